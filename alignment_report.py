@@ -0,0 +1,226 @@
+"""
+Align the reference and the prediction of every utterance word by word and report the most frequent substitutions, deletions and insertions of the corpus
+"""
+
+import os
+import json
+import numpy as np
+from rapidfuzz.distance import Levenshtein, Opcodes
+from tqdm import tqdm
+from typing import Dict, List, Optional, Tuple
+
+from wer_scorer import to_words
+from manifest_io import ManifestWriter, iter_manifest
+
+
+class AlignmentReport:
+
+    '''
+    word alignment and confusion report of a manifest, the words are encoded as integers once so the edit distance and the counting run on ints
+
+    the alignment is the one jiwer shows (the same levenshtein edit operations and the same tokenisation), so the counts match the WER of wer_scorer
+    '''
+
+    def __init__(
+        self,
+        manifest_path: str,
+        ref_key: str='text',
+        pred_key: str='pred_str',
+        top_n: int=50,
+        alignment_output_path: str=None,
+    ) -> None:
+
+        '''
+        manifest_path: NeMo manifest with the reference and the prediction of every utterance
+        ref_key, pred_key: the keys of the reference and the prediction
+        top_n: number of confusion pairs, deleted and inserted words in the report
+        alignment_output_path: if set, the aligned (ref, hyp) word pairs of every utterance are written there as json lines, null marks a gap
+        '''
+
+        self.manifest_path = manifest_path
+        self.ref_key = ref_key
+        self.pred_key = pred_key
+        self.top_n = top_n
+        self.alignment_output_path = alignment_output_path
+
+        self.vocabulary = {}
+        self.words = []
+
+
+    def encode(self, words: List[str]) -> List[int]:
+        vocabulary = self.vocabulary
+        ids = []
+
+        for word in words:
+            word_id = vocabulary.get(word)
+            if word_id is None:
+                word_id = vocabulary[word] = len(self.words)
+                self.words.append(word)
+            ids.append(word_id)
+
+        return ids
+
+
+    @staticmethod
+    def opcodes(ref_ids: List[int], hyp_ids: List[int]) -> Opcodes:
+        return Opcodes.from_editops(Levenshtein.editops(ref_ids, hyp_ids))
+
+
+    @staticmethod
+    def align(ref_ids: List[int], hyp_ids: List[int], opcodes: Opcodes=None) -> List[Tuple[Optional[int], Optional[int]]]:
+
+        '''
+        returns: the aligned (ref, hyp) pairs of a single utterance, None on the side of a deletion or an insertion
+        '''
+
+        pairs = []
+
+        for op in opcodes if opcodes is not None else AlignmentReport.opcodes(ref_ids, hyp_ids):
+            if op.tag == 'delete':
+                pairs.extend((ref_id, None) for ref_id in ref_ids[op.src_start:op.src_end])
+            elif op.tag == 'insert':
+                pairs.extend((None, hyp_id) for hyp_id in hyp_ids[op.dest_start:op.dest_end])
+            else:
+                pairs.extend(zip(ref_ids[op.src_start:op.src_end], hyp_ids[op.dest_start:op.dest_end]))
+
+        return pairs
+
+
+    def top_counts(self, keys: List[int], num_columns: int=1) -> List[Tuple[Tuple[int, ...], int]]:
+
+        '''
+        most frequent keys, ties broken by the key so the report is deterministic
+        ---
+        keys: word ids, num_columns ids per entry flattened
+        ---
+        returns: [(ids, count), ...] of the top_n keys
+        '''
+
+        if not keys:
+            return []
+
+        ids = np.array(keys, dtype=np.int64).reshape(-1, num_columns)
+        unique, counts = np.unique(ids, axis=0, return_counts=True)
+        # np.unique sorts the keys, a stable sort on the counts keeps them sorted among the ties
+        order = np.argsort(-counts, kind='stable')[:self.top_n]
+
+        return [(tuple(int(word_id) for word_id in unique[idx]), int(counts[idx])) for idx in order]
+
+
+    def build(self) -> Dict:
+
+        '''
+        align the whole manifest
+        ---
+        returns: the report, with the totals and the top substitutions, deletions and insertions
+        '''
+
+        substitutions, deletions, insertions = [], [], []
+        hits = num_utterances = num_ref_words = 0
+
+        f_out = ManifestWriter(self.alignment_output_path) if self.alignment_output_path else None
+
+        try:
+            for entry in tqdm(iter_manifest(self.manifest_path)):
+                ref_ids = self.encode(to_words(entry[self.ref_key]))
+                hyp_ids = self.encode(to_words(entry[self.pred_key]))
+
+                opcodes = self.opcodes(ref_ids, hyp_ids)
+
+                for op in opcodes:
+                    if op.tag == 'equal':
+                        hits += op.src_end - op.src_start
+                    elif op.tag == 'replace':
+                        for ref_id, hyp_id in zip(ref_ids[op.src_start:op.src_end], hyp_ids[op.dest_start:op.dest_end]):
+                            substitutions.extend((ref_id, hyp_id))
+                    elif op.tag == 'delete':
+                        deletions.extend(ref_ids[op.src_start:op.src_end])
+                    else:
+                        insertions.extend(hyp_ids[op.dest_start:op.dest_end])
+
+                if f_out is not None:
+                    alignment = [
+                        [None if ref_id is None else self.words[ref_id], None if hyp_id is None else self.words[hyp_id]]
+                        for ref_id, hyp_id in self.align(ref_ids, hyp_ids, opcodes)
+                    ]
+                    f_out.write({'audio_filepath': entry.get('audio_filepath'), 'alignment': alignment})
+
+                num_utterances += 1
+                num_ref_words += len(ref_ids)
+        finally:
+            if f_out is not None:
+                f_out.close()
+
+        counts = {
+            'hits': hits,
+            'substitutions': len(substitutions) // 2,
+            'deletions': len(deletions),
+            'insertions': len(insertions),
+        }
+
+        return {
+            'num_utterances': num_utterances,
+            'num_ref_words': num_ref_words,
+            'counts': counts,
+            'wer': (counts['substitutions'] + counts['deletions'] + counts['insertions']) / num_ref_words if num_ref_words else None,
+            'top_substitutions': [
+                {'ref': self.words[ref_id], 'hyp': self.words[hyp_id], 'count': count}
+                for (ref_id, hyp_id), count in self.top_counts(substitutions, num_columns=2)
+            ],
+            'top_deletions': [{'word': self.words[word_id], 'count': count} for (word_id,), count in self.top_counts(deletions)],
+            'top_insertions': [{'word': self.words[word_id], 'count': count} for (word_id,), count in self.top_counts(insertions)],
+        }
+
+
+    @staticmethod
+    def write_json(report: Dict, output_path: str) -> None:
+        with open(output_path, 'w+', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+    @staticmethod
+    def write_tsv(report: Dict, output_path: str) -> None:
+
+        '''
+        one row per reported error: type, ref word, hyp word, count
+        '''
+
+        with open(output_path, 'w+', encoding='utf-8') as f:
+            f.write('type\tref\thyp\tcount\n')
+            for row in report['top_substitutions']:
+                f.write(f"substitution\t{row['ref']}\t{row['hyp']}\t{row['count']}\n")
+            for row in report['top_deletions']:
+                f.write(f"deletion\t{row['word']}\t\t{row['count']}\n")
+            for row in report['top_insertions']:
+                f.write(f"insertion\t\t{row['word']}\t{row['count']}\n")
+
+
+    def __call__(self, report_path: str=None) -> Dict:
+
+        '''
+        build the report, and write it as json to report_path and as tsv next to it if given
+        '''
+
+        report = self.build()
+
+        if report_path is not None:
+            self.write_json(report, report_path)
+            self.write_tsv(report, os.path.splitext(report_path)[0] + '.tsv')
+
+        return report
+
+
+if __name__ == '__main__':
+
+    ROOT = '/datasets/mms/transcribed/mms_transcribed_batch_2/test_split/'
+    MANIFEST_PATH = 'test_manifest_495_with_pred.json'
+    REPORT_PATH = 'test_manifest_495_alignment_report.json'
+    ALIGNMENT_PATH = 'test_manifest_495_alignment.json'
+
+    report = AlignmentReport(
+        manifest_path=os.path.join(ROOT, MANIFEST_PATH),
+        top_n=50,
+        alignment_output_path=os.path.join(ROOT, ALIGNMENT_PATH),
+    )(report_path=os.path.join(ROOT, REPORT_PATH))
+
+    print(json.dumps({key: report[key] for key in ('num_utterances', 'counts', 'wer')}, indent=2))
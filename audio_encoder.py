@@ -0,0 +1,191 @@
+"""
+Compress the wav files before they are uploaded to whisper zero, flac by default so the transcription is not affected
+"""
+
+import os
+import time
+import tempfile
+import threading
+import soundfile as sf
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, IO
+
+# codec name -> (soundfile format, soundfile subtype, mime type, file extension, lossless)
+CODECS = {
+    'flac': ('FLAC', None, 'audio/flac', '.flac', True),
+    'ogg': ('OGG', 'VORBIS', 'audio/ogg', '.ogg', False),
+    'opus': ('OGG', 'OPUS', 'audio/ogg', '.opus', False),
+    'mp3': ('MP3', 'MPEG_LAYER_III', 'audio/mpeg', '.mp3', False),
+}
+
+# flac only stores integer samples up to 24 bits, the other subtypes (PCM_32, FLOAT, DOUBLE, ...) are uploaded as they are rather than
+# truncated, so flac stays lossless
+FLAC_SUBTYPES = {
+    'PCM_U8': 'PCM_S8',
+    'PCM_S8': 'PCM_S8',
+    'PCM_16': 'PCM_16',
+    'PCM_24': 'PCM_24',
+}
+
+
+class EncodedAudio:
+
+    '''
+    an encoded audio file ready to be uploaded, held in memory up to the spool size and on disk beyond it
+    '''
+
+    def __init__(self, f: IO[bytes], filename: str, mime_type: str, bytes_before: int, bytes_after: int, encode_seconds: float) -> None:
+        self.f = f
+        self.filename = filename
+        self.mime_type = mime_type
+        self.bytes_before = bytes_before
+        self.bytes_after = bytes_after
+        self.encode_seconds = encode_seconds
+
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class AudioEncoder:
+
+    '''
+    encodes the audio into a compressed format in a pool of worker threads, libsndfile releases the gil so the encoding runs alongside the uploads
+    '''
+
+    def __init__(self, codec: str='flac', compression_level: float=None, workers: int=2, spool_max_bytes: int=32 * 1024**2) -> None:
+
+        '''
+        codec: one of 'flac', 'ogg', 'opus' or 'mp3', only flac is lossless
+        compression_level: between 0 and 1, higher is smaller (and lower quality for the lossy codecs), None uses the libsndfile default
+        workers: number of encoding threads
+        spool_max_bytes: encoded files bigger than this are spooled to a temp file instead of memory
+        '''
+
+        if codec not in CODECS:
+            raise ValueError(f'codec must be one of {list(CODECS)}, got {codec}')
+
+        self.codec = codec
+        self.format, self.subtype, self.mime_type, self.extension, self.lossless = CODECS[codec]
+        self.compression_level = compression_level
+        self.spool_max_bytes = spool_max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+        self.lock = threading.Lock()
+        self.files_encoded = 0
+        self.total_bytes_before = 0
+        self.total_bytes_after = 0
+        self.total_encode_seconds = 0.0
+        self.files_passed_through = 0
+
+
+    def cache_params(self) -> Dict:
+
+        '''
+        returns: the encoding parameters that can change the transcription, to be added to the response cache key
+        '''
+
+        if self.lossless:
+            return {}
+
+        return {'codec': self.codec, 'compression_level': self.compression_level}
+
+
+    def encode(self, input_audio_path: str) -> EncodedAudio:
+
+        '''
+        encode a single audio file
+        '''
+
+        start = time.perf_counter()
+
+        info = sf.info(input_audio_path)
+
+        if self.format == 'FLAC' and info.subtype not in FLAC_SUBTYPES:
+            return self.pass_through(input_audio_path, start)
+
+        subtype = self.subtype if self.format != 'FLAC' else FLAC_SUBTYPES[info.subtype]
+
+        # int32 keeps the full precision of the integer pcm formats
+        data, sample_rate = sf.read(input_audio_path, dtype='int32' if self.format == 'FLAC' else 'float32', always_2d=True)
+
+        f = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        kwargs = {} if self.compression_level is None else {'compression_level': self.compression_level}
+        sf.write(f, data, sample_rate, format=self.format, subtype=subtype, **kwargs)
+
+        # libsndfile seeks back to patch the header, so measure from the end
+        f.seek(0, os.SEEK_END)
+        bytes_after = f.tell()
+        f.seek(0)
+
+        encoded = EncodedAudio(
+            f=f,
+            filename=os.path.splitext(os.path.basename(input_audio_path))[0] + self.extension,
+            mime_type=self.mime_type,
+            bytes_before=os.path.getsize(input_audio_path),
+            bytes_after=bytes_after,
+            encode_seconds=time.perf_counter() - start,
+        )
+
+        with self.lock:
+            self.files_encoded += 1
+            self.total_bytes_before += encoded.bytes_before
+            self.total_bytes_after += encoded.bytes_after
+            self.total_encode_seconds += encoded.encode_seconds
+
+        return encoded
+
+
+    def pass_through(self, input_audio_path: str, start: float) -> EncodedAudio:
+
+        '''
+        the audio file as it is, for the samples flac cannot hold without loss
+        '''
+
+        size = os.path.getsize(input_audio_path)
+        encoded = EncodedAudio(
+            f=open(input_audio_path, 'rb'),
+            filename=os.path.basename(input_audio_path),
+            # the same as the unencoded uploads of GladiaClient
+            mime_type='audio/wav',
+            bytes_before=size,
+            bytes_after=size,
+            encode_seconds=time.perf_counter() - start,
+        )
+
+        with self.lock:
+            self.files_passed_through += 1
+            self.total_bytes_before += size
+            self.total_bytes_after += size
+
+        return encoded
+
+
+    def submit(self, input_audio_path: str) -> 'Future[EncodedAudio]':
+
+        '''
+        encode a single audio file on the worker pool
+        '''
+
+        return self.executor.submit(self.encode, input_audio_path)
+
+
+    def stats(self) -> Dict:
+
+        '''
+        returns: the number of files encoded and of files uploaded as they are, the bytes before and after and the time spent encoding
+        '''
+
+        return {
+            'codec': self.codec,
+            'files': self.files_encoded,
+            'files_passed_through': self.files_passed_through,
+            'bytes_before': self.total_bytes_before,
+            'bytes_after': self.total_bytes_after,
+            'ratio': self.total_bytes_after / self.total_bytes_before if self.total_bytes_before else None,
+            'encode_seconds': round(self.total_encode_seconds, 3),
+        }
+
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
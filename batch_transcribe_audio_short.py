@@ -3,13 +3,30 @@ Read in a manifest file and get all the required audio filepaths, then do a post
 """
 
 import os
-import requests
-import time
-import json
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from tqdm import tqdm
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 
+from rate_limiter import TokenBucket
+from jsonl_checkpoint import JSONLCheckpoint
+from response_cache import ResponseCache
+from gladia_client import GLADIA_API_URL, GladiaClient, TranscriptionError
+from audio_encoder import AudioEncoder, EncodedAudio
+from request_packing import PackedTranscribeShortAudio
+from request_telemetry import RequestTelemetry
+from manifest_io import load_manifest
+from sharding import check_shard, select_shard, shard_path
+from scheduling import DEFAULT_RTF, POLICIES, clip_duration, estimate_makespan, order_jobs, previous_rtf
+
+# Setup logging in a nice readable format
+logging.basicConfig(level=logging.INFO,
+                    format='[%(levelname)5s][%(asctime)s][%(name)s]: %(message)s',
+                    datefmt='%H:%M:%S')
+
 class BatchTranscribeAudio:
 
     '''
@@ -19,95 +36,452 @@ class BatchTranscribeAudio:
     def __init__(
         self,
         audio_root_path: str,
-        input_manifest_path: str,
+        input_manifest_path: Optional[str],
         output_manifest_path: str,
         language: str, 
+        *,
+        max_in_flight: int=1,
+        requests_per_second: float=1.0,
+        api_url: str=GLADIA_API_URL,
+        checkpoint_path: str=None,
+        fsync_every: int=20,
+        cache_dir: str=None,
+        cache_max_bytes: int=2 * 1024**3,
+        cache_mode: str='use',
+        max_retries: int=5,
+        read_timeout: float=600.0,
+        encode_codec: str=None,
+        encode_compression_level: float=None,
+        encode_workers: int=2,
+        telemetry_path: str=None,
+        shard_index: int=0,
+        num_shards: int=1,
+        schedule: str='longest_first',
+        estimated_rtf: float=None,
+        pack_clips: int=1,
+        pack_max_seconds: float=60.0,
+        pack_gap_seconds: float=1.0,
     ) -> None:
         
         """
         audio_root_path: the root path of where the audio files reside
-        input_manifest_path: manifest file to obtain the filepath of the audio files, nemo format
+        input_manifest_path: manifest file to obtain the filepath of the audio files, nemo format, only read by batch_transcribe_audio,
+            None when the entries are given to transcribe directly
         output_manifest_path: raw manifest output from whisper zero
         language: target language of the audio clips 
+        max_in_flight: maximum number of requests sent to the api at the same time, 1 runs the clips one after another
+        requests_per_second: rate of the token bucket that throttles the requests, <= 0 disables the throttling
+        api_url: endpoint of the transcription api, can be pointed to a local stand-in server for testing
+        checkpoint_path: jsonl file the responses are appended to as they arrive, defaults to <output_manifest_path>.jsonl, a rerun skips the clips already in it
+        fsync_every: number of responses written to the checkpoint before it is fsync'd to disk
+        cache_dir: directory of the response cache keyed by the audio bytes and request parameters, None disables the cache
+        cache_max_bytes: size of the response cache before the least recently used responses are evicted
+        cache_mode: 'use', 'bypass' or 'refresh' the response cache
+        max_retries: number of retries of a clip on network errors, 429 and 5xx responses
+        read_timeout: seconds to wait for the response of a single clip
+        encode_codec: compress the audio before the upload, 'flac' (lossless), 'ogg', 'opus' or 'mp3', None uploads the raw wav
+        encode_compression_level: between 0 and 1, higher is smaller, None uses the codec default
+        encode_workers: number of threads encoding the audio ahead of the uploads
+        telemetry_path: json summary of the request latencies, sizes, statuses and retries written at the end of the run, defaults to
+            <output_manifest_path>.telemetry.json, the prometheus text file (.prom) and the per-request json lines (.requests.jsonl) go next to it
+        shard_index, num_shards: only transcribe the entries of this shard of the manifest (see sharding.py), the outputs of the shards are
+            merged back in manifest order with sharding.ShardMerger
+        schedule: order the clips are sent in, 'longest_first', 'shortest_first' or 'manifest', the output is in manifest order regardless
+        estimated_rtf: seconds of request per second of audio for the estimate of the run time, None takes the median of the earlier run
+            in telemetry_path if there is one
+        pack_clips: number of clips joined into one upload and split back afterwards, 1 sends every clip on its own, see request_packing.py
+        pack_max_seconds: length of a pack at most, gaps included
+        pack_gap_seconds: silence put between the clips of a pack
         """
 
+        check_shard(shard_index, num_shards)
+        if schedule not in POLICIES:
+            raise ValueError(f'unknown schedule {schedule}, expects one of {", ".join(POLICIES)}')
+
         self.audio_root_path = audio_root_path
         self.input_manifest_path = input_manifest_path
         self.output_manifest_path = output_manifest_path
         self.language = language
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.max_in_flight = max(1, max_in_flight)
+        self.requests_per_second = requests_per_second
+        self.schedule = schedule
+        self.estimated_rtf = estimated_rtf
+        self.durations = {}
+        self.checkpoint_path = checkpoint_path if checkpoint_path is not None else f'{output_manifest_path}.jsonl'
+        self.fsync_every = fsync_every
+        self.cache = ResponseCache(cache_dir=cache_dir, max_bytes=cache_max_bytes, mode=cache_mode) if cache_dir is not None else None
+        self.failed_list = []
+        self.encode_workers = max(1, encode_workers)
+        self.encoder = AudioEncoder(
+            codec=encode_codec,
+            compression_level=encode_compression_level,
+            workers=self.encode_workers,
+        ) if encode_codec is not None else None
+
+        self.telemetry_path = telemetry_path if telemetry_path is not None else f'{output_manifest_path}.telemetry.json'
+        self.telemetry = RequestTelemetry(records_path=os.path.splitext(self.telemetry_path)[0] + '.requests.jsonl')
 
         load_dotenv()
-        self.headers = {
-            'x-gladia-key': os.environ.get("API_KEY"),
-        }
+        self.client = GladiaClient(
+            api_url=api_url,
+            read_timeout=read_timeout,
+            max_retries=max_retries,
+            pool_maxsize=self.max_in_flight,
+            rate_limiter=TokenBucket(rate=requests_per_second),
+            cache=self.cache,
+            encoder=self.encoder,
+            telemetry=self.telemetry,
+        )
+
+        self.packer = PackedTranscribeShortAudio(
+            client=self.client,
+            language=self.language,
+            max_clips=pack_clips,
+            max_pack_seconds=pack_max_seconds,
+            gap_seconds=pack_gap_seconds,
+        ) if pack_clips > 1 else None
 
 
     def load_manifest_nemo(self, input_manifest_path: str) -> List[Dict[str, str]]:
 
         '''
-        loads the manifest file in Nvidia NeMo format to process the entries and store them into a list of dictionaries
+        loads the manifest file in Nvidia NeMo format into a list of dictionaries, see manifest_io.load_manifest
+        '''
 
-        the manifest file would contain entries in this format:
+        return load_manifest(input_manifest_path)
 
-        {"audio_filepath": "subdir1/xxx1.wav", "duration": 3.0, "text": "shan jie is an orange cat"}
-        {"audio_filepath": "subdir1/xxx2.wav", "duration": 4.0, "text": "shan jie's orange cat is chonky"}
-        ---
 
-        input_manifest_path: the manifest path that contains the information of the audio clips of interest
+    def duration_of(self, entry: Dict) -> float:
+
+        '''
+        duration of the clip from the manifest or its wav header, read once per clip
+        '''
+
+        audio_filepath = entry['audio_filepath']
+        if audio_filepath not in self.durations:
+            self.durations[audio_filepath] = clip_duration(entry, audio_root_path=self.audio_root_path)
+
+        return self.durations[audio_filepath]
+
+
+    def schedule_jobs(self, manifest_list: List[Dict[str, str]]) -> List[Dict[str, str]]:
+
+        '''
+        order the clips by the schedule policy and print the audio hours and the expected run time before anything is sent
         ---
-        returns: a list of dictionaries of the information in the input manifest file
+        returns: the entries in the order they should be sent
         '''
 
-        dict_list = []
+        durations = [self.duration_of(entry) for entry in manifest_list]
+        order = order_jobs(manifest_list, durations, policy=self.schedule)
+
+        rtf = self.estimated_rtf
+        if rtf is None:
+            rtf = previous_rtf(self.telemetry_path)
+        if rtf is None:
+            rtf = DEFAULT_RTF
+
+        expected = estimate_makespan(
+            [durations[idx] for idx in order],
+            rtf=rtf,
+            workers=self.max_in_flight,
+            requests_per_second=self.requests_per_second,
+        )
+
+        if manifest_list:
+            print(
+                f'{len(manifest_list)} clips, {sum(durations) / 3600:.2f} audio hours, longest {max(durations):.1f}s, '
+                f'schedule {self.schedule}, expected run time {expected / 60:.1f} min at rtf {rtf:.3f}'
+            )
+
+        return [manifest_list[idx] for idx in order]
+
+
+    def progress_bar(self, manifest_list: List[Dict[str, str]]) -> tqdm:
+
+        '''
+        progress in seconds of audio transcribed, so the rate is in audio seconds per second
+        '''
+
+        return tqdm(total=sum(self.duration_of(entry) for entry in manifest_list), unit=' audio s', unit_scale=True)
+
+
+    @staticmethod
+    def advance(progress: tqdm, seconds: float) -> None:
+        # the float sums of the updates can overshoot the total by a rounding error
+        progress.update(min(seconds, progress.total - progress.n))
+
+
+    def transcribe_audio(self, input_audio_path: str, encoded: 'Future[EncodedAudio]'=None, duration: float=None) -> Dict:
+
+        """
+        method to transcribe a single audio file, raises TranscriptionError if it fails after the retries
+
+        duration is the manifest duration of the clip, for the telemetry
+        """
+
+        response = self.client.transcribe(
+            input_audio_path=input_audio_path,
+            language=self.language,
+            language_behaviour='manual',
+            toggle_diarization=True,
+            encoded=encoded,
+            duration=duration,
+        )
+
+        return response
+
+
+    def transcribe_entry(self, entry: Dict[str, str], encoded: 'Future[EncodedAudio]'=None) -> Optional[Dict]:
+
+        """
+        transcribe the audio clip of a single manifest entry and tag the response with its audio filepath
+
+        returns None if the clip failed, an auth failure is raised straight away as every other clip would fail the same way
+        """
+
+        try:
+            response = self.transcribe_audio(
+                input_audio_path=os.path.join(self.audio_root_path, entry['audio_filepath']),
+                encoded=encoded,
+                duration=self.duration_of(entry),
+            )
+        except TranscriptionError as e:
+            if e.kind == 'auth':
+                raise
+
+            logging.getLogger('ERROR').error(f"{entry['audio_filepath']}: {e}")
+            self.failed_list.append(entry['audio_filepath'])
+            return None
+
+        response['audio_filepath'] = entry['audio_filepath']
+
+        return response
+
+
+    def transcribe_pack(self, entries: List[Dict[str, str]], pack_filepath: str) -> List[Optional[Dict]]:
+
+        """
+        transcribe the clips of the manifest entries in one request and tag the responses with their audio filepaths
+
+        returns None for every clip of a failed pack, an auth failure is raised straight away
+        """
+
+        try:
+            responses = self.packer(
+                audio_filepaths=[os.path.join(self.audio_root_path, entry['audio_filepath']) for entry in entries],
+                pack_filepath=pack_filepath,
+            )
+        except TranscriptionError as e:
+            if e.kind == 'auth':
+                raise
+
+            for entry in entries:
+                logging.getLogger('ERROR').error(f"{entry['audio_filepath']}: {e}")
+                self.failed_list.append(entry['audio_filepath'])
+            return [None] * len(entries)
+
+        for response, entry in zip(responses, entries):
+            response['audio_filepath'] = entry['audio_filepath']
+
+        return responses
+
 
-        with open(input_manifest_path, 'rb') as f:
-            for line in f:
-                dict_list.append(json.loads(line))
+    def iter_jobs(self, manifest_list: List[Dict[str, str]]) -> Iterator[Tuple[Dict[str, str], Optional['Future[EncodedAudio]']]]:
+
+        """
+        pair every manifest entry with its encoding job, the encoder works ahead of the uploads by a few clips so the encoding overlaps the requests in flight
+        """
 
-        return dict_list
+        if self.encoder is None:
+            for entry in manifest_list:
+                yield entry, None
+            return
 
+        lookahead = self.max_in_flight + self.encode_workers
+        pending = deque()
 
-    def transcribe_audio(self, input_audio_path: str) -> Dict:
+        for entry in manifest_list:
+            pending.append((entry, self.encoder.submit(os.path.join(self.audio_root_path, entry['audio_filepath']))))
+
+            if len(pending) > lookahead:
+                yield pending.popleft()
+
+        while pending:
+            yield pending.popleft()
+
+
+    def transcribe_serial(self, manifest_list: List[Dict[str, str]]) -> Iterator[Dict]:
 
         """
-        method to transcribe a single audio file
+        transcribe the manifest entries one after another, yields the responses in the order of the list
         """
 
-        with open(input_audio_path, 'rb') as f:
-            files = {
-                'audio': (input_audio_path, f, 'audio/wav'),
-                'toggle_diarization': (None, True),
-                'language_behaviour': 'manual',
-                'language': self.language,
-            }
+        with self.progress_bar(manifest_list) as progress:
+            for entry, encoded in self.iter_jobs(manifest_list):
+                response = self.transcribe_entry(entry=entry, encoded=encoded)
+                self.advance(progress, self.duration_of(entry))
+                yield response
+
+
+    def transcribe_concurrent(self, manifest_list: List[Dict[str, str]]) -> Iterator[Dict]:
 
-            response = requests.post('https://api.gladia.io/audio/text/audio-transcription/', headers=self.headers, files=files)
-            time.sleep(1.0)
-            
-            print(response.json())
-            return response.json()
+        """
+        transcribe the manifest entries with up to max_in_flight requests at the same time, yields the responses in the order they complete
+
+        only a couple of clips per worker are queued at a time, so the encoder and the memory use stay just ahead of the uploads
+        """
+
+        progress = self.progress_bar(manifest_list)
+        futures = set()
+        entries = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            try:
+                for entry, encoded in self.iter_jobs(manifest_list):
+                    if len(futures) >= 2 * self.max_in_flight:
+                        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.advance(progress, self.duration_of(entries.pop(future)))
+                            yield future.result()
+
+                    future = executor.submit(self.transcribe_entry, entry, encoded)
+                    futures.add(future)
+                    entries[future] = entry
+
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.advance(progress, self.duration_of(entries.pop(future)))
+                        yield future.result()
+            finally:
+                # on failure, do not send the requests that have not started yet
+                for future in futures:
+                    future.cancel()
+                progress.close()
         
 
+    def transcribe_packed(self, manifest_list: List[Dict[str, str]]) -> Iterator[Dict]:
+
+        """
+        transcribe the manifest entries in packs, with up to max_in_flight packs sent at the same time, yields the responses of the clips as their pack completes
+
+        the packs are cut from the list in order, so clips of similar length end up together with the longest first schedule
+        """
+
+        packs = self.packer.plan_packs([os.path.join(self.audio_root_path, entry['audio_filepath']) for entry in manifest_list])
+        logging.getLogger('INFO').info(f'{len(manifest_list)} clips packed into {len(packs)} requests')
+
+        progress = self.progress_bar(manifest_list)
+        futures = set()
+        pack_entries = {}
+
+        def finished(done: set) -> Iterator[Dict]:
+            for future in done:
+                entries = pack_entries.pop(future)
+                self.advance(progress, sum(self.duration_of(entry) for entry in entries))
+                yield from future.result()
+
+        with tempfile.TemporaryDirectory() as tmp_dir, ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            try:
+                for idx, pack in enumerate(packs):
+                    if len(futures) >= 2 * self.max_in_flight:
+                        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                        yield from finished(done)
+
+                    entries = [manifest_list[position] for position in pack]
+                    future = executor.submit(self.transcribe_pack, entries, os.path.join(tmp_dir, f'pack_{idx:06d}.wav'))
+                    futures.add(future)
+                    pack_entries[future] = entries
+
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    yield from finished(done)
+            finally:
+                for future in futures:
+                    future.cancel()
+                progress.close()
+
+
+    def transcribe(self, manifest_list: List[Dict[str, str]]) -> Iterator[Dict]:
+
+        """
+        transcribe the manifest entries in packs, concurrently or one after another depending on the settings, None is yielded for a failed clip
+        """
+
+        if self.packer is not None:
+            return self.transcribe_packed(manifest_list=manifest_list)
+
+        if self.max_in_flight > 1:
+            return self.transcribe_concurrent(manifest_list=manifest_list)
+
+        return self.transcribe_serial(manifest_list=manifest_list)
+
+
     def batch_transcribe_audio(self) -> None:
 
         """
         batch transcribe the audio files from manifest
+
+        every response is appended to the checkpoint as soon as it arrives, the output file is only built from the checkpoint at the end
         """
 
+        if self.input_manifest_path is None:
+            raise ValueError('batch_transcribe_audio needs an input_manifest_path, transcribe takes the entries directly')
+
         # read the nemo json file
         manifest_list = self.load_manifest_nemo(input_manifest_path=self.input_manifest_path)
+        manifest_list = select_shard(manifest_list, shard_index=self.shard_index, num_shards=self.num_shards)
 
-        output_json_list = []
+        checkpoint = JSONLCheckpoint(checkpoint_path=self.checkpoint_path, fsync_every=self.fsync_every)
 
-        for entry in tqdm(manifest_list):
-            response = self.transcribe_audio(input_audio_path=os.path.join(self.audio_root_path, entry['audio_filepath']))
-            response['audio_filepath'] = entry['audio_filepath']
+        # skip the clips that were transcribed by a previous run
+        completed = checkpoint.load_completed()
+        pending_list = [entry for entry in manifest_list if entry['audio_filepath'] not in completed]
+
+        if completed:
+            print(f'resuming from {self.checkpoint_path}: {len(manifest_list) - len(pending_list)} done, {len(pending_list)} to go')
+
+        pending_list = self.schedule_jobs(pending_list)
+
+        responses = self.transcribe(manifest_list=pending_list)
 
-            output_json_list.append(response)
+        try:
+            with checkpoint:
+                for response in responses:
+                    # failed clips are left out of the checkpoint so a rerun retries them
+                    if response is not None:
+                        checkpoint.append(response)
+        finally:
+            if self.cache is not None:
+                print(f'response cache: {self.cache.stats()}')
 
-        # export file
-        with open(self.output_manifest_path, "w") as f:
-            json.dump(output_json_list, f, indent=2)
+            if self.encoder is not None:
+                print(f'audio encoding: {self.encoder.stats()}')
+
+            summary = self.telemetry.write(summary_path=self.telemetry_path)
+            self.telemetry.close()
+            if summary['requests']:
+                print(
+                    f"requests: {summary['requests']}, failed: {summary['failed']}, retries: {summary['retries']}, "
+                    f"latency p50/p95: {summary['latency']['p50']:.2f}/{summary['latency']['p95']:.2f}s, telemetry: {self.telemetry_path}"
+                )
+
+            self.client.close()
+
+        if self.failed_list:
+            raise RuntimeError(
+                f'{len(self.failed_list)} clips failed to transcribe, rerun to retry them, '
+                f'the completed responses are kept in {self.checkpoint_path}'
+            )
+
+        # export file in manifest order, same format as before for CombineManifest
+        checkpoint.finalise(
+            output_path=self.output_manifest_path,
+            keys=(entry['audio_filepath'] for entry in manifest_list)
+        )
 
 
     def __call__(self):
@@ -120,9 +494,24 @@ if __name__ == '__main__':
     INPUT_MANIFEST = 'test_manifest_495.json'
     OUTPUT_MANIFEST = 'test_manifest_495_output_whisper_zero.json'
 
+    # set by the job scheduler when the manifest is split over several workers, e.g. a slurm array task, then merge the shard
+    # outputs with: python sharding.py merge <input manifest> <output manifest> <shard outputs>
+    NUM_SHARDS = int(os.environ.get('NUM_SHARDS', 1))
+    SHARD_INDEX = int(os.environ.get('SHARD_INDEX', 0))
+
+    output_manifest_path = os.path.join(ROOT, OUTPUT_MANIFEST)
+    if NUM_SHARDS > 1:
+        output_manifest_path = shard_path(output_manifest_path, SHARD_INDEX, NUM_SHARDS)
+
     b = BatchTranscribeAudio(
         audio_root_path=ROOT,
         input_manifest_path=os.path.join(ROOT, INPUT_MANIFEST),
-        output_manifest_path=os.path.join(ROOT, OUTPUT_MANIFEST),
+        output_manifest_path=output_manifest_path,
         language="english", 
+        max_in_flight=8,
+        requests_per_second=4.0,
+        cache_dir=os.path.join(ROOT, '.whisper_zero_cache'),
+        encode_codec='flac',
+        shard_index=SHARD_INDEX,
+        num_shards=NUM_SHARDS,
     )()
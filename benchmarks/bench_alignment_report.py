@@ -0,0 +1,44 @@
+"""
+Time the alignment report on a 100k utterance manifest against jiwer.process_words, which aligns the same way but keeps every alignment in memory
+
+run from the repository root: python -m benchmarks.bench_alignment_report
+"""
+
+import os
+import json
+import time
+import tempfile
+import jiwer
+
+from alignment_report import AlignmentReport
+from benchmarks.synthetic import write_scored_manifest
+
+
+if __name__ == '__main__':
+
+    NUM_UTTERANCES = 100_000
+
+    with tempfile.TemporaryDirectory() as root:
+        manifest_path = os.path.join(root, 'manifest.json')
+        write_scored_manifest(manifest_path, NUM_UTTERANCES, vocabulary_size=20_000, seed=2)
+
+        start = time.perf_counter()
+        report = AlignmentReport(manifest_path=manifest_path, top_n=20)(report_path=os.path.join(root, 'report.json'))
+        report_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        AlignmentReport(manifest_path=manifest_path, top_n=20, alignment_output_path=os.path.join(root, 'alignment.json'))()
+        alignment_time = time.perf_counter() - start
+
+        with open(manifest_path, 'rb') as f:
+            data = [json.loads(line) for line in f]
+        start = time.perf_counter()
+        expected = jiwer.process_words([entry['text'] for entry in data], [entry['pred_str'] for entry in data])
+        jiwer_time = time.perf_counter() - start
+
+        for key in ('hits', 'substitutions', 'deletions', 'insertions'):
+            assert report['counts'][key] == getattr(expected, key), f'{key} differs from jiwer'
+        assert report['wer'] == expected.wer
+
+        print(f'{NUM_UTTERANCES} utterances: report {report_time:.2f}s, with per-utterance alignments {alignment_time:.2f}s, jiwer.process_words (no report) {jiwer_time:.2f}s')
+        print(f"report: {os.path.getsize(os.path.join(root, 'report.json')) / 1024:.1f} kb json, {os.path.getsize(os.path.join(root, 'report.tsv')) / 1024:.1f} kb tsv")
@@ -0,0 +1,113 @@
+"""
+Compare the serial and the concurrent path of BatchTranscribeAudio against the local stand-in server
+
+run from the repository root: python -m benchmarks.bench_batch_transcribe
+"""
+
+import io
+import os
+import json
+import time
+import wave
+import tempfile
+import contextlib
+
+from batch_transcribe_audio_short import BatchTranscribeAudio
+from benchmarks.mock_gladia_server import start_mock_server
+
+
+def write_silent_wav(path: str, duration: float, sample_rate: int=16000) -> None:
+
+    '''
+    write a 16-bit mono wav file of silence
+    '''
+
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(b'\x00\x00' * int(duration * sample_rate))
+
+
+def build_dataset(root: str, num_clips: int) -> str:
+
+    '''
+    generate the audio clips and the nemo manifest, returns the manifest path
+    '''
+
+    manifest_path = os.path.join(root, 'manifest.json')
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        for idx in range(num_clips):
+            audio_filepath = f'clip_{idx:05d}.wav'
+            write_silent_wav(os.path.join(root, audio_filepath), duration=0.5)
+            f.write(json.dumps({"audio_filepath": audio_filepath, "duration": 0.5, "text": "word"}) + '\n')
+
+    return manifest_path
+
+
+def run(root: str, manifest_path: str, url: str, max_in_flight: int, requests_per_second: float) -> tuple:
+
+    '''
+    run one batch transcription
+    ---
+    returns: the wall clock time taken and the request telemetry summary of the run
+    '''
+
+    output_path = os.path.join(root, f'output_{max_in_flight}.json')
+
+    start = time.perf_counter()
+    # the transcriber prints its run summary, keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        BatchTranscribeAudio(
+            audio_root_path=root,
+            input_manifest_path=manifest_path,
+            output_manifest_path=output_path,
+            language='english',
+            max_in_flight=max_in_flight,
+            requests_per_second=requests_per_second,
+            api_url=url,
+        )()
+    elapsed = time.perf_counter() - start
+
+    # the output must stay in manifest order
+    with open(output_path, 'rb') as f:
+        outputs = [entry['audio_filepath'] for entry in json.load(f)]
+    assert outputs == [f'clip_{idx:05d}.wav' for idx in range(len(outputs))], 'output is not in manifest order'
+
+    with open(f'{output_path}.telemetry.json', 'rb') as f:
+        summary = json.load(f)
+    assert summary['requests'] == len(outputs), 'a request is missing from the telemetry'
+
+    return elapsed, summary
+
+
+if __name__ == '__main__':
+
+    NUM_CLIPS = 100
+    LATENCY = 0.2
+    FAILURE_RATE = 0.1
+    MAX_IN_FLIGHT = 16
+    REQUESTS_PER_SECOND = 50.0
+
+    server, url = start_mock_server(latency=LATENCY, failure_rate=FAILURE_RATE)
+
+    with tempfile.TemporaryDirectory() as root:
+        manifest_path = build_dataset(root=root, num_clips=NUM_CLIPS)
+
+        serial_time, serial_summary = run(root, manifest_path, url, max_in_flight=1, requests_per_second=REQUESTS_PER_SECOND)
+        concurrent_time, concurrent_summary = run(root, manifest_path, url, max_in_flight=MAX_IN_FLIGHT, requests_per_second=REQUESTS_PER_SECOND)
+
+    server.shutdown()
+
+    print(f'clips: {NUM_CLIPS}, latency: {LATENCY}s, failure rate: {FAILURE_RATE}, rate limit: {REQUESTS_PER_SECOND} req/s')
+    print(f'serial:                    {serial_time:.2f}s')
+    print(f'concurrent ({MAX_IN_FLIGHT} in flight): {concurrent_time:.2f}s')
+    print(f'speedup: {serial_time / concurrent_time:.1f}x')
+
+    for name, summary in (('serial', serial_summary), ('concurrent', concurrent_summary)):
+        print(
+            f"{name + ' telemetry:':<22} retries {summary['retries']}, status {summary['status_codes']}, "
+            f"ttfb p50 {summary['ttfb']['p50']:.3f}s, latency p50/p95 {summary['latency']['p50']:.3f}/{summary['latency']['p95']:.3f}s, "
+            f"total p95 {summary['total_seconds']['p95']:.3f}s, rtf p50 {summary['rtf']['p50']:.2f}"
+        )
@@ -0,0 +1,98 @@
+"""
+Compare the peak memory and runtime of the in-memory and the streaming ExtractSingleWord on synthetic whisper zero responses
+
+every run is done in a fresh subprocess so the peak rss of one run does not leak into the next
+
+run from the repository root: python -m benchmarks.bench_extract_single_word
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+from word_store import WordTimestampStore
+from benchmarks.synthetic import write_gladia_response
+
+
+def peak_rss_mb() -> float:
+
+    '''
+    peak resident memory of this process, ru_maxrss carries over the parent's peak across fork+exec so VmHWM is used on linux
+    '''
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(streaming: bool, input_manifest: str, output_manifest: str) -> None:
+
+    '''
+    run a single extraction and print the runtime and peak rss as json
+    '''
+
+    from extract_single_word_manifest_from_long_audio import ExtractSingleWord
+
+    devnull = open(os.devnull, 'w')
+    sys.stderr = devnull
+
+    start = time.perf_counter()
+    ExtractSingleWord(input_manifest=input_manifest, output_manifest=output_manifest, streaming=streaming)()
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+
+
+def run(streaming: bool, input_manifest: str, output_manifest: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_extract_single_word', 'child', str(int(streaming)), input_manifest, output_manifest],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'child':
+        child(streaming=bool(int(sys.argv[2])), input_manifest=sys.argv[3], output_manifest=sys.argv[4])
+        sys.exit(0)
+
+    NUM_WORDS_LIST = [10_000, 100_000, 1_000_000]
+
+    with tempfile.TemporaryDirectory() as root:
+        print(f"{'words':>10} {'response mb':>12} | {'in-memory s':>11} {'rss mb':>8} | {'streaming s':>11} {'rss mb':>8}")
+
+        for num_words in NUM_WORDS_LIST:
+            input_manifest = os.path.join(root, f'response_{num_words}.json')
+            write_gladia_response(input_manifest, num_words=num_words)
+
+            in_memory = run(False, input_manifest, os.path.join(root, 'in_memory.json'))
+            streaming = run(True, input_manifest, os.path.join(root, 'streaming.json'))
+
+            with open(os.path.join(root, 'in_memory.json'), 'rb') as a, open(os.path.join(root, 'streaming.json'), 'rb') as b:
+                assert a.read() == b.read(), 'streaming output differs from the in-memory output'
+
+            # the word store must convert back to the very same manifest
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+                store = WordTimestampStore.from_jsonl(os.path.join(root, 'streaming.json'), os.path.join(root, 'store'))
+                store.to_jsonl(os.path.join(root, 'round_trip.json'))
+            with open(os.path.join(root, 'streaming.json'), 'rb') as a, open(os.path.join(root, 'round_trip.json'), 'rb') as b:
+                assert a.read() == b.read(), 'the word store does not convert back to the ExtractSingleWord manifest'
+
+            print(
+                f"{num_words:>10} {os.path.getsize(input_manifest) / 1024**2:>12.1f} | "
+                f"{in_memory['seconds']:>11.2f} {in_memory['peak_rss_mb']:>8.1f} | "
+                f"{streaming['seconds']:>11.2f} {streaming['peak_rss_mb']:>8.1f}"
+            )
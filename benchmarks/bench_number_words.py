@@ -0,0 +1,77 @@
+"""
+Check EnglishNumberConverter against text2digits on a generated regression corpus and compare their speed
+
+run from the repository root: python -m benchmarks.bench_number_words
+"""
+
+import time
+import random
+import logging
+from text2digits import text2digits
+
+from number_words import EnglishNumberConverter
+from benchmarks.synthetic import make_number_text, make_text
+
+
+def reference_convert(text: str):
+
+    '''
+    text2digits as TextPostProcessingEN used it, a new converter per call, the exception name is returned instead of raised
+    '''
+
+    try:
+        return text2digits.Text2Digits().convert(text)
+    except Exception as e:
+        return type(e).__name__
+
+
+def converter_convert(converter: EnglishNumberConverter, text: str):
+    try:
+        return converter.convert(text)
+    except Exception as e:
+        return type(e).__name__
+
+
+def check_regression(num_sentences: int) -> None:
+    converter = EnglishNumberConverter()
+    failures = 0
+
+    for seed in range(num_sentences):
+        # the normalised text TextPostProcessingEN passes in, and text with the separators text2digits splits on
+        for punctuation in ('', ".,;:-_'#"):
+            text = make_number_text(random.Random(seed).randint(0, 12), seed=seed, punctuation=punctuation)
+            expected = reference_convert(text)
+            assert converter_convert(converter, text) == expected, f'{text!r}: expected {expected!r}'
+
+            # the call used by TextPostProcessingEN never raises, malformed numbers leave the text as it is
+            assert converter(text) == (text if expected == 'InvalidOperation' else expected)
+            failures += expected == 'InvalidOperation'
+
+    print(f'{2 * num_sentences} sentences match text2digits, {failures} of them malformed numbers')
+
+
+if __name__ == '__main__':
+
+    NUM_REGRESSION = 20_000
+    NUM_UTTERANCES = 5000
+
+    # the skipped malformed numbers are expected here
+    logging.getLogger('WARNING').setLevel(logging.ERROR)
+    check_regression(NUM_REGRESSION)
+
+    for name, texts in [
+        ('number dense', [make_number_text(15, seed=idx) for idx in range(NUM_UTTERANCES)]),
+        ('conversational', [make_text('en', 20, seed=idx) for idx in range(NUM_UTTERANCES)]),
+    ]:
+        start = time.perf_counter()
+        expected = [reference_convert(text) for text in texts]
+        reference_time = time.perf_counter() - start
+
+        # memo disabled so every sentence is parsed
+        converter = EnglishNumberConverter(memo_size=0)
+        start = time.perf_counter()
+        converted = [converter_convert(converter, text) for text in texts]
+        converter_time = time.perf_counter() - start
+
+        assert converted == expected
+        print(f'{name:>15}: text2digits {reference_time:.3f}s, converter {converter_time:.3f}s ({reference_time / converter_time:.1f}x)')
@@ -0,0 +1,126 @@
+"""
+Compare BatchTranscribeAudio sending every short clip on its own with packing the clips into fewer requests, against the local stand-in
+server echoing words timed on the uploaded audio, and check the packed responses split back into the same words per clip
+
+run from the repository root: python -m benchmarks.bench_packing
+"""
+
+import io
+import os
+import json
+import time
+import wave
+import random
+import tempfile
+import contextlib
+import numpy as np
+
+from batch_transcribe_audio_short import BatchTranscribeAudio
+from combine_manifest_short import CombineManifest
+from benchmarks.mock_gladia_server import start_mock_server
+
+
+def write_level_wav(path: str, duration: float, level: int, sample_rate: int=16000) -> None:
+
+    '''
+    write a 16-bit mono wav file of a constant sample value, the stand-in server names the words it echoes after it
+    '''
+
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(np.full(int(round(duration * sample_rate)), level, dtype='<i2').tobytes())
+
+
+def build_dataset(root: str, num_clips: int, seed: int=0) -> str:
+
+    '''
+    generate clips of 2 to 5 seconds, each of its own level, and the nemo manifest, returns the manifest path
+    '''
+
+    rng = random.Random(seed)
+    manifest_path = os.path.join(root, 'manifest.json')
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        for idx in range(num_clips):
+            # whole tenths of a second so the clips line up with the frames of the stand-in server
+            duration = rng.randint(20, 50) / 10
+            audio_filepath = f'clip_{idx:05d}.wav'
+            write_level_wav(os.path.join(root, audio_filepath), duration=duration, level=1000 + idx)
+            f.write(json.dumps({"audio_filepath": audio_filepath, "duration": duration, "text": "word"}) + '\n')
+
+    return manifest_path
+
+
+def run(root: str, manifest_path: str, url: str, pack_clips: int, max_in_flight: int) -> tuple:
+
+    '''
+    run one batch transcription
+    ---
+    returns: the wall clock time taken, the number of requests and the output path
+    '''
+
+    output_path = os.path.join(root, f'output_{pack_clips}.json')
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        BatchTranscribeAudio(
+            audio_root_path=root,
+            input_manifest_path=manifest_path,
+            output_manifest_path=output_path,
+            language='english',
+            max_in_flight=max_in_flight,
+            requests_per_second=0,
+            api_url=url,
+            pack_clips=pack_clips,
+        )()
+    elapsed = time.perf_counter() - start
+
+    with open(f'{output_path}.telemetry.json', 'rb') as f:
+        requests = json.load(f)['requests']
+
+    return elapsed, requests, output_path
+
+
+if __name__ == '__main__':
+
+    NUM_CLIPS = 120
+    PACK_CLIPS = 10
+    LATENCY = 0.3
+    RTF = 0.02
+    MAX_IN_FLIGHT = 4
+
+    server, url = start_mock_server(latency=LATENCY, rtf=RTF, echo=True)
+
+    with tempfile.TemporaryDirectory() as root:
+        manifest_path = build_dataset(root=root, num_clips=NUM_CLIPS)
+
+        single_time, single_requests, single_path = run(root, manifest_path, url, pack_clips=1, max_in_flight=MAX_IN_FLIGHT)
+        packed_time, packed_requests, packed_path = run(root, manifest_path, url, pack_clips=PACK_CLIPS, max_in_flight=MAX_IN_FLIGHT)
+
+        with open(single_path, 'rb') as f:
+            single = json.load(f)
+        with open(packed_path, 'rb') as f:
+            packed = json.load(f)
+
+        # the split words must be the words of the clip sent on its own, with the same timestamps
+        for single_entry, packed_entry in zip(single, packed):
+            single_words = [word for segment in single_entry['prediction'] for word in segment['words']]
+            packed_words = [word for segment in packed_entry['prediction'] for word in segment['words']]
+            assert single_entry['audio_filepath'] == packed_entry['audio_filepath'], 'output is not in manifest order'
+            assert single_words == packed_words, f"{packed_entry['audio_filepath']}: the packed words differ"
+
+        # and read the same by CombineManifest
+        combine = CombineManifest(raw_manifest=manifest_path, whisper_zero_manifest=packed_path, output_manifest='', language='en', workers=1)
+        with contextlib.redirect_stderr(io.StringIO()):
+            single_text = combine.load_whisper_zero_manifest(single_path)
+            packed_text = combine.load_whisper_zero_manifest(packed_path)
+        assert single_text == packed_text, 'CombineManifest reads the packed output differently'
+
+    server.shutdown()
+
+    print(f'clips: {NUM_CLIPS} of 2-5s, latency: {LATENCY}s, rtf: {RTF}, in flight: {MAX_IN_FLIGHT}')
+    print(f'one clip per request:      {single_time:.2f}s, {single_requests} requests')
+    print(f'{PACK_CLIPS} clips per request:     {packed_time:.2f}s, {packed_requests} requests')
+    print(f'speedup: {single_time / packed_time:.1f}x, packed words match the single clip words')
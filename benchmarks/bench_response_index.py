@@ -0,0 +1,83 @@
+"""
+Benchmark the time range and speaker queries of the response index against a scan of the parsed responses, and check that they agree
+
+run from the repository root: python -m benchmarks.bench_response_index
+"""
+
+import os
+import json
+import time
+import random
+import tempfile
+import numpy as np
+from typing import Dict, List
+
+from response_index import ResponseIndex
+from benchmarks.synthetic import write_gladia_response
+
+
+def scan_words(responses: Dict[str, List[Dict]], recording: str, speaker: int, start: float, end: float) -> List[tuple]:
+
+    '''
+    the words of the speaker overlapping the range, found by walking every segment of the parsed response
+    '''
+
+    return sorted(
+        (word['time_begin'], word['time_end'], word['word'])
+        for segment in responses[recording] if segment['speaker'] == speaker
+        for word in segment['words'] if word['time_end'] > start and word['time_begin'] < end
+    )
+
+
+if __name__ == '__main__':
+
+    NUM_RECORDINGS = 20
+    WORDS_PER_RECORDING = 50_000
+    NUM_SPEAKERS = 4
+    QUERY_SECONDS = 300
+    NUM_QUERIES = 200
+
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        response_paths = [os.path.join(tmp_dir, f'recording_{idx:02d}.json') for idx in range(NUM_RECORDINGS)]
+        for idx, path in enumerate(response_paths):
+            write_gladia_response(path, num_words=WORDS_PER_RECORDING, num_speakers=NUM_SPEAKERS, seed=idx)
+
+        start = time.perf_counter()
+        index = ResponseIndex.build(response_paths, os.path.join(tmp_dir, 'index'))
+        print(f'{NUM_RECORDINGS} recordings, {NUM_RECORDINGS * WORDS_PER_RECORDING} words, index built in {time.perf_counter() - start:.2f}s')
+
+        start = time.perf_counter()
+        responses = {}
+        for path in response_paths:
+            with open(path, 'rb') as f:
+                responses[os.path.splitext(os.path.basename(path))[0]] = json.load(f)['prediction']
+        print(f'json parse of every response: {time.perf_counter() - start:.2f}s')
+
+        duration = max(segment['time_end'] for segment in responses['recording_00'])
+        queries = []
+        for _ in range(NUM_QUERIES):
+            query_start = rng.uniform(0, duration - QUERY_SECONDS)
+            queries.append((f'recording_{rng.randrange(NUM_RECORDINGS):02d}', rng.randrange(NUM_SPEAKERS), query_start, query_start + QUERY_SECONDS))
+
+        # the first query pages the columns in, the timings are of a warm index like an interactive session
+        index.words(*queries[0])
+
+        query_times, scan_times, num_words = [], [], []
+        for recording, speaker, query_start, query_end in queries:
+            start = time.perf_counter()
+            words = index.words(recording, speaker=speaker, start=query_start, end=query_end)
+            query_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            scanned = scan_words(responses, recording, speaker, query_start, query_end)
+            scan_times.append(time.perf_counter() - start)
+
+            assert sorted((word['time_begin'], word['time_end'], word['word']) for word in words) == scanned, 'the index differs from the scan'
+            num_words.append(len(words))
+
+        query_ms, scan_ms = np.array(query_times) * 1000, np.array(scan_times) * 1000
+        print(f'{NUM_QUERIES} queries of {QUERY_SECONDS}s for one speaker match the scan, {np.median(num_words):.0f} words each (median)')
+        print(f'index words(): median {np.median(query_ms):.3f} ms, p95 {np.percentile(query_ms, 95):.3f} ms')
+        print(f'scan of the parsed response: median {np.median(scan_ms):.3f} ms ({np.median(scan_ms) / np.median(query_ms):.0f}x)')
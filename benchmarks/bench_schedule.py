@@ -0,0 +1,88 @@
+"""
+Compare the run time of BatchTranscribeAudio with the clips sent in manifest order and longest first, on a manifest of mostly short clips
+with a few long ones at the end, against the local stand-in server answering in time proportional to the audio
+
+run from the repository root: python -m benchmarks.bench_schedule
+"""
+
+import io
+import os
+import json
+import time
+import tempfile
+import contextlib
+
+from batch_transcribe_audio_short import BatchTranscribeAudio
+from benchmarks.bench_batch_transcribe import write_silent_wav
+from benchmarks.mock_gladia_server import start_mock_server
+
+
+def build_dataset(root: str, num_short: int, num_long: int, short_duration: float, long_duration: float) -> str:
+
+    '''
+    generate the clips and the nemo manifest, the long clips last, returns the manifest path
+    '''
+
+    manifest_path = os.path.join(root, 'manifest.json')
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        for idx in range(num_short + num_long):
+            duration = short_duration if idx < num_short else long_duration
+            audio_filepath = f'clip_{idx:05d}.wav'
+            write_silent_wav(os.path.join(root, audio_filepath), duration=duration)
+            f.write(json.dumps({"audio_filepath": audio_filepath, "duration": duration, "text": "word"}) + '\n')
+
+    return manifest_path
+
+
+def run(root: str, manifest_path: str, url: str, schedule: str, max_in_flight: int) -> float:
+
+    '''
+    returns: the wall clock time of one batch transcription
+    '''
+
+    output_path = os.path.join(root, f'output_{schedule}.json')
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        BatchTranscribeAudio(
+            audio_root_path=root,
+            input_manifest_path=manifest_path,
+            output_manifest_path=output_path,
+            language='english',
+            max_in_flight=max_in_flight,
+            requests_per_second=0,
+            api_url=url,
+            schedule=schedule,
+        )()
+    elapsed = time.perf_counter() - start
+
+    # the output stays in manifest order whatever the schedule
+    with open(output_path, 'rb') as f:
+        outputs = [entry['audio_filepath'] for entry in json.load(f)]
+    assert outputs == [f'clip_{idx:05d}.wav' for idx in range(len(outputs))], 'output is not in manifest order'
+
+    return elapsed
+
+
+if __name__ == '__main__':
+
+    NUM_SHORT = 60
+    NUM_LONG = 4
+    SHORT_DURATION = 1.0
+    LONG_DURATION = 20.0
+    RTF = 0.1
+    MAX_IN_FLIGHT = 8
+
+    server, url = start_mock_server(latency=0.0, rtf=RTF)
+
+    with tempfile.TemporaryDirectory() as root:
+        manifest_path = build_dataset(root, NUM_SHORT, NUM_LONG, SHORT_DURATION, LONG_DURATION)
+        times = {schedule: run(root, manifest_path, url, schedule, MAX_IN_FLIGHT) for schedule in ('manifest', 'longest_first')}
+
+    server.shutdown()
+
+    print(f'clips: {NUM_SHORT} x {SHORT_DURATION}s + {NUM_LONG} x {LONG_DURATION}s, rtf: {RTF}, in flight: {MAX_IN_FLIGHT}')
+    for schedule, elapsed in times.items():
+        print(f'{schedule + ":":<15} {elapsed:.2f}s')
+    print(f"speedup: {times['manifest'] / times['longest_first']:.2f}x")
@@ -0,0 +1,173 @@
+"""
+Compare the compiled normalisers of text_processing.py against the original, read from the baseline commit with git, on synthetic utterances of every language branch,
+then the batch normaliser on a templated corpus where most utterances repeat, the chinese script conversion is also checked on every code point
+
+run from the repository root: python -m benchmarks.bench_text_processing
+"""
+
+import os
+import sys
+import time
+import types
+import argparse
+import subprocess
+
+import text_processing
+from text_processing import BatchTextPostProcessor
+from benchmarks.synthetic import make_text
+
+LANGUAGES = ['en', 'id', 'ms', 'tl', 'zh', 'zh_cmn', 'zh_yue', 'vi', 'ta', 'th', '']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# tag of the commit with the original text_processing.py the normalisers must match exactly
+BASELINE_TAG = 'text-processing-baseline'
+UPSTREAM_BRANCHES = ['origin/main', 'main', 'origin/master']
+
+
+def git(*args: str) -> str:
+
+    '''
+    returns: the stripped output of the git command run in the repository, empty if it fails
+    '''
+
+    result = subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True)
+
+    return result.stdout.strip() if result.returncode == 0 else ''
+
+
+def resolve_baseline(revision: str=None) -> str:
+
+    '''
+    the revision of the original text_processing.py: the given one, else the baseline tag, else the merge base with the upstream branch,
+    else the commit that added text_processing.py
+    '''
+
+    if revision is not None:
+        return revision
+
+    if git('rev-parse', '--verify', '--quiet', f'refs/tags/{BASELINE_TAG}'):
+        return BASELINE_TAG
+
+    for branch in UPSTREAM_BRANCHES:
+        merge_base = git('merge-base', 'HEAD', branch)
+        if merge_base and merge_base != git('rev-parse', 'HEAD'):
+            return merge_base
+
+    added = git('log', '--diff-filter=A', '--format=%H', '--', 'text_processing.py').splitlines()
+    if not added:
+        raise SystemExit('cannot find the original text_processing.py in the git history, pass --baseline-rev')
+
+    return added[-1]
+
+
+def load_baseline(revision: str) -> types.ModuleType:
+
+    '''
+    the text_processing.py of the given revision, read with git show and imported as a module of its own
+    '''
+
+    source = subprocess.run(
+        ['git', 'show', f'{revision}:text_processing.py'], cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+
+    module = types.ModuleType('reference_text_processing')
+    module.__file__ = f'{revision}:text_processing.py'
+    exec(compile(source, module.__file__, 'exec'), module.__dict__)
+
+    return module
+
+
+def time_normaliser(module, language: str, texts) -> tuple:
+
+    '''
+    normalise every text with a single manager of the module, like CombineManifest does
+
+    returns: (outputs, seconds)
+    '''
+
+    manager = module.TextPostProcessingManager(language=language)
+    # build the processor (and its tables) outside of the timing
+    manager.process_data(text='')
+
+    start = time.perf_counter()
+    outputs = [manager.process_data(text=text) for text in texts]
+
+    return outputs, time.perf_counter() - start
+
+
+def time_reference_per_call(language: str, texts) -> float:
+
+    '''
+    the original calling pattern, a new manager (and processor) for every utterance
+    '''
+
+    start = time.perf_counter()
+    for text in texts:
+        reference_text_processing.TextPostProcessingManager(language=language).process_data(text=text)
+
+    return time.perf_counter() - start
+
+
+def check_every_code_point() -> None:
+
+    '''
+    the translate tables of zh_cmn and zh_yue against the original filter and HanziConv on a text of every unicode character
+    '''
+
+    text = ''.join(chr(code) for code in range(sys.maxunicode + 1) if not 0xD800 <= code <= 0xDFFF)
+
+    for language in ('zh_cmn', 'zh_yue'):
+        expected = reference_text_processing.TextPostProcessingManager(language=language).process_data(text=text)
+        converted = text_processing.TextPostProcessingManager(language=language).process_data(text=text)
+        assert converted.encode('utf-8') == expected.encode('utf-8'), f'{language} differs from HanziConv'
+
+    print('zh_cmn and zh_yue match HanziConv on every code point')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark the normalisers against the original text_processing.py')
+    parser.add_argument('--baseline-rev', default=None, help=f'git revision of the original text_processing.py, defaults to the {BASELINE_TAG} tag')
+    args = parser.parse_args()
+
+    NUM_UTTERANCES = 2000
+    WORDS_PER_UTTERANCE = 20
+
+    baseline = resolve_baseline(args.baseline_rev)
+    reference_text_processing = load_baseline(baseline)
+    print(f'reference: text_processing.py at {baseline}')
+    check_every_code_point()
+
+    print(f"{'language':>8} | {'per-call s':>10} {'reference s':>11} {'compiled s':>10} | {'vs per-call':>11} {'vs reference':>12}")
+
+    for language in LANGUAGES:
+        texts = [make_text(language or 'en', WORDS_PER_UTTERANCE, seed=idx) for idx in range(NUM_UTTERANCES)]
+
+        per_call_time = time_reference_per_call(language, texts)
+        reference, reference_time = time_normaliser(reference_text_processing, language, texts)
+        compiled, compiled_time = time_normaliser(text_processing, language, texts)
+
+        mismatches = [idx for idx, (a, b) in enumerate(zip(reference, compiled)) if a != b]
+        assert not mismatches, f'{language!r}: {len(mismatches)} outputs differ, first {texts[mismatches[0]]!r}'
+
+        print(
+            f"{language or 'base':>8} | {per_call_time:>10.3f} {reference_time:>11.3f} {compiled_time:>10.3f} | "
+            f"{per_call_time / compiled_time:>10.1f}x {reference_time / compiled_time:>11.1f}x"
+        )
+
+    # templated corpus, NUM_UTTERANCES drawn from NUM_TEMPLATES distinct utterances
+    NUM_TEMPLATES = 200
+    texts = [make_text('en', WORDS_PER_UTTERANCE, seed=idx % NUM_TEMPLATES) for idx in range(NUM_UTTERANCES)]
+    expected, _ = time_normaliser(reference_text_processing, 'en', texts)
+
+    print(f'\nbatch en, {NUM_UTTERANCES} utterances from {NUM_TEMPLATES} templates, {os.cpu_count()} cpus')
+    _, one_by_one_time = time_normaliser(text_processing, 'en', texts)
+    print(f'one by one: {one_by_one_time:.3f}s')
+
+    for workers in [0, None]:
+        with BatchTextPostProcessor(language='en', workers=workers, min_parallel=0) as batch:
+            start = time.perf_counter()
+            assert batch.process_batch(texts) == expected
+            elapsed = time.perf_counter() - start
+            print(f"batch, {'in-process' if workers == 0 else 'process pool'}: {elapsed:.3f}s ({one_by_one_time / elapsed:.1f}x) {batch.stats()}")
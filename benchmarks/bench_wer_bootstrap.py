@@ -0,0 +1,79 @@
+"""
+Time the bootstrap of wer_bootstrap on 50k utterances of word and of character counts, check it against a plain index resampling bootstrap and check that the paired test
+keeps its false positive rate when the two systems are equally good
+
+run from the repository root: python -m benchmarks.bench_wer_bootstrap
+"""
+
+import time
+import numpy as np
+
+from wer_bootstrap import WERBootstrap
+
+
+def make_counts(num_utterances: int, error_rate: float, seed: int=0, max_ref_len: int=40):
+
+    '''
+    per-utterance errors and reference lengths of a system with the given error rate, up to 40 words or, for the cer, a few hundred characters
+    '''
+
+    rng = np.random.default_rng(seed)
+    ref_len = rng.integers(1, max_ref_len, num_utterances)
+
+    return rng.binomial(ref_len, error_rate), ref_len
+
+
+def index_bootstrap(errors: np.ndarray, ref_len: np.ndarray, num_resamples: int, seed: int=0) -> np.ndarray:
+
+    '''
+    the textbook bootstrap, utterance indices drawn with replacement one resample at a time
+    '''
+
+    rng = np.random.default_rng(seed)
+    rates = np.empty(num_resamples)
+
+    for resample in range(num_resamples):
+        idx = rng.integers(0, len(errors), len(errors))
+        rates[resample] = errors[idx].sum() / ref_len[idx].sum()
+
+    return rates
+
+
+if __name__ == '__main__':
+
+    NUM_UTTERANCES = 50_000
+    NUM_RESAMPLES = 10_000
+
+    # the character counts have many more distinct rows than the word counts
+    for level, max_ref_len in (('word', 40), ('char', 200)):
+        errors_a, ref_len = make_counts(NUM_UTTERANCES, 0.150, seed=1, max_ref_len=max_ref_len)
+        errors_b = np.random.default_rng(2).binomial(ref_len, 0.147)
+        bootstrap = WERBootstrap(num_resamples=NUM_RESAMPLES)
+        num_rows = len(np.unique(np.column_stack([errors_a, ref_len]), axis=0))
+
+        start = time.perf_counter()
+        interval = bootstrap.confidence_interval(errors_a, ref_len)
+        print(f"{level}: confidence interval, {NUM_UTTERANCES} utterances ({num_rows} distinct rows) x {NUM_RESAMPLES} resamples: "
+              f"{time.perf_counter() - start:.3f}s rate {interval['rate']:.5f} [{interval['low']:.5f}, {interval['high']:.5f}]")
+
+        start = time.perf_counter()
+        paired = bootstrap.paired_test(errors_a, errors_b, ref_len)
+        print(f"{level}: paired test: {time.perf_counter() - start:.3f}s delta {paired['delta']:.5f} [{paired['low']:.5f}, {paired['high']:.5f}] "
+              f"p {paired['p_value']:.4f}")
+
+        # the same interval as the textbook bootstrap, up to the resampling noise
+        start = time.perf_counter()
+        rates = index_bootstrap(errors_a, ref_len, 2000)
+        low, high = np.percentile(rates, [2.5, 97.5])
+        print(f'{level}: index bootstrap, 2000 resamples: {time.perf_counter() - start:.3f}s [{low:.5f}, {high:.5f}]')
+        assert abs(low - interval['low']) < 0.2 * (high - low) and abs(high - interval['high']) < 0.2 * (high - low)
+
+    # two equally good systems, the test should reject about 5% of the time at p < 0.05
+    num_trials = 500
+    rejections = 0
+    for trial in range(num_trials):
+        errors_a, ref_len = make_counts(5000, 0.15, seed=100 + trial)
+        errors_b = np.random.default_rng(10_000 + trial).binomial(ref_len, 0.15)
+        rejections += WERBootstrap(num_resamples=500, seed=trial).paired_test(errors_a, errors_b, ref_len)['p_value'] < 0.05
+
+    print(f'false positive rate of the paired test at p < 0.05: {rejections / num_trials:.3f}')
@@ -0,0 +1,79 @@
+"""
+Compare the streaming scorer against three separate jiwer calls (the original WERFromJSON) on synthetic manifests, the totals must match jiwer exactly
+
+run from the repository root: python -m benchmarks.bench_wer_scorer
+"""
+
+import os
+import json
+import time
+import tempfile
+import jiwer
+
+from wer_scorer import StreamingWERScorer
+from benchmarks.synthetic import write_scored_manifest
+
+
+def jiwer_scores(manifest_path: str) -> dict:
+
+    '''
+    the original WERFromJSON: the whole manifest in memory, wer, cer and mer computed separately
+    '''
+
+    with open(manifest_path, 'rb') as f:
+        data = [json.loads(line) for line in f]
+
+    references = [entry['text'] for entry in data]
+    predictions = [entry['pred_str'] for entry in data]
+
+    return {
+        'wer': jiwer.wer(reference=references, hypothesis=predictions),
+        'cer': jiwer.cer(reference=references, hypothesis=predictions),
+        'mer': jiwer.mer(reference=references, hypothesis=predictions),
+        'word': jiwer.process_words(references, predictions),
+        'char': jiwer.process_characters(references, predictions),
+    }
+
+
+def check_against_jiwer(result: dict, expected: dict) -> None:
+    for metric in ('wer', 'cer', 'mer'):
+        assert result[metric] == expected[metric], f'{metric}: {result[metric]} != jiwer {expected[metric]}'
+
+    for level in ('word', 'char'):
+        for key in ('hits', 'substitutions', 'deletions', 'insertions'):
+            assert result[level][key] == getattr(expected[level], key), f'{level} {key} differs from jiwer'
+
+
+if __name__ == '__main__':
+
+    NUM_UTTERANCES = 20_000
+
+    with tempfile.TemporaryDirectory() as root:
+        for language in ('en', 'zh', 'th'):
+            manifest_path = os.path.join(root, f'{language}.json')
+            write_scored_manifest(manifest_path, NUM_UTTERANCES, language=language, seed=1)
+
+            start = time.perf_counter()
+            expected = jiwer_scores(manifest_path)
+            jiwer_time = time.perf_counter() - start
+
+            print(f'{language}, {NUM_UTTERANCES} utterances: jiwer {jiwer_time:.2f}s', end='')
+
+            for workers in (0, None):
+                start = time.perf_counter()
+                result = StreamingWERScorer(
+                    manifest_path=manifest_path,
+                    workers=workers,
+                    utterance_output_path=os.path.join(root, 'utterances.json'),
+                )()
+                elapsed = time.perf_counter() - start
+                check_against_jiwer(result, expected)
+                print(f", {'in-process' if workers == 0 else f'{os.cpu_count()} workers'} {elapsed:.2f}s ({jiwer_time / elapsed:.1f}x)", end='')
+
+            print(f", wer {result['wer']:.4f} cer {result['cer']:.4f} mer {result['mer']:.4f}")
+
+            # the per-utterance counts sum up to the totals
+            with open(os.path.join(root, 'utterances.json')) as f:
+                utterances = [json.loads(line) for line in f]
+            assert len(utterances) == NUM_UTTERANCES
+            assert sum(utterance['word']['substitutions'] for utterance in utterances) == result['word']['substitutions']
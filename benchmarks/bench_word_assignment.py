@@ -0,0 +1,134 @@
+"""
+Benchmark the indexed word to utterance assignment against a python two-pointer walk like the original CombineWordToUtterances loop
+
+run from the repository root: python -m benchmarks.bench_word_assignment
+"""
+
+import time
+import numpy as np
+from typing import List
+
+from word_assignment import ASSIGNMENT_RULES, WordSegmentAssigner
+
+
+def make_word_arrays(num_words: int, seed: int=0):
+
+    '''
+    sorted word start/end times with short pauses between them, generated with numpy so 1M words is quick
+    '''
+
+    rng = np.random.default_rng(seed)
+    gaps = rng.uniform(0.02, 0.4, num_words)
+    lengths = rng.uniform(0.1, 0.6, num_words)
+    word_start = np.cumsum(gaps + np.concatenate([[0.0], lengths[:-1]]))
+
+    return word_start, word_start + lengths
+
+
+def make_segments(word_start: np.ndarray, word_end: np.ndarray, words_per_segment: int=12, shuffle: bool=False, overlap: float=0.0, seed: int=0):
+
+    '''
+    reference segments covering groups of words, optionally shuffled and widened so they overlap their neighbours
+    '''
+
+    idx = np.arange(0, len(word_start), words_per_segment)
+    ref_start = word_start[idx] - 0.01 - overlap
+    ref_end = word_end[np.minimum(idx + words_per_segment - 1, len(word_end) - 1)] + 0.01 + overlap
+
+    if shuffle:
+        order = np.random.default_rng(seed).permutation(len(ref_start))
+        ref_start, ref_end = ref_start[order], ref_end[order]
+
+    return ref_start, ref_end
+
+
+def python_walk(word_start: List[float], word_end: List[float], ref_start: List[float], ref_end: List[float]) -> List[List[int]]:
+
+    '''
+    the original linear walk (with bounds checks), only valid for sorted, non-overlapping references
+    '''
+
+    assigned = []
+    idx = 0
+
+    for start, end in zip(ref_start, ref_end):
+        words = []
+
+        while idx < len(word_start) and word_start[idx] < start:
+            idx += 1
+
+        while idx < len(word_start) and word_start[idx] < end:
+            words.append(idx)
+            idx += 1
+
+        assigned.append(words)
+
+    return assigned
+
+
+def brute_force(word_start, word_end, ref_start, ref_end, rule: str) -> List[List[int]]:
+
+    '''
+    direct definition of every rule, for checking the indexed version on small inputs
+    '''
+
+    assigned = [[] for _ in ref_start]
+
+    if rule == 'max_overlap':
+        for w, (ws, we) in enumerate(zip(word_start, word_end)):
+            overlaps = [min(we, re) - max(ws, rs) for rs, re in zip(ref_start, ref_end)]
+            best = int(np.argmax(overlaps))
+            if overlaps[best] > 0:
+                assigned[best].append(w)
+    else:
+        for r, (rs, re) in enumerate(zip(ref_start, ref_end)):
+            for w, (ws, we) in enumerate(zip(word_start, word_end)):
+                key = (ws + we) / 2 if rule == 'midpoint' else ws
+                if rs <= key < re:
+                    assigned[r].append(w)
+
+    return [sorted(words, key=lambda w: word_start[w]) for words in assigned]
+
+
+def check_correctness() -> None:
+    word_start, word_end = make_word_arrays(2000, seed=1)
+    ref_start, ref_end = make_segments(word_start, word_end, shuffle=True, overlap=0.5, seed=1)
+
+    assigner = WordSegmentAssigner(word_start, word_end)
+    for rule in ASSIGNMENT_RULES:
+        offsets, word_idx = assigner.assign(ref_start, ref_end, rule=rule)
+        indexed = [word_idx[offsets[r]:offsets[r + 1]].tolist() for r in range(len(ref_start))]
+        assert indexed == brute_force(word_start, word_end, ref_start, ref_end, rule), f'{rule} differs from the brute force'
+
+    print(f'rules {ASSIGNMENT_RULES} match the brute force on shuffled, overlapping segments')
+
+
+if __name__ == '__main__':
+
+    NUM_WORDS = 1_000_000
+
+    check_correctness()
+
+    word_start, word_end = make_word_arrays(NUM_WORDS)
+    ref_start, ref_end = make_segments(word_start, word_end)
+    print(f'{NUM_WORDS} words, {len(ref_start)} segments')
+
+    start = time.perf_counter()
+    walked = python_walk(word_start.tolist(), word_end.tolist(), ref_start.tolist(), ref_end.tolist())
+    walk_time = time.perf_counter() - start
+    print(f'python walk (sorted, non-overlapping only): {walk_time:.3f}s')
+
+    for rule in ASSIGNMENT_RULES:
+        start = time.perf_counter()
+        offsets, word_idx = WordSegmentAssigner(word_start, word_end).assign(ref_start, ref_end, rule=rule)
+        elapsed = time.perf_counter() - start
+
+        if rule == 'start':
+            assert [word_idx[offsets[r]:offsets[r + 1]].tolist() for r in range(len(ref_start))] == walked
+
+        print(f'indexed {rule:<12}: {elapsed:.3f}s ({walk_time / elapsed:.1f}x)')
+
+    shuffled_start, shuffled_end = make_segments(word_start, word_end, shuffle=True, overlap=1.0)
+    start = time.perf_counter()
+    WordSegmentAssigner(word_start, word_end).assign(shuffled_start, shuffled_end, rule='max_overlap')
+    print(f'indexed max_overlap on shuffled, overlapping segments: {time.perf_counter() - start:.3f}s')
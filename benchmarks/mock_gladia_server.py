@@ -0,0 +1,179 @@
+"""
+Local stand-in for the whisper zero (gladia) transcription api, returns a synthetic response after an artificial latency
+"""
+
+# bytes of a second of 16 kHz 16-bit mono wav, to tell the audio duration of an upload from its size
+WAV_BYTES_PER_SECOND = 32000
+
+# frames the echoed words are found over, and the seconds of sound per echoed word
+ECHO_FRAME_SECONDS = 0.02
+ECHO_WORD_SECONDS = 0.5
+
+import io
+import json
+import time
+import wave
+import random
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+
+class MockGladiaHandler(BaseHTTPRequestHandler):
+
+    '''
+    handles the post request like the transcription endpoint, the latency, real-time factor and failure rate are set on the server object
+    '''
+
+    @staticmethod
+    def echo_words(body: bytes) -> List[Dict]:
+
+        '''
+        find the stretches of sound in the uploaded 16-bit wav and return a word every ECHO_WORD_SECONDS of them, timed where they are heard
+
+        the word is named after the mean absolute sample value of its stretch, e.g. " a1200", so a test can tell which clip a word came from
+        '''
+
+        start = body.find(b'RIFF')
+        if start < 0:
+            return []
+
+        with wave.open(io.BytesIO(body[start:]), 'rb') as w:
+            sample_rate = w.getframerate()
+            samples = np.abs(np.frombuffer(w.readframes(w.getnframes()), dtype='<i2').astype(np.int64))
+
+        frame_len = max(1, int(sample_rate * ECHO_FRAME_SECONDS))
+        num_frames = len(samples) // frame_len
+        loud = np.append(samples[:num_frames * frame_len].reshape(num_frames, frame_len).max(axis=1) > 0, False)
+
+        words = []
+        frame = 0
+        while frame < num_frames:
+            if not loud[frame]:
+                frame += 1
+                continue
+
+            end = frame + int(np.argmin(loud[frame:]))
+            level = int(round(samples[frame * frame_len:end * frame_len].mean()))
+            begin_seconds, end_seconds = frame * frame_len / sample_rate, end * frame_len / sample_rate
+
+            time_begin = begin_seconds
+            while time_begin < end_seconds:
+                time_end = min(time_begin + ECHO_WORD_SECONDS * 0.8, end_seconds)
+                words.append({"word": f" a{level}", "time_begin": round(time_begin, 3), "time_end": round(time_end, 3), "confidence": 0.9})
+                time_begin += ECHO_WORD_SECONDS
+
+            frame = end
+
+        return words
+
+
+    def build_response(self, body: bytes) -> Dict:
+
+        '''
+        build a gladia shaped response with a single segment of synthetic words, or of the words echoed from the audio if the server echoes
+        '''
+
+        if self.server.echo:
+            words = self.echo_words(body)
+            if not words:
+                return {"prediction": [], "prediction_raw": {"metadata": {"uploaded_bytes": len(body)}}}
+        else:
+            words = [
+                {
+                    "word": f" word{idx}",
+                    "time_begin": idx * 0.5,
+                    "time_end": idx * 0.5 + 0.4,
+                    "confidence": 0.9
+                } for idx in range(4)
+            ]
+
+        return {
+            "prediction": [
+                {
+                    "words": words,
+                    "language": "en",
+                    "transcription": ' '.join(word['word'].lstrip() for word in words),
+                    "confidence": 0.9,
+                    "time_begin": words[0]['time_begin'],
+                    "time_end": words[-1]['time_end'],
+                    "speaker": 0,
+                    "channel": "channel_0"
+                }
+            ],
+            "prediction_raw": {
+                "metadata": {"uploaded_bytes": len(body)}
+            }
+        }
+
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # a fixed latency, plus a time proportional to the uploaded audio like a real transcription
+        time.sleep(self.server.latency + self.server.rtf * len(body) / WAV_BYTES_PER_SECOND)
+
+        # transient overload, the client is expected to back off and retry
+        if random.random() < self.server.failure_rate:
+            payload = json.dumps({"error": "service unavailable"}).encode('utf-8')
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        payload = json.dumps(self.build_response(body=body)).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def log_message(self, format: str, *args) -> None:
+        # keep the benchmark output clean
+        pass
+
+
+def start_mock_server(latency: float=0.2, failure_rate: float=0.0, rtf: float=0.0, echo: bool=False, host: str='127.0.0.1', port: int=0) -> Tuple[ThreadingHTTPServer, str]:
+
+    '''
+    start the stand-in server on a background thread
+    ---
+    latency: artificial delay in seconds added to every request
+    failure_rate: fraction of the requests answered with a 503
+    rtf: seconds of delay added per second of uploaded audio, assuming an uncompressed 16 kHz 16-bit mono wav
+    echo: answer with words timed on the sound in the uploaded 16-bit wav instead of the same fixed words, see MockGladiaHandler.echo_words
+    port: port to listen on, 0 picks a free port
+    ---
+    returns: the server object (call shutdown() when done) and the url to post to
+    '''
+
+    server = ThreadingHTTPServer((host, port), MockGladiaHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.rtf = rtf
+    server.echo = echo
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, f'http://{host}:{server.server_address[1]}/audio/text/audio-transcription/'
+
+
+if __name__ == '__main__':
+
+    LATENCY = 0.5
+    PORT = 8000
+
+    server, url = start_mock_server(latency=LATENCY, port=PORT)
+    print(f'mock gladia api listening on {url}')
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
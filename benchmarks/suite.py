@@ -0,0 +1,334 @@
+"""
+Benchmark suite of every stage of the pipeline on synthetic inputs: the throughput and peak memory of every stage, saved as json baselines
+so later runs can be compared against them
+
+the inputs are generated once, then every stage runs in a fresh subprocess so the peak rss it reports is its own
+
+run from the repository root:
+    python -m benchmarks.suite --scale small --save before
+    python -m benchmarks.suite --scale small --compare before
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from text_processing import TextPostProcessingManager
+from extract_single_word_manifest_from_long_audio import ExtractSingleWord
+from combine_word_level_long_audio import CombineWordToUtterances
+from combine_manifest_short import CombineManifest
+from get_wer_from_json import WERFromJSON
+from benchmarks.bench_extract_single_word import peak_rss_mb
+from benchmarks.synthetic import (
+    make_text,
+    write_gladia_response,
+    write_long_audio_manifests,
+    write_nemo_manifest,
+    write_scored_manifest,
+    write_whisper_zero_manifest,
+)
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# every language branch of TextPostProcessingManager.process_data, '' is the fallback branch
+LANGUAGES = ['en', 'id', 'ms', 'tl', 'zh', 'zh_cmn', 'zh_yue', 'vi', 'ta', 'th', '']
+
+# number of items of every stage, small runs in about a minute
+SCALES = {
+    'small': {'text_utterances': 10_000, 'response_words': 100_000, 'long_audio_words': 100_000, 'short_utterances': 10_000, 'scored_utterances': 20_000},
+    'full': {'text_utterances': 100_000, 'response_words': 1_000_000, 'long_audio_words': 1_000_000, 'short_utterances': 100_000, 'scored_utterances': 200_000},
+}
+
+
+def run_text_processing(texts_path: str, language: str) -> float:
+
+    '''
+    normalise every text with one manager, like CombineWordToUtterances does, the processor is built before the timing
+    '''
+
+    with open(texts_path, 'rb') as f:
+        texts = [json.loads(line) for line in f]
+
+    manager = TextPostProcessingManager(language=language)
+    manager.process_data(text='')
+
+    start = time.perf_counter()
+    for text in texts:
+        manager.process_data(text=text)
+
+    return time.perf_counter() - start
+
+
+def run_extract_single_word(input_manifest: str, output_manifest: str) -> float:
+    start = time.perf_counter()
+    ExtractSingleWord(input_manifest=input_manifest, output_manifest=output_manifest)()
+
+    return time.perf_counter() - start
+
+
+def run_combine_word_to_utterances(ref_manifest: str, word_level_manifest: str, output_manifest: str, language: str) -> float:
+    start = time.perf_counter()
+    CombineWordToUtterances(ref_manifest=ref_manifest, word_level_manifest=word_level_manifest, output_manifest=output_manifest, language=language)()
+
+    return time.perf_counter() - start
+
+
+def run_combine_manifest(raw_manifest: str, whisper_zero_manifest: str, output_manifest: str, language: str, workers: int=None) -> float:
+    start = time.perf_counter()
+    CombineManifest(
+        raw_manifest=raw_manifest,
+        whisper_zero_manifest=whisper_zero_manifest,
+        output_manifest=output_manifest,
+        language=language,
+        workers=workers,
+    )()
+
+    return time.perf_counter() - start
+
+
+def run_wer_from_json(manifest_path: str, workers: int=None) -> float:
+    start = time.perf_counter()
+    WERFromJSON(manifest_path=manifest_path, workers=workers)()
+
+    return time.perf_counter() - start
+
+
+RUNNERS = {
+    'text_processing': run_text_processing,
+    'extract_single_word': run_extract_single_word,
+    'combine_word_to_utterances': run_combine_word_to_utterances,
+    'combine_manifest': run_combine_manifest,
+    'wer_from_json': run_wer_from_json,
+}
+
+
+def prepare(root: str, scale: Dict[str, int], workers: int=None) -> List[Dict]:
+
+    '''
+    generate the inputs of every stage under root
+    ---
+    returns: the stages, each {'name', 'runner', 'params', 'items', 'unit', 'input_paths'}
+    '''
+
+    path = lambda name: os.path.join(root, name)
+    stages = []
+
+    for language in LANGUAGES:
+        texts_path = path(f'texts_{language or "default"}.json')
+        with open(texts_path, 'w', encoding='utf-8') as f:
+            for idx in range(scale['text_utterances']):
+                f.write(json.dumps(make_text(language, 15, seed=idx), ensure_ascii=False) + '\n')
+
+        stages.append({
+            'name': f'text_processing[{language}]',
+            'runner': 'text_processing',
+            'params': {'texts_path': texts_path, 'language': language},
+            'items': scale['text_utterances'],
+            'unit': 'utt',
+            'input_paths': [texts_path],
+        })
+
+    write_gladia_response(path('response.json'), num_words=scale['response_words'])
+    stages.append({
+        'name': 'extract_single_word',
+        'runner': 'extract_single_word',
+        'params': {'input_manifest': path('response.json'), 'output_manifest': path('word_level_extracted.json')},
+        'items': scale['response_words'],
+        'unit': 'word',
+        'input_paths': [path('response.json')],
+    })
+
+    write_long_audio_manifests(path('word_level.json'), path('long_ref.json'), num_words=scale['long_audio_words'], language='id')
+    stages.append({
+        'name': 'combine_word_to_utterances',
+        'runner': 'combine_word_to_utterances',
+        'params': {'ref_manifest': path('long_ref.json'), 'word_level_manifest': path('word_level.json'), 'output_manifest': path('long_with_pred.json'), 'language': 'id'},
+        'items': scale['long_audio_words'],
+        'unit': 'word',
+        'input_paths': [path('long_ref.json'), path('word_level.json')],
+    })
+
+    write_nemo_manifest(path('short_raw.json'), scale['short_utterances'])
+    write_whisper_zero_manifest(path('short_whisper_zero.json'), path('short_raw.json'))
+    stages.append({
+        'name': 'combine_manifest',
+        'runner': 'combine_manifest',
+        'params': {
+            'raw_manifest': path('short_raw.json'),
+            'whisper_zero_manifest': path('short_whisper_zero.json'),
+            'output_manifest': path('short_with_pred.json'),
+            'language': 'en',
+            'workers': workers,
+        },
+        'items': scale['short_utterances'],
+        'unit': 'utt',
+        'input_paths': [path('short_raw.json'), path('short_whisper_zero.json')],
+    })
+
+    write_scored_manifest(path('scored.json'), scale['scored_utterances'], vocabulary_size=20_000)
+    stages.append({
+        'name': 'wer_from_json',
+        'runner': 'wer_from_json',
+        'params': {'manifest_path': path('scored.json'), 'workers': workers},
+        'items': scale['scored_utterances'],
+        'unit': 'utt',
+        'input_paths': [path('scored.json')],
+    })
+
+    return stages
+
+
+def child(runner: str, params: str) -> None:
+
+    '''
+    run a single stage and print its runtime and memory as json on the last line of stdout, the memory before the stage (the interpreter
+    and the imports) is reported apart from the peak
+    '''
+
+    # keep the progress bars and the logging out of the report
+    sys.stderr = open(os.devnull, 'w')
+
+    start_rss = peak_rss_mb()
+    seconds = RUNNERS[runner](**json.loads(params))
+
+    print(json.dumps({'seconds': seconds, 'start_rss_mb': start_rss, 'peak_rss_mb': peak_rss_mb()}))
+
+
+def run_stage(stage: Dict, repeats: int) -> Dict:
+
+    '''
+    run the stage repeats times in fresh processes, the fastest run and the highest peak memory are kept
+    '''
+
+    runs = []
+
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.suite', 'child', stage['runner'], json.dumps(stage['params'])],
+            capture_output=True, text=True, check=True,
+        )
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    seconds = min(run['seconds'] for run in runs)
+    input_mb = sum(os.path.getsize(input_path) for input_path in stage['input_paths']) / 1024**2
+
+    return {
+        'unit': stage['unit'],
+        'items': stage['items'],
+        'input_mb': round(input_mb, 3),
+        'seconds': round(seconds, 4),
+        'items_per_second': round(stage['items'] / seconds, 1),
+        'mb_per_second': round(input_mb / seconds, 3),
+        'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+        'stage_rss_mb': round(max(run['peak_rss_mb'] - run['start_rss_mb'] for run in runs), 1),
+    }
+
+
+def baseline_path(name: str) -> str:
+
+    '''
+    a bare name is a file in benchmarks/baselines, anything ending in .json is used as the path
+    '''
+
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, f'{name}.json')
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+
+    '''
+    print the change of every stage against the baseline
+    ---
+    tolerance: relative drop of the throughput, or growth of the peak memory, flagged as a regression
+    ---
+    returns: the names of the regressed stages
+    '''
+
+    if baseline['scale'] != results['scale']:
+        print(f"warning: the baseline was run at scale {baseline['scale']}, this run at {results['scale']}")
+    if baseline['machine'] != results['machine']:
+        print(f"warning: the baseline was run on another machine: {baseline['machine']}")
+
+    regressions = []
+    print(f"\n{'stage':<28} {'base /s':>11} {'now /s':>11} {'speed':>7} | {'base mb':>8} {'now mb':>8}")
+
+    for name, stage in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            print(f'{name:<28} not in the baseline')
+            continue
+
+        speed = stage['items_per_second'] / base['items_per_second']
+        memory = stage['peak_rss_mb'] / base['peak_rss_mb']
+        regressed = speed < 1 - tolerance or memory > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+
+        print(
+            f"{name:<28} {base['items_per_second']:>11,.0f} {stage['items_per_second']:>11,.0f} {speed:>6.2f}x | "
+            f"{base['peak_rss_mb']:>8.1f} {stage['peak_rss_mb']:>8.1f}" + ('  REGRESSION' if regressed else '')
+        )
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'child':
+        child(runner=sys.argv[2], params=sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='benchmark every stage of the pipeline on synthetic inputs')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--stages', nargs='*', default=None, help='only run the stages starting with these names, e.g. text_processing wer_from_json')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help='processes of the normalisation and the scoring, one per cpu by default')
+    parser.add_argument('--save', default=None, help='save the results as this baseline name, or to this .json path')
+    parser.add_argument('--compare', default=None, help='compare the results against this baseline name or .json path')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'scale': args.scale,
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'stages': {},
+    }
+
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        stages = prepare(root, SCALES[args.scale], workers=args.workers)
+        print(f'generated the inputs in {time.perf_counter() - start:.1f}s\n')
+
+        if args.stages:
+            stages = [stage for stage in stages if any(stage['name'].startswith(prefix) for prefix in args.stages)]
+
+        print(f"{'stage':<28} {'items':>9} {'input mb':>9} {'s':>8} {'items/s':>11} {'mb/s':>7} {'peak mb':>8} {'stage mb':>9}")
+
+        for stage in stages:
+            result = results['stages'][stage['name']] = run_stage(stage, repeats=args.repeats)
+            print(
+                f"{stage['name']:<28} {result['items']:>9,} {result['input_mb']:>9.1f} {result['seconds']:>8.3f} "
+                f"{result['items_per_second']:>11,.0f} {result['mb_per_second']:>7.2f} {result['peak_rss_mb']:>8.1f} {result['stage_rss_mb']:>9.1f}"
+            )
+
+    if args.save:
+        path = baseline_path(args.save)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nsaved the results to {path}')
+
+    if args.compare:
+        with open(baseline_path(args.compare), 'rb') as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
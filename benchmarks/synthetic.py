@@ -0,0 +1,287 @@
+"""
+Generators of synthetic inputs shaped like the real data of the pipeline
+"""
+
+import json
+import random
+from typing import Dict, List
+
+
+def make_words(num_words: int, start: float=0.0, seed: int=0) -> List[Dict]:
+
+    '''
+    generate gladia style words with increasing timestamps
+    '''
+
+    rng = random.Random(seed)
+    words = []
+    t = start
+
+    for _ in range(num_words):
+        t += rng.uniform(0.02, 0.4)
+        length = rng.uniform(0.1, 0.6)
+        words.append({
+            "word": ' ' + ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9))),
+            "time_begin": t,
+            "time_end": t + length,
+            "confidence": round(rng.uniform(0.3, 1.0), 2)
+        })
+        t += length
+
+    return words
+
+
+def write_gladia_response(path: str, num_words: int, words_per_segment: int=10, num_speakers: int=2, seed: int=0) -> None:
+
+    '''
+    write a whisper zero response like output.json with the given number of words, including the duplicate prediction_raw tree
+
+    the file is written one segment at a time so even very large responses can be generated
+    '''
+
+    rng = random.Random(seed)
+    segments = []
+    t = 0.0
+
+    with open(path, 'w') as f:
+        f.write('{\n  "prediction": [')
+
+        for segment_idx, word_idx in enumerate(range(0, num_words, words_per_segment)):
+            words = make_words(min(words_per_segment, num_words - word_idx), start=t, seed=seed + segment_idx)
+            t = words[-1]['time_end'] + rng.uniform(0.5, 3.0)
+
+            segment = {
+                "words": words,
+                "language": "id",
+                "transcription": ''.join(word['word'] for word in words).strip(),
+                "confidence": round(rng.uniform(0.3, 1.0), 2),
+                "time_begin": words[0]['time_begin'],
+                "time_end": words[-1]['time_end'],
+                "speaker": rng.randrange(num_speakers),
+                "channel": "channel_0"
+            }
+            segments.append({key: segment[key] for key in ('speaker', 'channel', 'time_begin', 'time_end')})
+
+            f.write((',' if segment_idx else '') + '\n    ' + json.dumps(segment, indent=2).replace('\n', '\n    '))
+
+        # prediction_raw repeats the whole transcription, the parsers never need it
+        f.write('\n  ],\n  "prediction_raw": {\n    "metadata": {"total_transcription_time": 1.0},\n    "transcription": [')
+
+        for segment_idx, word_idx in enumerate(range(0, num_words, words_per_segment)):
+            words = make_words(min(words_per_segment, num_words - word_idx), seed=seed + segment_idx)
+            f.write((',' if segment_idx else '') + '\n      ' + json.dumps({"words": words, "transcription": ''.join(word['word'] for word in words)}))
+
+        f.write('\n    ],\n    "speaker_mapping": ' + json.dumps(segments) + '\n  }\n}\n')
+
+
+# character pools of every language branch of TextPostProcessingManager.process_data, each a list of (characters, weight)
+LATIN = 'abcdefghijklmnopqrstuvwxyz'
+PUNCTUATION = ",.?!-'\"():;"
+TEXT_POOLS = {
+    'en': [(LATIN, 10), (LATIN.upper(), 1), ('0123456789', 1), (PUNCTUATION, 1), ('éü“”', 0.2)],
+    'id': [(LATIN, 10), (LATIN.upper(), 1), ('0123456789', 1), (PUNCTUATION, 1)],
+    'tl': [(LATIN, 10), ('ñÑ', 0.5), ('0123456789', 1), (PUNCTUATION, 1)],
+    'zh': [([chr(c) for c in range(0x4E00, 0x9FCC)], 10), ('0123456789', 0.5), ('，。？！、', 1), (LATIN, 0.5)],
+    'vi': [(LATIN, 6), ([chr(c) for c in range(0x1EA0, 0x1EFA)], 3), ('àáâãèéêìíòóôõùúýăđ', 2), (PUNCTUATION, 1), ('0123456789', 0.5)],
+    'ta': [([chr(c) for c in range(0x0B82, 0x0BFB)], 10), (LATIN, 0.5), (PUNCTUATION, 0.5), ('0123456789', 0.5)],
+    'th': [([chr(c) for c in range(0x0E01, 0x0E5C)], 10), (LATIN, 0.5), ('0123456789', 0.5), (PUNCTUATION, 0.5)],
+}
+TEXT_POOLS['ms'] = TEXT_POOLS['id']
+TEXT_POOLS['zh_cmn'] = TEXT_POOLS['zh']
+TEXT_POOLS['zh_yue'] = TEXT_POOLS['zh']
+
+# english number words so the text to digit conversion has work to do
+EN_NUMBER_WORDS = ['one', 'two', 'three', 'four', 'five', 'twenty', 'thirty', 'hundred', 'thousand', 'million', 'eleven', 'nineteen', 'and', 'point']
+
+
+def make_text(language: str, num_words: int, seed: int=0) -> str:
+
+    '''
+    generate a noisy utterance in the script of the language, with punctuation, digits and characters from other scripts mixed in
+    '''
+
+    rng = random.Random(seed)
+    pools = TEXT_POOLS.get(language, TEXT_POOLS['en'])
+    chars = [pool for pool, _ in pools]
+    weights = [weight for _, weight in pools]
+    words = []
+
+    for _ in range(num_words):
+        if language == 'en' and rng.random() < 0.15:
+            words.append(rng.choice(EN_NUMBER_WORDS))
+            continue
+
+        length = rng.randint(1, 3) if language in ('zh', 'zh_cmn', 'zh_yue') else rng.randint(2, 9)
+        words.append(''.join(rng.choice(rng.choices(chars, weights)[0]) for _ in range(length)))
+
+    return ' '.join(words)
+
+
+# every kind of word text2digits treats differently, for the number conversion regression corpus
+NUMBER_TOKENS = (
+    ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve', 'thirteen', 'nineteen'] +
+    ['twenty', 'thirty', 'forty', 'fifty', 'ninety', 'hundred', 'thousand', 'million', 'billion', 'trillion', 'and', 'and', 'and'] +
+    ['oh', 'first', 'second', 'third', 'fourth', 'fifth', 'eighth', 'ninth', 'twelfth', 'twentieth', 'hundredth', 'thousandth', 'andth', 'zeroth'] +
+    ['0', '1', '7', '12', '100', '250', '2000', '1000000', '007', '0100', '1' * 30, '5' * 29 + '0']
+)
+OTHER_TOKENS = ['the', 'call', 'is', 'at', 'a', 'i', 'was', "it's", '#', 'th', 'ieth', 'thth', 'sixtyish']
+
+
+def make_number_text(num_words: int, seed: int=0, punctuation: str='') -> str:
+
+    '''
+    generate a sentence dense with number words, literals, ordinals and conjunctions in random case, optionally glued with punctuation
+    '''
+
+    rng = random.Random(seed)
+    words = []
+
+    for _ in range(num_words):
+        word = rng.choice(NUMBER_TOKENS) if rng.random() < 0.7 else rng.choice(OTHER_TOKENS)
+        if rng.random() < 0.1:
+            word = word.upper() if rng.random() < 0.5 else word.capitalize()
+        words.append(word)
+
+    text = words[0] if words else ''
+    for word in words[1:]:
+        glue = rng.choice(punctuation) if punctuation and rng.random() < 0.2 else ' ' * rng.randint(1, 2)
+        text += glue + word
+
+    return text
+
+
+def perturb_words(text: str, error_rate: float, rng: random.Random) -> str:
+
+    '''
+    a hypothesis of the text with random substitutions, deletions and insertions
+    '''
+
+    words = []
+    for word in text.split(' '):
+        roll = rng.random()
+        if roll < error_rate / 3:
+            continue
+        elif roll < 2 * error_rate / 3:
+            words.append(word[::-1] + 'x')
+        elif roll < error_rate:
+            words.extend([word, rng.choice(['uh', 'the', 'a'])])
+        else:
+            words.append(word)
+
+    return ' '.join(words)
+
+
+def write_scored_manifest(
+    path: str,
+    num_utterances: int,
+    language: str='en',
+    words_per_utterance: int=15,
+    error_rate: float=0.15,
+    vocabulary_size: int=None,
+    seed: int=0,
+) -> None:
+
+    '''
+    write a NeMo manifest with a reference "text" and a perturbed "pred_str" per line, like the output of CombineManifest
+
+    vocabulary_size: if set the words are drawn from a fixed vocabulary with zipf frequencies, like real speech, instead of being random
+    '''
+
+    rng = random.Random(seed)
+
+    if vocabulary_size:
+        vocabulary = make_text(language, vocabulary_size, seed=seed).split(' ')
+        frequencies = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for idx in range(num_utterances):
+            num_words = rng.randint(1, 2 * words_per_utterance)
+            if vocabulary_size:
+                text = ' '.join(rng.choices(vocabulary, frequencies, k=num_words))
+            else:
+                text = make_text(language, num_words, seed=seed * 1_000_003 + idx)
+            pred = perturb_words(text, error_rate, rng)
+            # stray whitespace, which the jiwer transforms strip and collapse
+            if rng.random() < 0.05:
+                pred = '  ' + pred.replace(' ', '   ', 1) + ' '
+            f.write(json.dumps({'audio_filepath': f'audio/{idx:08d}.wav', 'duration': 1.0, 'text': text, 'pred_str': pred}, ensure_ascii=False) + '\n')
+
+
+def write_nemo_manifest(path: str, num_utterances: int, language: str='en', words_per_utterance: int=15, seed: int=0) -> None:
+
+    '''
+    write a NeMo manifest of short clips, {"audio_filepath", "duration", "text"} per line, the input of BatchTranscribeAudio and CombineManifest
+    '''
+
+    rng = random.Random(seed)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for idx in range(num_utterances):
+            num_words = rng.randint(1, 2 * words_per_utterance)
+            text = make_text(language, num_words, seed=seed * 1_000_003 + idx)
+            f.write(json.dumps({'audio_filepath': f'audio/{idx:08d}.wav', 'duration': round(num_words * 0.4, 2), 'text': text}, ensure_ascii=False) + '\n')
+
+
+def write_whisper_zero_manifest(path: str, nemo_manifest: str, error_rate: float=0.15, max_segments: int=3, seed: int=0) -> None:
+
+    '''
+    write the output of BatchTranscribeAudio for the clips of a NeMo manifest, a json list of {"audio_filepath", "prediction"} where the
+    prediction is the perturbed reference split into up to max_segments gladia segments
+    '''
+
+    rng = random.Random(seed)
+
+    with open(nemo_manifest, 'rb') as f_in, open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+
+        for idx, line in enumerate(f_in):
+            entry = json.loads(line)
+            words = perturb_words(entry['text'], error_rate, rng).split(' ')
+            bounds = sorted(rng.sample(range(1, len(words)), min(max_segments, len(words)) - 1)) if len(words) > 1 else []
+            segments = [' '.join(words[begin:end]) for begin, end in zip([0] + bounds, bounds + [len(words)])]
+
+            prediction = [{'transcription': segment, 'language': 'en', 'confidence': round(rng.uniform(0.3, 1.0), 2)} for segment in segments]
+            f.write((',' if idx else '') + '\n' + json.dumps({'audio_filepath': entry['audio_filepath'], 'prediction': prediction}, ensure_ascii=False))
+
+        f.write('\n]\n')
+
+
+def write_long_audio_manifests(
+    word_level_path: str,
+    ref_path: str,
+    num_words: int,
+    language: str='id',
+    words_per_utterance: int=12,
+    error_rate: float=0.15,
+    seed: int=0,
+) -> None:
+
+    '''
+    write the two inputs of CombineWordToUtterances for one long recording: the word level manifest of ExtractSingleWord and the reference
+    manifest of utterances, {"audio_filepath", "duration", "start", "end", "text"}, spanning consecutive groups of the words
+
+    the predicted words are a perturbed copy of the reference, both are written one utterance at a time so millions of words fit
+    '''
+
+    rng = random.Random(seed)
+    t = 0.0
+
+    with open(word_level_path, 'w', encoding='utf-8') as f_words, open(ref_path, 'w', encoding='utf-8') as f_ref:
+        for idx, word_idx in enumerate(range(0, num_words, words_per_utterance)):
+            text = make_text(language, min(words_per_utterance, num_words - word_idx), seed=seed * 1_000_003 + idx)
+            start = t
+
+            for word in perturb_words(text, error_rate, rng).split():
+                t += rng.uniform(0.02, 0.4)
+                length = rng.uniform(0.1, 0.6)
+                f_words.write(json.dumps({'text': ' ' + word, 'start': t, 'end': t + length, 'confidence': round(rng.uniform(0.3, 1.0), 2)}, ensure_ascii=False) + '\n')
+                t += length
+
+            f_ref.write(json.dumps({
+                'audio_filepath': f'audio/{idx:08d}.wav',
+                'duration': round(t - start, 3),
+                'start': start,
+                'end': t + 0.01,
+                'text': text,
+            }, ensure_ascii=False) + '\n')
+            t += rng.uniform(0.5, 3.0)
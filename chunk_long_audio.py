@@ -0,0 +1,280 @@
+"""
+Split a long recording at low energy points, transcribe the chunks concurrently and stitch the words back into a single response
+"""
+
+import os
+import wave
+import logging
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from typing import Dict, List, Tuple
+
+from gladia_client import GladiaClient
+
+
+class ChunkedTranscribeLongAudio:
+
+    '''
+    transcribe a long audio file in chunks of about chunk_minutes, the chunks overlap by overlap_seconds on each side
+
+    every chunk owns the words whose midpoint falls between its cut points, so the words heard twice in the overlaps are only kept once
+
+    note that the speaker labels from the diarization are per chunk and are not matched across chunks
+    '''
+
+    def __init__(
+        self,
+        client: GladiaClient,
+        language: str,
+        chunk_minutes: float=10.0,
+        overlap_seconds: float=2.0,
+        search_seconds: float=30.0,
+        frame_ms: float=50.0,
+        max_in_flight: int=4,
+        dedup_tolerance: float=0.2,
+    ) -> None:
+
+        '''
+        client: the gladia client used to transcribe each chunk
+        language: target language of the audio
+        chunk_minutes: target length of a chunk
+        overlap_seconds: audio added on both sides of a cut point so the words cut in half are still heard in full
+        search_seconds: the cut point is the quietest frame within this many seconds of the target boundary
+        frame_ms: length of the frames the energy is computed over
+        max_in_flight: number of chunks transcribed at the same time
+        dedup_tolerance: seconds within which the same word from two chunks at a cut point is treated as a duplicate
+        '''
+
+        self.client = client
+        self.language = language
+        self.chunk_seconds = chunk_minutes * 60
+        self.overlap_seconds = overlap_seconds
+        self.search_seconds = search_seconds
+        self.frame_ms = frame_ms
+        self.max_in_flight = max(1, max_in_flight)
+        self.dedup_tolerance = dedup_tolerance
+
+
+    @staticmethod
+    def pcm_to_array(frames: bytes, sample_width: int, channels: int) -> np.ndarray:
+
+        '''
+        convert the raw pcm bytes into a float array of shape (num_samples, channels)
+        '''
+
+        if sample_width == 1:
+            # 8-bit wav is unsigned
+            samples = np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0
+        elif sample_width == 2:
+            samples = np.frombuffer(frames, dtype='<i2').astype(np.float32)
+        elif sample_width == 3:
+            # 24-bit samples go into the top 3 bytes of an int32, the arithmetic shift brings them back down with their sign
+            padded = np.zeros((len(frames) // 3, 4), dtype=np.uint8)
+            padded[:, 1:] = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+            samples = (padded.view('<i4')[:, 0] >> 8).astype(np.float32)
+        elif sample_width == 4:
+            samples = np.frombuffer(frames, dtype='<i4').astype(np.float32)
+        else:
+            raise ValueError(f'unsupported sample width: {sample_width} bytes')
+
+        return samples.reshape(-1, channels)
+
+
+    def find_cut(self, w: wave.Wave_read, target: float, lower: float, upper: float) -> float:
+
+        '''
+        find the quietest frame around the target time, only the search window is read from the file
+        ---
+        w: the opened wav file
+        target: the ideal cut time in seconds
+        lower, upper: the cut is kept within these bounds
+        ---
+        returns: the cut time in seconds
+        '''
+
+        sample_rate = w.getframerate()
+        start = max(lower, target - self.search_seconds)
+        end = min(upper, target + self.search_seconds)
+
+        if end <= start:
+            return target
+
+        w.setpos(int(start * sample_rate))
+        samples = self.pcm_to_array(w.readframes(int((end - start) * sample_rate)), w.getsampwidth(), w.getnchannels())
+
+        frame_len = max(1, int(sample_rate * self.frame_ms / 1000))
+        num_frames = len(samples) // frame_len
+
+        if num_frames == 0:
+            return target
+
+        energy = np.square(samples[:num_frames * frame_len]).mean(axis=1).reshape(num_frames, frame_len).mean(axis=1)
+
+        # among equally quiet frames, prefer the one nearest to the target
+        frame_centres = start + (np.arange(num_frames) + 0.5) * frame_len / sample_rate
+        quietest = np.flatnonzero(energy <= energy.min() * 1.0001 + 1e-9)
+        best = quietest[np.argmin(np.abs(frame_centres[quietest] - target))]
+
+        return float(frame_centres[best])
+
+
+    def plan_chunks(self, audio_filepath: str) -> Tuple[float, List[Tuple[float, float, float, float]]]:
+
+        '''
+        pick the cut points of the long audio
+        ---
+        returns: the duration of the audio, and for every chunk (audio start, audio end, owned start, owned end) in seconds
+        '''
+
+        with wave.open(audio_filepath, 'rb') as w:
+            duration = w.getnframes() / w.getframerate()
+
+            cuts = [0.0]
+            while duration - cuts[-1] > self.chunk_seconds * 1.5:
+                target = cuts[-1] + self.chunk_seconds
+                # keep every chunk at least half the target length
+                cuts.append(self.find_cut(w, target, lower=cuts[-1] + self.chunk_seconds / 2, upper=duration))
+            cuts.append(duration)
+
+        chunks = []
+        for owned_start, owned_end in zip(cuts[:-1], cuts[1:]):
+            chunks.append((
+                max(0.0, owned_start - self.overlap_seconds),
+                min(duration, owned_end + self.overlap_seconds),
+                owned_start,
+                owned_end,
+            ))
+
+        return duration, chunks
+
+
+    @staticmethod
+    def write_chunk(audio_filepath: str, chunk_filepath: str, start: float, end: float) -> None:
+
+        '''
+        copy the pcm frames between start and end into a new wav file without decoding them
+        '''
+
+        with wave.open(audio_filepath, 'rb') as src:
+            sample_rate = src.getframerate()
+            src.setpos(int(start * sample_rate))
+            frames = src.readframes(int((end - start) * sample_rate))
+
+            with wave.open(chunk_filepath, 'wb') as dst:
+                dst.setnchannels(src.getnchannels())
+                dst.setsampwidth(src.getsampwidth())
+                dst.setframerate(sample_rate)
+                dst.writeframes(frames)
+
+
+    def transcribe_chunk(self, audio_filepath: str, tmp_dir: str, idx: int, start: float, end: float) -> Dict:
+
+        '''
+        cut out a single chunk and transcribe it
+        '''
+
+        chunk_filepath = os.path.join(tmp_dir, f'chunk_{idx:04d}.wav')
+        self.write_chunk(audio_filepath, chunk_filepath, start, end)
+
+        try:
+            return self.client.transcribe(input_audio_path=chunk_filepath, language=self.language, duration=end - start)
+        finally:
+            os.remove(chunk_filepath)
+
+
+    def stitch(self, responses: List[Dict], chunks: List[Tuple[float, float, float, float]]) -> Dict:
+
+        '''
+        shift the timestamps of every chunk response by the chunk offset and keep only the words owned by the chunk
+        ---
+        returns: a single response in the same shape as a whole file transcription
+        '''
+
+        prediction = []
+        chunk_info = []
+        last_word = None
+
+        for idx, (response, (start, end, owned_start, owned_end)) in enumerate(zip(responses, chunks)):
+            # the first and last chunks own everything before and after them
+            lower = owned_start if idx > 0 else float('-inf')
+            upper = owned_end if idx < len(chunks) - 1 else float('inf')
+
+            for segment in response.get('prediction', []):
+                words = []
+
+                for word in segment['words']:
+                    shifted = dict(word, time_begin=word['time_begin'] + start, time_end=word['time_end'] + start)
+                    midpoint = (shifted['time_begin'] + shifted['time_end']) / 2
+
+                    if not lower <= midpoint < upper:
+                        continue
+
+                    # the same word transcribed by both chunks with slightly different timestamps
+                    if (
+                        last_word is not None
+                        and shifted['word'].strip() == last_word['word'].strip()
+                        and abs(shifted['time_begin'] - last_word['time_begin']) <= self.dedup_tolerance
+                    ):
+                        continue
+
+                    words.append(shifted)
+                    last_word = shifted
+
+                if not words:
+                    continue
+
+                prediction.append(dict(
+                    segment,
+                    words=words,
+                    transcription=''.join(word['word'] for word in words).strip(),
+                    time_begin=words[0]['time_begin'],
+                    time_end=words[-1]['time_end'],
+                ))
+
+            chunk_info.append({
+                'time_begin': start,
+                'time_end': end,
+                'owned_time_begin': owned_start,
+                'owned_time_end': owned_end,
+                'metadata': response.get('prediction_raw', {}).get('metadata'),
+            })
+
+        return {
+            'prediction': prediction,
+            'prediction_raw': {'chunks': chunk_info},
+        }
+
+
+    def transcribe(self, audio_filepath: str) -> Dict:
+
+        '''
+        main method to transcribe the long audio in chunks, a file the wave module cannot read (float, extensible or not a wav) is sent whole
+        '''
+
+        try:
+            duration, chunks = self.plan_chunks(audio_filepath=audio_filepath)
+        except (wave.Error, EOFError) as e:
+            logging.getLogger('WARNING').warning(f'{audio_filepath}: cannot be split ({e}), uploading it whole')
+            return self.client.transcribe(input_audio_path=audio_filepath, language=self.language)
+
+        print(f'{audio_filepath}: {duration:.1f}s split into {len(chunks)} chunks')
+
+        with tempfile.TemporaryDirectory() as tmp_dir, ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = [
+                executor.submit(self.transcribe_chunk, audio_filepath, tmp_dir, idx, start, end)
+                for idx, (start, end, _, _) in enumerate(chunks)
+            ]
+
+            try:
+                responses = [future.result() for future in tqdm(futures)]
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return self.stitch(responses=responses, chunks=chunks)
+
+
+    def __call__(self, audio_filepath: str) -> Dict:
+        return self.transcribe(audio_filepath=audio_filepath)
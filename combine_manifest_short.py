@@ -4,10 +4,12 @@ Combine manifest to append the predictions into the raw nemo manifest
 
 import os
 import json
+import logging
 from tqdm import tqdm
 from typing import Dict, List
 
-from text_processing import TextPostProcessingManager
+from text_processing import BatchTextPostProcessor
+from manifest_io import load_manifest, write_manifest
 
 class CombineManifest:
 
@@ -21,36 +23,28 @@ class CombineManifest:
         whisper_zero_manifest: str,
         output_manifest: str,
         language: str,
+        workers: int=None,
+        memo_size: int=100_000,
     ) -> None:
+
+        '''
+        workers: number of processes normalising the texts, None for one per cpu
+        memo_size: number of normalised texts remembered, repeated texts are only normalised once
+        '''
         
         self.raw_manifest = raw_manifest
         self.whisper_zero_manifest = whisper_zero_manifest
         self.output_manifest = output_manifest
         self.language = language
+        self.text_processor = BatchTextPostProcessor(language=self.language, workers=workers, memo_size=memo_size)
 
     def load_manifest_nemo(self, input_manifest_path: str) -> List[Dict[str, str]]:
 
         '''
-        loads the manifest file in Nvidia NeMo format to process the entries and store them into a list of dictionaries
-
-        the manifest file would contain entries in this format:
-
-        {"audio_filepath": "subdir1/xxx1.wav", "duration": 3.0, "text": "shan jie is an orange cat"}
-        {"audio_filepath": "subdir1/xxx2.wav", "duration": 4.0, "text": "shan jie's orange cat is chonky"}
-        ---
-
-        input_manifest_path: the manifest path that contains the information of the audio clips of interest
-        ---
-        returns: a list of dictionaries of the information in the input manifest file
+        loads the manifest file in Nvidia NeMo format into a list of dictionaries, see manifest_io.load_manifest
         '''
 
-        dict_list = []
-
-        with open(input_manifest_path, 'rb') as f:
-            for line in f:
-                dict_list.append(json.loads(line))
-
-        return dict_list
+        return load_manifest(input_manifest_path)
     
     def load_whisper_zero_manifest(self, input_manifest_path: str) -> Dict[str, str]:
 
@@ -74,34 +68,37 @@ class CombineManifest:
                 temp_transcription_list.append(pred['transcription'])
 
             final_transciption = ' '.join(temp_transcription_list)
-            final_transciption_cleaned = TextPostProcessingManager(
-                language=self.language
-            ).process_data(text=final_transciption)
             transcription_dict[entry['audio_filepath']] = {
                 'pred_str_raw': final_transciption,
-                'pred_str': final_transciption_cleaned
             }
 
+        # normalise all the predictions in one batch
+        cleaned = self.text_processor.process_batch(entry['pred_str_raw'] for entry in transcription_dict.values())
+        for entry, final_transciption_cleaned in zip(transcription_dict.values(), cleaned):
+            entry['pred_str'] = final_transciption_cleaned
+
         return transcription_dict
     
     def combine_manifest(self) -> None:
 
         # load the manifests
         manifest_nemo = self.load_manifest_nemo(input_manifest_path=self.raw_manifest)
-        pred_transcription_dict = self.load_whisper_zero_manifest(input_manifest_path=self.whisper_zero_manifest)
 
-        for entry in tqdm(manifest_nemo):
+        try:
+            pred_transcription_dict = self.load_whisper_zero_manifest(input_manifest_path=self.whisper_zero_manifest)
+            cleaned = self.text_processor.process_batch(entry['text'] for entry in manifest_nemo)
+        finally:
+            logging.getLogger('INFO').info(f'text normalisation: {self.text_processor.stats()}')
+            self.text_processor.close()
+
+        for entry, text in zip(tqdm(manifest_nemo), cleaned):
             entry['text_raw'] = entry['text']
-            entry['text'] = TextPostProcessingManager(
-                language=self.language
-            ).process_data(text=entry['text'])
+            entry['text'] = text
             entry['pred_str'] = pred_transcription_dict[entry['audio_filepath']]['pred_str']
             entry['pred_str_raw'] = pred_transcription_dict[entry['audio_filepath']]['pred_str_raw']
 
         # export the manifest file
-        with open(self.output_manifest, 'w+', encoding='utf-8') as f:
-            for data in manifest_nemo:
-                f.write(json.dumps(data, ensure_ascii=False) + '\n')
+        write_manifest(self.output_manifest, manifest_nemo)
 
     def __call__(self) -> None:
         return self.combine_manifest()
@@ -3,9 +3,14 @@ combine the words into utterances level based on the ground truth
 """
 
 import os
-import json
+import numpy as np
 from tqdm import tqdm
-from typing import Dict, List
+from typing import Dict, List, Sequence
+
+from text_processing import TextPostProcessingManager
+from word_store import WordTimestampStore, is_word_store
+from word_assignment import WordSegmentAssigner
+from manifest_io import ManifestWriter, load_manifest
 
 class CombineWordToUtterances:
 
@@ -13,62 +18,97 @@ class CombineWordToUtterances:
     main class to do the combination
     '''
 
-    def __init__(self, ref_manifest: str, word_level_manifest: str, output_manifest: str, language: str) -> None:
+    def __init__(self, ref_manifest: str, word_level_manifest: str, output_manifest: str, language: str, rule: str='midpoint') -> None:
+
+        '''
+        ref_manifest: nemo manifest of the reference utterances with their "start" and "end" in the long audio
+        word_level_manifest: the word level manifest from ExtractSingleWord, or a word store directory
+        output_manifest: the reference manifest with the predicted transcription of every utterance
+        language: language of the normalisation applied to the reference and the prediction
+        rule: how the words are assigned to the utterances, 'midpoint', 'start' or 'max_overlap' (see word_assignment.py)
+        '''
+
         self.ref_manifest = ref_manifest
         self.word_level_manifest = word_level_manifest
         self.output_manifest = output_manifest
         self.language = language
+        self.rule = rule
 
     
     def load_manifest_nemo(self, input_manifest_path: str) -> List[Dict[str, str]]:
 
         '''
-        loads the manifest file in Nvidia NeMo format to process the entries and store them into a list of dictionaries
+        loads the manifest file in Nvidia NeMo format into a list of dictionaries, see manifest_io.load_manifest
+        '''
 
-        the manifest file would contain entries in this format:
+        return load_manifest(input_manifest_path)
 
-        {"audio_filepath": "subdir1/xxx1.wav", "duration": 3.0, "text": "shan jie is an orange cat"}
-        {"audio_filepath": "subdir1/xxx2.wav", "duration": 4.0, "text": "shan jie's orange cat is chonky"}
-        ---
+    def load_word_level(self, word_level_manifest: str) -> Sequence[Dict]:
 
-        input_manifest_path: the manifest path that contains the information of the audio clips of interest
-        ---
-        returns: a list of dictionaries of the information in the input manifest file
+        '''
+        loads the word level words, either from the json manifest or memory-mapped from a word store directory (see word_store.py)
         '''
 
-        dict_list = []
-
-        with open(input_manifest_path, 'rb') as f:
-            for line in f:
-                dict_list.append(json.loads(line))
+        if is_word_store(word_level_manifest):
+            return WordTimestampStore(word_level_manifest)
 
-        return dict_list
+        return self.load_manifest_nemo(input_manifest_path=word_level_manifest)
     
     def combine_word_level_to_utt(self) -> None:
 
         '''
         main method to combine the words into utterances based on the reference manifest
+
+        the reference utterances can be in any order and can overlap, the words are assigned with a sorted index instead of a linear walk
         '''
 
         # load both the manifests
         ref_manifest = self.load_manifest_nemo(input_manifest_path=self.ref_manifest)
-        word_level_manifest = self.load_manifest_nemo(input_manifest_path=self.word_level_manifest)
+        word_level_manifest = self.load_word_level(word_level_manifest=self.word_level_manifest)
+
+        if isinstance(word_level_manifest, WordTimestampStore):
+            word_start, word_end = word_level_manifest.start, word_level_manifest.end
+            get_text = word_level_manifest.text
+        else:
+            word_start = np.fromiter((word['start'] for word in word_level_manifest), dtype=np.float64, count=len(word_level_manifest))
+            word_end = np.fromiter((word['end'] for word in word_level_manifest), dtype=np.float64, count=len(word_level_manifest))
+            get_text = lambda idx: word_level_manifest[idx]['text']
+
+        ref_start = np.fromiter((entry['start'] for entry in ref_manifest), dtype=np.float64, count=len(ref_manifest))
+        ref_end = np.fromiter((entry['end'] for entry in ref_manifest), dtype=np.float64, count=len(ref_manifest))
+
+        offsets, word_idx = WordSegmentAssigner(word_start=word_start, word_end=word_end).assign(ref_start=ref_start, ref_end=ref_end, rule=self.rule)
+
+        text_processor = TextPostProcessingManager(language=self.language)
+
+        # export the manifest file
+        with ManifestWriter(self.output_manifest) as writer:
+            for ref_idx, entry_ref in enumerate(tqdm(ref_manifest)):
+                utterance_word_list = [get_text(idx).lstrip() for idx in word_idx[offsets[ref_idx]:offsets[ref_idx + 1]]]
+
+                entry_ref['text_raw'] = entry_ref['text']
+                entry_ref['text'] = text_processor.process_data(text=entry_ref['text'])
+                entry_ref['pred_str_raw'] = ' '.join(utterance_word_list)
+                entry_ref['pred_str'] = text_processor.process_data(text=entry_ref['pred_str_raw'])
+
+                writer.write(entry_ref)
 
-        word_level_idx = 0
-        
-        for entry_ref in tqdm(ref_manifest):
-            utterance_word_list = []
+    def __call__(self) -> None:
+        return self.combine_word_level_to_utt()
 
-            # check if the start of the word level entry falls between the range in the ref entry
-            while entry_ref['start'] > word_level_manifest[word_level_idx]['start']:
-                word_level_idx += 1
 
-            while entry_ref['start'] <= word_level_manifest[word_level_idx]['start']:
+if __name__ == '__main__':
 
-                utterance_word_list.append(word_level_manifest[word_level_idx]['text'].lstrip())
-                word_level_idx += 1
+    ROOT = '/datasets/mms/transcribed/mms_transcribed_batch_2/test_split'
 
-                if entry_ref['end'] < word_level_manifest[word_level_idx]['end']:
-                    break
+    REF_MANIFEST = 'CHDIR_495_2022-05-07_19.json'
+    WORD_LEVEL_MANIFEST = 'CHDIR_495_2022-05-07_19_word_level.json'
+    OUTPUT_MANIFEST = 'CHDIR_495_2022-05-07_19_with_pred.json'
 
-            
\ No newline at end of file
+    c = CombineWordToUtterances(
+        ref_manifest=os.path.join(ROOT, REF_MANIFEST),
+        word_level_manifest=os.path.join(ROOT, WORD_LEVEL_MANIFEST),
+        output_manifest=os.path.join(ROOT, OUTPUT_MANIFEST),
+        language='id',
+        rule='midpoint',
+    )()
@@ -4,18 +4,29 @@ Pull all the single word and the timestamps of the words
 
 import os
 import json
+import ijson
 from tqdm import tqdm
 from typing import Dict, List
 
+from manifest_io import ManifestWriter, write_manifest
+
 class ExtractSingleWord:
 
     '''
     extract single word
     '''
 
-    def __init__(self, input_manifest: str, output_manifest: str) -> None:
+    def __init__(self, input_manifest: str, output_manifest: str, streaming: bool=True) -> None:
+
+        '''
+        input_manifest: the raw response from whisper zero
+        output_manifest: the word level manifest, one word per line
+        streaming: parse the response incrementally so the memory use does not grow with the length of the recording
+        '''
+
         self.input_manifest = input_manifest
         self.output_manifest = output_manifest
+        self.streaming = streaming
 
     
     def extract(self) -> None:
@@ -41,12 +52,31 @@ class ExtractSingleWord:
                 word_list.append(temp)
         
         # export manifest
-        with open(self.output_manifest, 'w+', encoding='utf-8') as f:
-            for word in word_list:
-                f.write(json.dumps(word, ensure_ascii=False) + '\n')
+        write_manifest(self.output_manifest, word_list)
+
+    def extract_streaming(self) -> None:
+
+        """
+        same output as extract, but walks prediction[*].words[*] as a stream and writes every word as soon as it is parsed,
+        the prediction_raw tree is scanned over without being built so the memory use stays flat
+        """
+
+        with open(self.input_manifest, 'rb') as f_in, ManifestWriter(self.output_manifest) as writer:
+            for word in tqdm(ijson.items(f_in, 'prediction.item.words.item', use_float=True)):
+                temp = {
+                    "text": word['word'],
+                    "start": word['time_begin'],
+                    "end": word['time_end'],
+                    "confidence": word['confidence']
+                }
+
+                writer.write(temp)
 
     def __call__(self) -> None:
-        self.extract()
+        if self.streaming:
+            self.extract_streaming()
+        else:
+            self.extract()
 
 
 if __name__ == '__main__':
@@ -1,10 +1,16 @@
 import os
 from typing import List, Dict
 from jiwer import cer, wer, mer
-import json
 
 import logging
 
+import numpy as np
+
+from wer_scorer import StreamingWERScorer
+from wer_bootstrap import WERBootstrap
+from alignment_report import AlignmentReport
+from manifest_io import load_manifest
+
 # Setup logging in a nice readable format
 logging.basicConfig(level=logging.INFO,
                     format='[%(levelname)5s][%(asctime)s][%(name)s]: %(message)s',
@@ -58,72 +64,67 @@ class WERFromJSON:
     to get the WER from the JSON file with key "prediction" and "ground truth" after running the evaluate_model.py script to generate the json file
     '''
 
-    def __init__(self, manifest_path:str) -> None:
+    def __init__(self, manifest_path:str, workers: int=None, utterance_output_path: str=None, num_resamples: int=0, report_path: str=None) -> None:
     
         '''
         input_json_dir (str): the json directory that was generated from evaluate_model.py
+        workers: number of scoring processes, None for one per cpu
+        utterance_output_path: if set, the error counts of every utterance are written there as json lines
+        num_resamples: if set, the bootstrap confidence intervals of the WER and CER are reported as well
+        report_path: if set, the json report of the most frequent substitutions, deletions and insertions is written there, with a tsv next to it
         '''
 
         self.manifest_path = manifest_path
+        self.workers = workers
+        self.utterance_output_path = utterance_output_path
+        self.num_resamples = num_resamples
+        self.report_path = report_path
 
     def load_manifest_nemo(self, input_manifest_path: str) -> List[Dict[str, str]]:
 
         '''
-        loads the manifest file in Nvidia NeMo format to process the entries and store them into a list of dictionaries
-
-        the manifest file would contain entries in this format:
-
-        {"audio_filepath": "subdir1/xxx1.wav", "duration": 3.0, "text": "shan jie is an orange cat"}
-        {"audio_filepath": "subdir1/xxx2.wav", "duration": 4.0, "text": "shan jie's orange cat is chonky"}
-        ---
-
-        input_manifest_path: the manifest path that contains the information of the audio clips of interest
-        ---
-        returns: a list of dictionaries of the information in the input manifest file
+        loads the manifest file in Nvidia NeMo format into a list of dictionaries, see manifest_io.load_manifest
         '''
 
-        dict_list = []
-
-        with open(input_manifest_path, 'rb') as f:
-            for line in f:
-                dict_list.append(json.loads(line))
-
-        return dict_list
+        return load_manifest(input_manifest_path)
         
 
-    def get_wer_result(self) -> None:
+    def get_wer_result(self) -> Dict:
 
         '''
         main method to print the WER and CER
         '''
 
-        # load the dict list that was loaded from the json manifest file
-        data = self.load_manifest_nemo(input_manifest_path=self.manifest_path)
-
-        # get the pred and the ground truth list
-        pred_list = [pred['pred_str'] for pred in data]
-        ground_truth_list = [ref['text'] for ref in data]
-
-        # compute the WER
-        get_wer = WER(
-            predictions=pred_list,
-            references=ground_truth_list
-        )
-
-        get_cer = CER(
-            predictions=pred_list,
-            references=ground_truth_list
-        )
-
-        get_mer = MER(
-            predictions=pred_list,
-            references=ground_truth_list
+        # stream the manifest and align every utterance once for all the metrics
+        scorer = StreamingWERScorer(
+            manifest_path=self.manifest_path,
+            workers=self.workers,
+            utterance_output_path=self.utterance_output_path,
+            keep_counts=self.num_resamples > 0,
         )
+        result = scorer()
 
         print()
-        logging.getLogger('INFO').info("Test WER: {:.5f}".format(get_wer.compute()))
-        logging.getLogger('INFO').info("Test CER: {:.5f}".format(get_cer.compute()))
-        logging.getLogger('INFO').info("Test Word Acc: {:.5f}\n".format(1-get_mer.compute()))
+        logging.getLogger('INFO').info("Test WER: {:.5f}".format(result['wer']))
+        logging.getLogger('INFO').info("Test CER: {:.5f}".format(result['cer']))
+        logging.getLogger('INFO').info("Test Word Acc: {:.5f}\n".format(result['word_acc']))
+
+        if self.num_resamples > 0:
+            bootstrap = WERBootstrap(num_resamples=self.num_resamples)
+
+            for level, metric in (('word', 'wer'), ('char', 'cer')):
+                interval = bootstrap.confidence_interval(
+                    errors=np.array(scorer.counts[level]['errors']),
+                    ref_len=np.array(scorer.counts[level]['ref_len']),
+                )
+                result[f'{metric}_interval'] = interval
+                logging.getLogger('INFO').info("Test {} {:.0%} CI: [{:.5f}, {:.5f}]".format(metric.upper(), interval['confidence'], interval['low'], interval['high']))
+
+        if self.report_path is not None:
+            AlignmentReport(manifest_path=self.manifest_path)(report_path=self.report_path)
+            logging.getLogger('INFO').info(f'alignment report written to {self.report_path}')
+
+        return result
 
 
     def __call__(self):
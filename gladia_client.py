@@ -0,0 +1,369 @@
+"""
+Shared client for the whisper zero (gladia) transcription api, used by both the short clip and the long audio scripts
+"""
+
+import os
+import time
+import random
+import logging
+import requests
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple, Union
+
+from rate_limiter import TokenBucket
+from response_cache import ResponseCache
+from audio_encoder import AudioEncoder, EncodedAudio
+from request_telemetry import RequestTelemetry
+
+GLADIA_API_URL = 'https://api.gladia.io/audio/text/audio-transcription/'
+
+# failure kinds that are worth another attempt
+RETRYABLE_KINDS = ('network', 'rate_limited', 'server_error')
+
+
+class TranscriptionError(Exception):
+
+    '''
+    raised when a clip could not be transcribed
+
+    kind is one of:
+        network: connection error, timeout or any other transport failure of requests, e.g. a dropped response body
+        rate_limited: http 429
+        server_error: http 5xx
+        auth: http 401/403, every other request will fail the same way
+        client_error: any other http 4xx, or an audio file that cannot be read
+        invalid_response: http 2xx but the body is not json or has no prediction
+    '''
+
+    def __init__(self, kind: str, message: str, status_code: Optional[int]=None, attempts: int=1) -> None:
+        super().__init__(f'[{kind}] {message} (status: {status_code}, attempts: {attempts})')
+        self.kind = kind
+        self.message = message
+        self.status_code = status_code
+        self.attempts = attempts
+
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in RETRYABLE_KINDS
+
+
+class GladiaClient:
+
+    '''
+    pooled http client with keep-alive connections, timeouts, and exponential backoff with jitter that respects Retry-After
+    '''
+
+    def __init__(
+        self,
+        api_key: str=None,
+        api_url: str=GLADIA_API_URL,
+        connect_timeout: float=10.0,
+        read_timeout: float=600.0,
+        max_retries: int=5,
+        backoff_base: float=1.0,
+        backoff_max: float=60.0,
+        pool_maxsize: int=10,
+        rate_limiter: TokenBucket=None,
+        cache: ResponseCache=None,
+        encoder: AudioEncoder=None,
+        telemetry: RequestTelemetry=None,
+    ) -> None:
+
+        '''
+        api_key: the gladia api key, defaults to the API_KEY environment variable
+        api_url: endpoint of the transcription api, can be pointed to a local stand-in server for testing
+        connect_timeout: seconds to wait for the connection to be established
+        read_timeout: seconds to wait for the response once the upload is done, long audio takes a while
+        max_retries: number of retries after the first attempt for the retryable failures
+        backoff_base: the delay before the first retry, doubled on every retry
+        backoff_max: upper bound of the backoff delay
+        pool_maxsize: number of keep-alive connections kept open, should be at least the number of requests in flight
+        rate_limiter: optional token bucket, one token is taken for every attempt
+        cache: optional response cache, hits are returned without any network call
+        encoder: optional audio encoder, the audio is compressed before the upload instead of sending the raw wav
+        telemetry: optional collector of the size, timing, status and retries of every request
+        '''
+
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.encoder = encoder
+        self.telemetry = telemetry
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'x-gladia-key': api_key if api_key is not None else os.environ.get("API_KEY"),
+        })
+
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+
+        '''
+        parse the Retry-After header, either a number of seconds or a http date
+        ---
+        returns: the number of seconds to wait, or None if the header is missing or malformed
+        '''
+
+        if not value:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+    def backoff(self, attempt: int, retry_after: Optional[float]=None) -> float:
+
+        '''
+        exponential backoff with full jitter, never shorter than what the server asked for in Retry-After
+        ---
+        attempt: the number of attempts made so far, starting from 1
+        ---
+        returns: the number of seconds to wait before the next attempt
+        '''
+
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        return delay
+
+
+    @staticmethod
+    def classify(response: requests.Response) -> Tuple[Optional[str], Optional[Dict]]:
+
+        '''
+        classify a http response
+        ---
+        returns: the failure kind (None on success) and the parsed json body (None if it is not json)
+        '''
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+
+        status = response.status_code
+
+        if status == 429:
+            return 'rate_limited', body
+        if status >= 500:
+            return 'server_error', body
+        if status in (401, 403):
+            return 'auth', body
+        if status >= 400:
+            return 'client_error', body
+        if not isinstance(body, dict) or 'prediction' not in body:
+            return 'invalid_response', body
+
+        return None, body
+
+
+    @staticmethod
+    def build_files(params: Dict, audio: Tuple) -> Dict:
+
+        '''
+        build the multipart form of the request
+        '''
+
+        return {
+            'audio': audio,
+            'toggle_diarization': (None, params['toggle_diarization']),
+            'language_behaviour': params['language_behaviour'],
+            'language': params['language'],
+        }
+
+
+    def post(self, input_audio_path: str, params: Dict, encoded: EncodedAudio=None, duration: float=None) -> Dict:
+
+        '''
+        upload the audio file with the request parameters, retrying the retryable failures
+        ---
+        encoded: the compressed audio to upload in place of the raw file
+        duration: seconds of audio, only used by the telemetry
+        ---
+        returns: the json response of a successful transcription
+        '''
+
+        attempt = 0
+        started = time.perf_counter()
+
+        while True:
+            attempt += 1
+            retry_after = None
+            ttfb = status_code = None
+
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            attempt_started = time.perf_counter()
+
+            try:
+                # reopen (or rewind) the file on every attempt so the upload starts from the beginning
+                if encoded is not None:
+                    encoded.f.seek(0)
+                    response = self.session.post(self.api_url, files=self.build_files(params, (encoded.filename, encoded.f, encoded.mime_type)), timeout=self.timeout)
+                else:
+                    with open(input_audio_path, 'rb') as f:
+                        response = self.session.post(self.api_url, files=self.build_files(params, (input_audio_path, f, 'audio/wav')), timeout=self.timeout)
+
+                # the body is read before post returns, elapsed stops at the headers
+                latency = time.perf_counter() - attempt_started
+                ttfb = response.elapsed.total_seconds()
+                status_code = response.status_code
+
+                kind, body = self.classify(response)
+                if kind is None:
+                    self.record(input_audio_path, encoded, attempt, started, latency, ttfb, status_code, duration=duration)
+                    return body
+
+                error = TranscriptionError(kind=kind, message=str(body)[:500], status_code=response.status_code, attempts=attempt)
+                retry_after = self.parse_retry_after(response.headers.get('Retry-After'))
+
+            except requests.RequestException as e:
+                # connection errors, timeouts, and the rest of the transport failures such as a response body cut off mid-stream
+                latency = time.perf_counter() - attempt_started
+                error = TranscriptionError(kind='network', message=str(e), attempts=attempt)
+
+            except OSError as e:
+                # the audio file is missing or unreadable, no retry will change that
+                latency = time.perf_counter() - attempt_started
+                error = TranscriptionError(kind='client_error', message=f'cannot read the audio: {e}', attempts=attempt)
+
+            if not error.retryable or attempt > self.max_retries:
+                self.record(input_audio_path, encoded, attempt, started, latency, ttfb, status_code, error_kind=error.kind, duration=duration)
+                raise error
+
+            delay = self.backoff(attempt=attempt, retry_after=retry_after)
+            logging.getLogger('WARNING').warning(f'{input_audio_path}: {error}, retrying in {delay:.1f}s')
+            time.sleep(delay)
+
+
+    def record(
+        self,
+        input_audio_path: str,
+        encoded: Optional[EncodedAudio],
+        attempts: int,
+        started: float,
+        latency: float,
+        ttfb: Optional[float],
+        status_code: Optional[int],
+        error_kind: str=None,
+        duration: float=None,
+    ) -> None:
+
+        '''
+        pass a finished request to the telemetry, if any
+        '''
+
+        if self.telemetry is None:
+            return
+
+        self.telemetry.record(
+            input_audio_path=input_audio_path,
+            upload_bytes=encoded.bytes_after if encoded is not None else (os.path.getsize(input_audio_path) if os.path.exists(input_audio_path) else 0),
+            attempts=attempts,
+            total_seconds=time.perf_counter() - started,
+            latency=latency,
+            ttfb=ttfb,
+            status_code=status_code,
+            error_kind=error_kind,
+            duration=duration,
+        )
+
+
+    def transcribe(
+        self,
+        input_audio_path: str,
+        language: str,
+        language_behaviour: str='manual',
+        toggle_diarization: bool=True,
+        encoded: Union[EncodedAudio, 'Future[EncodedAudio]']=None,
+        duration: float=None,
+    ) -> Dict:
+
+        '''
+        transcribe a single audio file, served from the response cache if the same audio was sent with the same parameters before
+        ---
+        encoded: the audio already (or being) compressed by the encoder, e.g. from encoder.submit() ahead of time, encoded here if not given
+        duration: seconds of audio for the telemetry, read from the file header if not given
+        ---
+        returns: the json response from whisper zero
+        ---
+        raises TranscriptionError if the clip could not be transcribed
+        '''
+
+        params = {
+            'toggle_diarization': toggle_diarization,
+            'language_behaviour': language_behaviour,
+            'language': language,
+        }
+
+        if self.cache is not None:
+            # a response of one endpoint (e.g. a staging server or a mock) must never be served for another
+            key_params = dict(params, api_url=self.api_url, **(self.encoder.cache_params() if self.encoder is not None else {}))
+            try:
+                cache_key = self.cache.make_key(input_audio_path=input_audio_path, params=key_params)
+            except OSError as e:
+                raise TranscriptionError(kind='client_error', message=f'cannot read the audio: {e}')
+            response = self.cache.get(cache_key)
+            if response is not None:
+                if self.telemetry is not None:
+                    self.telemetry.record_cache_hit()
+                if isinstance(encoded, Future):
+                    encoded.add_done_callback(lambda future: future.exception() is None and future.result().close())
+                elif encoded is not None:
+                    encoded.close()
+                return response
+
+        try:
+            if self.encoder is not None and encoded is None:
+                encoded = self.encoder.encode(input_audio_path)
+            elif isinstance(encoded, Future):
+                encoded = encoded.result()
+        except (RuntimeError, OSError, ValueError) as e:
+            # libsndfile cannot read the clip (corrupt, truncated or an unsupported format), the raw file goes up and the api decides
+            logging.getLogger('WARNING').warning(f'{input_audio_path}: could not be encoded ({e}), uploading it as it is')
+            encoded = None
+
+        try:
+            response = self.post(input_audio_path=input_audio_path, params=params, encoded=encoded, duration=duration)
+        finally:
+            if encoded is not None:
+                encoded.close()
+
+        if self.cache is not None:
+            self.cache.put(cache_key, response)
+
+        return response
+
+
+    def close(self) -> None:
+        self.session.close()
+
+        if self.encoder is not None:
+            self.encoder.close()
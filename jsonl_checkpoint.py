@@ -0,0 +1,187 @@
+"""
+Append-only JSONL checkpoint for the transcription responses, so a crashed run can be resumed without redoing the api calls
+"""
+
+import os
+import json
+from typing import Dict, Iterable, Iterator, Set
+
+
+class JSONLCheckpoint:
+
+    '''
+    writes one response per line as soon as it arrives, the file is flushed and fsync'd every few records
+    '''
+
+    def __init__(self, checkpoint_path: str, key: str='audio_filepath', fsync_every: int=20) -> None:
+
+        '''
+        checkpoint_path: path of the jsonl checkpoint file, created if it does not exist
+        key: field of the response that identifies the manifest entry
+        fsync_every: number of records written before the file is flushed and fsync'd to disk
+        '''
+
+        self.checkpoint_path = checkpoint_path
+        self.key = key
+        self.fsync_every = max(1, fsync_every)
+        self.pending = 0
+        self.f = None
+
+
+    def repair(self) -> None:
+
+        '''
+        drop a partially written last line left behind by a crash, so the next record starts on a fresh line
+        '''
+
+        if not os.path.exists(self.checkpoint_path):
+            return
+
+        with open(self.checkpoint_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+
+            if size == 0:
+                return
+
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+
+            # walk back to the end of the last complete line
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                block = f.read(step)
+                newline_idx = block.rfind(b'\n')
+                if newline_idx != -1:
+                    pos = pos - step + newline_idx + 1
+                    break
+                pos -= step
+
+            f.truncate(pos)
+
+
+    def load_completed(self) -> Set[str]:
+
+        '''
+        returns: the keys of the records already in the checkpoint
+        '''
+
+        completed = set()
+
+        if not os.path.exists(self.checkpoint_path):
+            return completed
+
+        with open(self.checkpoint_path, 'rb') as f:
+            for line in f:
+                try:
+                    completed.add(json.loads(line)[self.key])
+                except (ValueError, KeyError):
+                    # torn or foreign line, the entry is redone
+                    continue
+
+        return completed
+
+
+    def open(self) -> 'JSONLCheckpoint':
+        self.repair()
+        self.f = open(self.checkpoint_path, 'a', encoding='utf-8')
+        return self
+
+
+    def sync(self) -> None:
+
+        '''
+        push the buffered records to disk
+        '''
+
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.pending = 0
+
+
+    def append(self, record: Dict) -> None:
+
+        '''
+        write a single record to the checkpoint
+        '''
+
+        self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.pending += 1
+
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+
+    def close(self) -> None:
+        if self.f is not None:
+            self.sync()
+            self.f.close()
+            self.f = None
+
+
+    def __enter__(self) -> 'JSONLCheckpoint':
+        return self.open()
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+    def finalise(self, output_path: str, keys: Iterable[str]) -> None:
+
+        '''
+        write the records out as a single json list in the order of the given keys, same format as json.dump(..., indent=2)
+
+        only the byte offsets of the records are kept in memory, each record is read back and written out one at a time
+        ---
+        output_path: the final output file
+        keys: the keys in the order to be written, usually the manifest order
+        '''
+
+        offsets = {}
+
+        with open(self.checkpoint_path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    offsets[json.loads(line)[self.key]] = offset
+                except (ValueError, KeyError):
+                    pass
+                offset += len(line)
+
+        def records() -> Iterator[Dict]:
+            with open(self.checkpoint_path, 'rb') as src:
+                for key in keys:
+                    if key not in offsets:
+                        raise KeyError(f'{key} is missing from the checkpoint {self.checkpoint_path}')
+
+                    src.seek(offsets[key])
+                    yield json.loads(src.readline())
+
+        write_json_list(output_path, records())
+
+
+def write_json_list(output_path: str, records: Iterable[Dict]) -> None:
+
+    '''
+    write the records as a single json list, same format as json.dump(..., indent=2), one record at a time through a temporary file
+    '''
+
+    tmp_path = output_path + '.tmp'
+
+    with open(tmp_path, 'w') as dst:
+        dst.write('[')
+        first = True
+
+        for record in records:
+            # indent the record by one level to match a list dumped with indent=2
+            dst.write(('\n' if first else ',\n') + '  ' + json.dumps(record, indent=2).replace('\n', '\n  '))
+            first = False
+
+        # an empty list is dumped as []
+        dst.write(']' if first else '\n]')
+
+    os.replace(tmp_path, output_path)
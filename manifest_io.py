@@ -0,0 +1,325 @@
+"""
+Read and write NeMo manifests (one json object per line), shared by every script of the pipeline
+
+lines are parsed lazily with orjson when it is installed (the stdlib json otherwise), lines are always written by the stdlib json in the
+format of json.dumps(entry, ensure_ascii=False) so the output does not depend on what is installed, writes are buffered and go out in large blocks,
+.gz and .zst/.zstd manifests are compressed and decompressed on the fly, and a byte-offset index gives random access to line N
+"""
+
+import io
+import os
+import gzip
+import json
+import numpy as np
+from typing import Dict, IO, Iterable, Iterator, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_SUFFIXES = ('.gz',)
+ZSTD_SUFFIXES = ('.zst', '.zstd')
+
+# bytes read at once when indexing a manifest
+INDEX_BLOCK_BYTES = 4 * 1024**2
+
+# the bytes bytes.strip() removes, a line of only these is blank
+WHITESPACE_BYTES = np.frombuffer(b' \t\n\r\x0b\x0c', dtype=np.uint8)
+
+
+def loads(line: bytes) -> Dict:
+
+    '''
+    parse one manifest line, with orjson if available
+
+    note that orjson reads integers beyond 64 bits as floats, the stdlib json is used for a line orjson rejects
+    '''
+
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(line)
+
+
+def dumps(entry: Dict) -> bytes:
+
+    '''
+    encode one manifest line without the newline, exactly json.dumps(entry, ensure_ascii=False) in utf-8
+
+    orjson is not used here, its compact separators and float formatting would change the manifest format
+    '''
+
+    return json.dumps(entry, ensure_ascii=False).encode('utf-8')
+
+
+def is_compressed(manifest_path: str) -> bool:
+    return manifest_path.endswith(GZIP_SUFFIXES + ZSTD_SUFFIXES)
+
+
+def open_manifest(manifest_path: str, mode: str='rb') -> IO[bytes]:
+
+    '''
+    open the manifest as a binary file, decompressing or compressing by the file extension
+    ---
+    mode: 'rb', 'wb' or 'ab'
+    '''
+
+    if manifest_path.endswith(GZIP_SUFFIXES):
+        # a low level keeps the writes fast, the manifests are mostly repeated keys and compress well anyway
+        return gzip.open(manifest_path, mode, compresslevel=3)
+
+    if manifest_path.endswith(ZSTD_SUFFIXES):
+        if zstandard is None:
+            raise ImportError(f'zstandard is needed to read or write {manifest_path}, pip install zstandard')
+
+        f = zstandard.open(manifest_path, mode)
+        # the decompression reader has no efficient readline, buffer it for the line iteration
+        return io.BufferedReader(f) if 'r' in mode else f
+
+    return open(manifest_path, mode)
+
+
+def iter_manifest(manifest_path: str) -> Iterator[Dict]:
+
+    '''
+    yield the entries of the manifest one at a time, blank lines are skipped
+    '''
+
+    with open_manifest(manifest_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+def load_manifest(manifest_path: str) -> List[Dict]:
+
+    '''
+    loads the manifest file in Nvidia NeMo format to process the entries and store them into a list of dictionaries
+
+    the manifest file would contain entries in this format:
+
+    {"audio_filepath": "subdir1/xxx1.wav", "duration": 3.0, "text": "shan jie is an orange cat"}
+    {"audio_filepath": "subdir1/xxx2.wav", "duration": 4.0, "text": "shan jie's orange cat is chonky"}
+    ---
+
+    manifest_path: the manifest path that contains the information of the audio clips of interest
+    ---
+    returns: a list of dictionaries of the information in the input manifest file
+    '''
+
+    return list(iter_manifest(manifest_path))
+
+
+class ManifestWriter:
+
+    '''
+    buffered manifest writer, the encoded lines are collected and written out buffer_lines at a time
+    '''
+
+    def __init__(self, manifest_path: str, buffer_lines: int=1000, append: bool=False) -> None:
+
+        '''
+        manifest_path: the output manifest, compressed if it ends in .gz, .zst or .zstd
+        buffer_lines: number of lines held before they are written out together
+        append: add to the end of an existing manifest instead of replacing it
+        '''
+
+        self.manifest_path = manifest_path
+        self.buffer_lines = max(1, buffer_lines)
+        self.buffer = []
+        self.num_written = 0
+        self.f = open_manifest(manifest_path, 'ab' if append else 'wb')
+
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.f.write(b''.join(self.buffer))
+            self.buffer = []
+
+
+    def write(self, entry: Dict) -> None:
+        self.buffer.append(dumps(entry) + b'\n')
+        self.num_written += 1
+
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+
+
+    def write_many(self, entries: Iterable[Dict]) -> None:
+        for entry in entries:
+            self.write(entry)
+
+
+    def close(self) -> None:
+        if self.f is not None:
+            self.flush()
+            self.f.close()
+            self.f = None
+
+
+    def __enter__(self) -> 'ManifestWriter':
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def write_manifest(manifest_path: str, entries: Iterable[Dict], buffer_lines: int=1000) -> int:
+
+    '''
+    write the entries as a manifest
+    ---
+    returns: the number of entries written
+    '''
+
+    with ManifestWriter(manifest_path, buffer_lines=buffer_lines) as writer:
+        writer.write_many(entries)
+
+    return writer.num_written
+
+
+class ManifestIndex:
+
+    '''
+    byte offset of the start of every line of an uncompressed manifest, entry N is read with one seek instead of reading the lines before it
+
+    the offsets are saved next to the manifest (<manifest>.idx.npy) and reused while the size and modification time of the manifest match
+    '''
+
+    def __init__(self, manifest_path: str, index_path: str=None, save: bool=True) -> None:
+
+        '''
+        manifest_path: an uncompressed manifest, compressed streams cannot be seeked into
+        index_path: where the offsets are saved, defaults to <manifest>.idx.npy
+        save: save a newly built index so the next run skips the scan
+        '''
+
+        if is_compressed(manifest_path):
+            raise ValueError(f'{manifest_path} is compressed, random access needs an uncompressed manifest')
+
+        self.manifest_path = manifest_path
+        self.index_path = index_path if index_path is not None else f'{manifest_path}.idx.npy'
+        self.offsets = self.load() if os.path.exists(self.index_path) else None
+
+        if self.offsets is None:
+            self.offsets = self.build()
+            if save:
+                self.save()
+
+        self.f = None
+
+
+    def signature(self) -> np.ndarray:
+        stat = os.stat(self.manifest_path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+    def build(self) -> np.ndarray:
+
+        '''
+        scan the manifest a block at a time for the newlines
+        ---
+        returns: the offsets of the non blank lines
+        '''
+
+        starts = [np.zeros(1, dtype=np.int64)]
+        # number of non whitespace bytes before every line start, a line is blank when the count does not grow over it
+        counts = [np.zeros(1, dtype=np.int64)]
+        position = 0
+        count = 0
+
+        with open(self.manifest_path, 'rb') as f:
+            while True:
+                block = f.read(INDEX_BLOCK_BYTES)
+                if not block:
+                    break
+
+                data = np.frombuffer(block, dtype=np.uint8)
+                cumulative = np.cumsum(~np.isin(data, WHITESPACE_BYTES), dtype=np.int64)
+                newlines = np.flatnonzero(data == ord('\n'))
+
+                starts.append(newlines + position + 1)
+                counts.append(cumulative[newlines] + count)
+                position += len(block)
+                count += int(cumulative[-1])
+
+        starts = np.concatenate(starts)
+        counts = np.append(np.concatenate(counts), count)
+
+        # same rule as iter_manifest, the lines that are empty after strip() are skipped, so is the empty tail after the last newline
+        keep = (counts[1:] > counts[:-1]) & (starts < position)
+
+        return starts[keep]
+
+
+    def save(self) -> None:
+
+        '''
+        the offsets are saved after the signature of the manifest, written through a temporary file
+        '''
+
+        tmp_path = f'{self.index_path}.tmp.npy'
+        try:
+            np.save(tmp_path, np.concatenate([self.signature(), self.offsets]))
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # a read only directory, the index is rebuilt next time
+            pass
+
+
+    def load(self) -> np.ndarray:
+
+        '''
+        returns: the saved offsets, None if they are missing, unreadable or from another version of the manifest
+        '''
+
+        try:
+            saved = np.load(self.index_path)
+        except (OSError, ValueError):
+            return None
+
+        if len(saved) < 2 or not np.array_equal(saved[:2], self.signature()):
+            return None
+
+        return saved[2:]
+
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+    def read_line(self, idx: int) -> bytes:
+        if self.f is None:
+            self.f = open(self.manifest_path, 'rb')
+
+        self.f.seek(int(self.offsets[idx]))
+
+        return self.f.readline()
+
+
+    def __getitem__(self, idx: int) -> Dict:
+        return loads(self.read_line(idx))
+
+
+    def close(self) -> None:
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+    def __enter__(self) -> 'ManifestIndex':
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
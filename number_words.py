@@ -0,0 +1,357 @@
+"""
+Convert english number words into digits, a faster drop-in for text2digits.Text2Digits().convert used by TextPostProcessingEN
+
+the conversion follows text2digits 0.1.0 step by step (same tokens, same combination and concatenation rules, same decimal arithmetic) so the
+output is identical, what changes is that the lexicon is built once, the words are classified through a dict instead of regexes and enums, the
+rules walk the token list by index instead of slicing it, and sentences without any number word are returned without being parsed at all
+"""
+
+import re
+import logging
+from decimal import Decimal
+from collections import OrderedDict
+
+UNITS = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine']
+TEENS = ['ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen']
+TENS = ['twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+SCALES = ['hundred', 'thousand', 'million', 'billion', 'trillion']
+ORDINAL_WORDS = {'oh': 'zero', 'first': 'one', 'second': 'two', 'third': 'three', 'fifth': 'five', 'eighth': 'eight', 'ninth': 'nine', 'twelfth': 'twelve'}
+ORDINAL_ENDINGS = [('ieth', 'y'), ('th', '')]
+
+# token types, as text2digits.tokens_basic.WordType
+OTHER, LITERAL_INT, LITERAL_FLOAT, UNIT, TEEN, TEN, SCALE, CONJUNCTION, REPLACED = range(9)
+LITERAL_TYPES = (LITERAL_INT, LITERAL_FLOAT)
+COMBINATION_TYPES = (LITERAL_INT, LITERAL_FLOAT, UNIT, TEEN, TEN, SCALE)
+CONCATENATION_TYPES = (UNIT, TEEN, TEN, SCALE, REPLACED)
+
+# word -> (type, scale, value)
+NUMBER_WORDS = {'and': (CONJUNCTION, Decimal(1), Decimal(0))}
+NUMBER_WORDS.update({word: (UNIT, Decimal(1), Decimal(idx)) for idx, word in enumerate(UNITS)})
+NUMBER_WORDS.update({word: (TEEN, Decimal(1), Decimal(idx + 10)) for idx, word in enumerate(TEENS)})
+NUMBER_WORDS.update({word: (TEN, Decimal(1), Decimal((idx + 2) * 10)) for idx, word in enumerate(TENS)})
+NUMBER_WORDS.update({word: (SCALE, Decimal(10 ** (idx * 3 or 2)), Decimal(0)) for idx, word in enumerate(SCALES)})
+
+# the words and gluing characters text2digits splits a sentence on
+SEPARATOR_PATTERN = re.compile(r'\s+|(?<=\D)[.,;:\-_](?=\D)')
+FLOAT_PATTERN = re.compile(r'^\d+\.\d*|\d*\.\d+$')
+# any stretch that could be (part of) a number, sentences without one are returned as they are
+NUMBER_HINT_PATTERN = re.compile(r'\d|[a-z]+')
+
+
+def normalise_word(word: str) -> tuple:
+
+    '''
+    lowercase the word and map the ordinal forms onto the cardinal word, as text2digits.tokens_basic.Token does
+    ---
+    returns: the normalised word and whether it was an ordinal
+    '''
+
+    word = word.lower().replace(',', '')
+    ordinal = False
+
+    if word in ORDINAL_WORDS:
+        ordinal = True
+        word = ORDINAL_WORDS[word]
+
+    for ending, replacement in ORDINAL_ENDINGS:
+        if word.endswith(ending):
+            replaced = word[:-len(ending)] + replacement
+            if replaced in NUMBER_WORDS:
+                ordinal = True
+                word = replaced
+
+    return word, ordinal
+
+
+# every spelling of a number word, including the ordinal ones, so the words of a sentence can be checked with a single set lookup
+TRIGGER_WORDS = set(NUMBER_WORDS) | set(ORDINAL_WORDS)
+for _word in list(NUMBER_WORDS):
+    for _ending, _replacement in ORDINAL_ENDINGS:
+        if not _replacement or _word.endswith(_replacement):
+            TRIGGER_WORDS.add(_word[:len(_word) - len(_replacement)] + _ending)
+# a conjunction alone never changes anything
+TRIGGER_WORDS -= {'and', 'andth'}
+
+
+class NumberToken:
+
+    '''
+    a word of the sentence, the counterpart of text2digits Token, CombinedToken and ConcatenatedToken
+    '''
+
+    __slots__ = ('raw', 'glue', 'word', 'type', 'replaced')
+
+    def __init__(self, raw: str, glue: str, word: str, token_type: int, replaced: str=None) -> None:
+        self.raw = raw
+        self.glue = glue
+        self.word = word
+        self.type = token_type
+        self.replaced = replaced
+
+
+    def has_large_scale(self) -> bool:
+        if self.type == SCALE:
+            return True
+        if self.type in LITERAL_TYPES:
+            # Decimal raises InvalidOperation on malformed literals exactly where text2digits does
+            return Decimal(self.word) >= 100 and Decimal(self.word) % 10 == 0
+        return False
+
+
+    def value(self) -> Decimal:
+        if self.type in LITERAL_TYPES:
+            return Decimal(0) if self.has_large_scale() else Decimal(self.word)
+        return NUMBER_WORDS[self.word][2]
+
+
+    def scale(self) -> Decimal:
+        if self.type in LITERAL_TYPES:
+            return Decimal(self.word) if self.has_large_scale() else Decimal(1)
+        return NUMBER_WORDS[self.word][1]
+
+
+    def text(self) -> str:
+        if self.type == REPLACED:
+            return self.replaced
+        if self.type in (LITERAL_INT, LITERAL_FLOAT, CONJUNCTION, OTHER):
+            return self.raw
+        if self.type == SCALE:
+            return str(self.scale())
+        return str(self.value())
+
+
+class EnglishNumberConverter:
+
+    '''
+    replaces the number words of a sentence with digits, e.g. "born in nineteen sixty four" -> "born in 1964", built once and reused
+    '''
+
+    def __init__(self, memo_size: int=10_000) -> None:
+
+        '''
+        memo_size: number of converted sentences and classified words remembered, 0 disables the memo
+        '''
+
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.word_types = {}
+
+
+    def classify(self, raw: str) -> tuple:
+
+        '''
+        returns: the normalised word and its token type
+        '''
+
+        cached = self.word_types.get(raw)
+        if cached is not None:
+            return cached
+
+        word, _ = normalise_word(raw)
+
+        if word in NUMBER_WORDS:
+            token_type = NUMBER_WORDS[word][0]
+        elif '.' in word and FLOAT_PATTERN.search(word):
+            token_type = LITERAL_FLOAT
+        elif word.isdecimal():
+            token_type = LITERAL_INT
+        else:
+            token_type = OTHER
+
+        if len(self.word_types) >= max(self.memo_size, 1000):
+            self.word_types.clear()
+        self.word_types[raw] = (word, token_type)
+
+        return word, token_type
+
+
+    def split(self, text: str) -> list:
+
+        '''
+        split the sentence into tokens, the separator is searched in what is left of the sentence like text2digits.text_processing_helpers.split_glues
+        '''
+
+        tokens = []
+
+        while True:
+            match = SEPARATOR_PATTERN.search(text)
+            if not match:
+                tokens.append(NumberToken(text, '', *self.classify(text)))
+                break
+
+            raw = text[:match.start()]
+            tokens.append(NumberToken(raw, match.group(), *self.classify(raw)))
+            text = text[match.end():]
+
+        # a conjunction only combines numbers when a number follows it
+        for idx, token in enumerate(tokens):
+            if token.type == CONJUNCTION and (idx == len(tokens) - 1 or tokens[idx + 1].type in (CONJUNCTION, OTHER)):
+                token.type = OTHER
+
+        return tokens
+
+
+    @staticmethod
+    def match_combination(tokens: list, begin: int) -> int:
+
+        '''
+        number of tokens from begin to combine into a single number, text2digits.rules.CombinationRule.match
+        '''
+
+        size = len(tokens) - begin
+        if size < 2:
+            return 0
+
+        none_token = NumberToken('', '', '', None)
+        # the match kinds of the rule: single, scale, dual scale, dual hundred
+        last_match = None
+        last_scale = 0
+        consumed = 0
+
+        while consumed < size:
+            conjunctions = 0
+            first = tokens[begin + consumed]
+
+            if consumed > 0 and first.type == CONJUNCTION:
+                conjunctions = 1
+                first = tokens[begin + consumed + conjunctions]
+
+            second = tokens[begin + consumed + conjunctions + 1] if consumed < size - conjunctions - 1 else none_token
+            if second.type == CONJUNCTION:
+                conjunctions = 1
+                second = tokens[begin + consumed + conjunctions + 1] if consumed < size - conjunctions - 1 else none_token
+
+            if last_match != 'dual_hundred' and first.type == TEN and second.type == UNIT:
+                consumed += 2
+                last_match = 'dual_hundred'
+            elif first.type in COMBINATION_TYPES and second.has_large_scale():
+                consumed += 2
+                last_match = 'dual_scale'
+                last_scale = second.scale()
+            elif first.has_large_scale() and (second.type in COMBINATION_TYPES or last_match == 'dual_hundred'):
+                consumed += 1
+                last_match = 'scale'
+                last_scale = first.scale()
+            elif last_match in ('scale', 'dual_scale') and first.has_large_scale():
+                # two consecutive scales only when the scale increases
+                if first.scale() > last_scale:
+                    consumed += 1
+                    last_match = 'scale'
+                else:
+                    last_match = None
+            elif last_match in ('scale', 'dual_scale') and first.type in COMBINATION_TYPES:
+                consumed += 1
+                last_match = 'single'
+            else:
+                last_match = None
+
+            if last_match is None:
+                break
+
+            consumed += conjunctions
+
+        return consumed
+
+
+    @staticmethod
+    def combine(tokens: list) -> NumberToken:
+
+        '''
+        calculate the number of the tokens, text2digits.rules.CombinationRule.action
+        '''
+
+        current = Decimal(0)
+        result = Decimal(0)
+        prev_scale = 1
+
+        for token in tokens:
+            if token.has_large_scale():
+                current = max(1, current)
+
+            scale = token.scale()
+            if scale < prev_scale:
+                # flush when going from a larger to a smaller scale
+                result += current
+                current = Decimal(0)
+
+            current = current * scale + token.value()
+            prev_scale = scale
+
+        result += current
+        number = result.to_integral() if result == result.to_integral() else result.normalize()
+
+        return NumberToken('', tokens[-1].glue, '', REPLACED, str(number))
+
+
+    def convert_uncached(self, text: str) -> str:
+        tokens = self.split(text)
+
+        # combination rule: two hundred forty two -> 242
+        combined = []
+        idx = 0
+        while idx < len(tokens):
+            num_match = self.match_combination(tokens, idx) if tokens[idx].type != OTHER else 0
+            if num_match > 0:
+                combined.append(self.combine(tokens[idx:idx + num_match]))
+                idx += num_match
+            else:
+                combined.append(tokens[idx])
+                idx += 1
+
+        # concatenation rule: twenty twenty -> 2020, one two three -> 123
+        pieces = []
+        idx = 0
+        while idx < len(combined):
+            end = idx
+            while end < len(combined) and combined[end].type in CONCATENATION_TYPES:
+                end += 1
+
+            if end > idx:
+                pieces.append(''.join(token.text() for token in combined[idx:end]))
+                pieces.append(combined[end - 1].glue)
+                idx = end
+            else:
+                pieces.append(combined[idx].text())
+                pieces.append(combined[idx].glue)
+                idx += 1
+
+        return ''.join(pieces)
+
+
+    def convert(self, text: str) -> str:
+
+        '''
+        replace the number words of the sentence with digits, same output as text2digits.Text2Digits().convert
+        ---
+        returns: the converted sentence, exceptions from malformed numbers are raised as in text2digits
+        '''
+
+        if not any(hint in TRIGGER_WORDS or hint.isdigit() for hint in NUMBER_HINT_PATTERN.findall(text.lower())):
+            return text
+
+        converted = self.memo.get(text)
+        if converted is not None:
+            self.memo.move_to_end(text)
+            return converted
+
+        converted = self.convert_uncached(text)
+
+        if self.memo_size > 0:
+            self.memo[text] = converted
+            if len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+
+        return converted
+
+
+    def __call__(self, text: str) -> str:
+
+        '''
+        convert the sentence, leaving it unchanged if a malformed number cannot be converted
+        '''
+
+        try:
+            return self.convert(text)
+        except Exception as e:
+            logging.getLogger('WARNING').warning(f'{type(e).__name__} converting numbers, skipping transformation ...')
+            return text
@@ -0,0 +1,607 @@
+"""
+One entry point for an evaluation run: transcribe -> merge -> normalise -> score, for short clips or a long recording
+
+the stages are chained generators so the records flow through one at a time (a batch at a time for the normalisation), nothing is written
+between the stages unless asked for, and the time spent in every stage is reported at the end
+
+    python pipeline.py short --manifest test_manifest_495.json --audio-root /datasets/.../test_split --language english --text-language en --output-dir runs/495
+    python pipeline.py long --audio long.wav --reference long_ref.json --language indonesian --text-language id --output-dir runs/long
+"""
+
+import os
+import json
+import time
+import ijson
+import logging
+import argparse
+import numpy as np
+from collections import OrderedDict
+from tqdm import tqdm
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from gladia_client import GLADIA_API_URL, GladiaClient
+from jsonl_checkpoint import JSONLCheckpoint
+from request_telemetry import RequestTelemetry
+from rate_limiter import TokenBucket
+from response_cache import ResponseCache
+from audio_encoder import AudioEncoder
+from chunk_long_audio import ChunkedTranscribeLongAudio
+from batch_transcribe_audio_short import BatchTranscribeAudio
+from scheduling import POLICIES
+from word_assignment import ASSIGNMENT_RULES, WordSegmentAssigner
+from text_processing import BatchTextPostProcessor
+from wer_scorer import COUNT_KEYS, error_rates, score_utterance
+from manifest_io import ManifestWriter, iter_manifest, loads
+
+# Setup logging in a nice readable format
+logging.basicConfig(level=logging.INFO,
+                    format='[%(levelname)5s][%(asctime)s][%(name)s]: %(message)s',
+                    datefmt='%H:%M:%S')
+
+
+class StageTimer:
+
+    '''
+    times a chain of generator stages, every stage is timed around the next() calls on it
+
+    a stage pulls its items from the stage before it inside its own next(), so the time of a stage alone is its time minus the time of the
+    stage it pulls from, the stages must be wrapped in the order they are chained
+    '''
+
+    def __init__(self) -> None:
+        self.stages = OrderedDict()
+
+
+    def wrap(self, name: str, iterable: Iterable) -> Iterator:
+
+        '''
+        register the stage now, in chain order, and return the timed iterator over it
+        '''
+
+        stats = self.stages[name] = {'seconds': 0.0, 'items': 0}
+
+        return self.timed(stats, iter(iterable))
+
+
+    @staticmethod
+    def timed(stats: Dict, iterator: Iterator) -> Iterator:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stats['seconds'] += time.perf_counter() - start
+                return
+            stats['seconds'] += time.perf_counter() - start
+            stats['items'] += 1
+
+            yield item
+
+
+    def report(self) -> Dict[str, Dict]:
+
+        '''
+        returns: {stage: {'seconds', 'items'}} with the time spent in every stage alone
+        '''
+
+        report = OrderedDict()
+        upstream = 0.0
+
+        for name, stats in self.stages.items():
+            report[name] = {'seconds': round(stats['seconds'] - upstream, 4), 'items': stats['items']}
+            upstream = stats['seconds']
+
+        return report
+
+
+class EvaluationPipeline:
+
+    '''
+    transcribes, merges, normalises and scores in one pass, the stages are generators over the utterance records
+
+    everything is written to output_dir: result.json (the error rates, counts and stage timings) always, and on request the raw responses
+    (responses.jsonl, which is also the checkpoint a rerun resumes from), the merged manifest with the predictions (manifest_with_pred.json)
+    and the error counts of every utterance (utterance_scores.json)
+    '''
+
+    def __init__(
+        self,
+        output_dir: str,
+        language: str,
+        text_language: str,
+        keep_responses: bool=False,
+        keep_manifest: bool=False,
+        keep_utterance_scores: bool=False,
+        batch_size: int=256,
+        workers: int=None,
+        api_url: str=GLADIA_API_URL,
+        max_in_flight: int=4,
+        requests_per_second: float=1.0,
+        max_retries: int=5,
+        cache_dir: str=None,
+        encode_codec: str=None,
+        schedule: str='longest_first',
+        pack_clips: int=1,
+    ) -> None:
+
+        '''
+        output_dir: directory of the outputs, created if missing
+        language: language of the audio sent to the api, e.g. 'english'
+        text_language: language code of the text normalisation, as for TextPostProcessingManager, e.g. 'en'
+        keep_responses, keep_manifest, keep_utterance_scores: write the raw responses, the merged manifest and the per-utterance scores
+        batch_size: number of records normalised at once
+        workers: number of processes normalising the texts, None for one per cpu
+        api_url: endpoint of the transcription api, can be pointed to a local stand-in server for testing
+        max_in_flight: number of requests (clips, or chunks of the long audio) sent at the same time
+        requests_per_second: rate limit of the requests, <= 0 disables it
+        max_retries: number of retries of a request on network errors, 429 and 5xx responses
+        cache_dir: directory of the response cache, None disables it
+        encode_codec: compress the audio before the upload ('flac', 'ogg', 'opus' or 'mp3'), None uploads the raw wav
+        schedule: order the short clips are sent in, 'longest_first', 'shortest_first' or 'manifest'
+        pack_clips: number of short clips joined into one upload, 1 sends every clip on its own
+        '''
+
+        self.output_dir = output_dir
+        self.language = language
+        self.text_language = text_language
+        self.keep_responses = keep_responses
+        self.keep_manifest = keep_manifest
+        self.keep_utterance_scores = keep_utterance_scores
+        self.batch_size = batch_size
+        self.workers = workers
+        self.api_url = api_url
+        self.max_in_flight = max(1, max_in_flight)
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.cache_dir = cache_dir
+        self.encode_codec = encode_codec
+        self.schedule = schedule
+        self.pack_clips = pack_clips
+
+        self.timer = StageTimer()
+        self.failed = 0
+        self.skipped = 0
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.output_dir, name)
+
+
+    @staticmethod
+    def iter_responses(responses_path: str) -> Iterator[Dict]:
+
+        '''
+        stream the responses of an earlier run, either the json list of BatchTranscribeAudio or its jsonl checkpoint
+        '''
+
+        with open(responses_path, 'rb') as f:
+            first = f.read(64).lstrip()[:1]
+            f.seek(0)
+
+            if first == b'[':
+                yield from ijson.items(f, 'item', use_float=True)
+                return
+
+            for line in f:
+                try:
+                    yield loads(line)
+                except ValueError:
+                    # torn last line of a crashed run
+                    continue
+
+
+    # --- short clips ---
+
+    def transcribe_short(self, entries: List[Dict], audio_root: str) -> Iterator[Dict]:
+
+        '''
+        yield the response of every clip as it completes, the responses already in the checkpoint are yielded first without any request
+        '''
+
+        checkpoint = JSONLCheckpoint(checkpoint_path=self.path('responses.jsonl')) if self.keep_responses else None
+        completed = set()
+
+        if checkpoint is not None and os.path.exists(checkpoint.checkpoint_path):
+            checkpoint.repair()
+            for response in self.iter_responses(checkpoint.checkpoint_path):
+                completed.add(response['audio_filepath'])
+                yield response
+
+        pending = [entry for entry in entries if entry['audio_filepath'] not in completed]
+        if not pending:
+            return
+
+        transcriber = BatchTranscribeAudio(
+            audio_root_path=audio_root,
+            input_manifest_path=None,
+            output_manifest_path=self.path('responses.json'),
+            language=self.language,
+            max_in_flight=self.max_in_flight,
+            requests_per_second=self.requests_per_second,
+            max_retries=self.max_retries,
+            cache_dir=self.cache_dir,
+            encode_codec=self.encode_codec,
+            telemetry_path=self.path('telemetry.json'),
+            api_url=self.api_url,
+            schedule=self.schedule,
+            pack_clips=self.pack_clips,
+        )
+
+        pending = transcriber.schedule_jobs(pending)
+
+        responses = transcriber.transcribe(manifest_list=pending)
+
+        try:
+            if checkpoint is not None:
+                checkpoint.open()
+
+            for response in responses:
+                if response is None:
+                    # logged by the transcriber, a rerun with keep_responses retries it
+                    self.failed += 1
+                    continue
+
+                if checkpoint is not None:
+                    checkpoint.append(response)
+                yield response
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+            transcriber.telemetry.write(summary_path=transcriber.telemetry_path)
+            transcriber.telemetry.close()
+            transcriber.client.close()
+
+
+    def merge_short(self, responses: Iterable[Dict], entries: List[Dict]) -> Iterator[Dict]:
+
+        '''
+        join every response with its manifest entry and concatenate the segment transcriptions, as CombineManifest does
+        '''
+
+        by_path = {entry['audio_filepath']: entry for entry in entries}
+
+        for response in responses:
+            entry = by_path.pop(response['audio_filepath'], None)
+            if entry is None:
+                # a response of another manifest, or a duplicate in the checkpoint
+                continue
+
+            yield dict(entry, pred_str_raw=' '.join(pred['transcription'] for pred in response['prediction']))
+
+
+    # --- long audio ---
+
+    def transcribe_long(self, audio_filepath: str, chunk_minutes: Optional[float], overlap_seconds: float) -> Iterator[Dict]:
+
+        '''
+        yield the single response of the long recording, reused from responses.json of an earlier run when keep_responses is set
+        '''
+
+        response_path = self.path('response.json')
+
+        if self.keep_responses and os.path.exists(response_path):
+            logging.getLogger('INFO').info(f'reusing the response of {response_path}')
+            yield {'response_path': response_path}
+            return
+
+        cache = ResponseCache(cache_dir=self.cache_dir) if self.cache_dir is not None else None
+        encoder = AudioEncoder(codec=self.encode_codec, workers=self.max_in_flight) if self.encode_codec is not None else None
+        telemetry = RequestTelemetry(records_path=self.path('telemetry.requests.jsonl'))
+
+        client = GladiaClient(
+            read_timeout=600.0 if chunk_minutes is not None else 3600.0,
+            max_retries=self.max_retries,
+            pool_maxsize=self.max_in_flight,
+            rate_limiter=TokenBucket(rate=self.requests_per_second),
+            cache=cache,
+            encoder=encoder,
+            telemetry=telemetry,
+            api_url=self.api_url,
+        )
+
+        try:
+            if chunk_minutes is not None:
+                response = ChunkedTranscribeLongAudio(
+                    client=client,
+                    language=self.language,
+                    chunk_minutes=chunk_minutes,
+                    overlap_seconds=overlap_seconds,
+                    max_in_flight=self.max_in_flight,
+                )(audio_filepath=audio_filepath)
+            else:
+                response = client.transcribe(input_audio_path=audio_filepath, language=self.language)
+        finally:
+            telemetry.write(summary_path=self.path('telemetry.json'))
+            telemetry.close()
+            client.close()
+
+        if self.keep_responses:
+            with open(response_path, 'w') as f:
+                json.dump(response, f, indent=2)
+
+        yield response
+
+
+    def words_long(self, responses: Iterable[Dict]) -> Iterator[Dict]:
+
+        '''
+        yield the words of the response, a response kept on disk is streamed without being loaded
+        '''
+
+        for response in responses:
+            if 'response_path' in response:
+                with open(response['response_path'], 'rb') as f:
+                    yield from ijson.items(f, 'prediction.item.words.item', use_float=True)
+            else:
+                for segment in response['prediction']:
+                    yield from segment['words']
+
+
+    def merge_long(self, words: Iterable[Dict], reference_manifest: str, rule: str) -> Iterator[Dict]:
+
+        '''
+        assign the words to the reference utterances with the sorted index of word_assignment, as CombineWordToUtterances does
+
+        the assignment needs every word, only their start, end and text are kept, as columns
+        '''
+
+        texts, starts, ends = [], [], []
+        for word in words:
+            texts.append(word['word'].lstrip())
+            starts.append(word['time_begin'])
+            ends.append(word['time_end'])
+
+        entries = list(iter_manifest(reference_manifest))
+        ref_start = np.fromiter((entry['start'] for entry in entries), dtype=np.float64, count=len(entries))
+        ref_end = np.fromiter((entry['end'] for entry in entries), dtype=np.float64, count=len(entries))
+
+        offsets, word_idx = WordSegmentAssigner(word_start=np.array(starts, dtype=np.float64), word_end=np.array(ends, dtype=np.float64)).assign(
+            ref_start=ref_start, ref_end=ref_end, rule=rule,
+        )
+
+        for ref_idx, entry in enumerate(entries):
+            yield dict(entry, pred_str_raw=' '.join(texts[idx] for idx in word_idx[offsets[ref_idx]:offsets[ref_idx + 1]]))
+
+
+    # --- shared ---
+
+    def normalise(self, records: Iterable[Dict], text_processor: BatchTextPostProcessor) -> Iterator[Dict]:
+
+        '''
+        normalise the reference and the prediction of the records a batch at a time, keeping the raw texts next to them
+        '''
+
+        def flush(batch: List[Dict]) -> List[Dict]:
+            cleaned = text_processor.process_batch([record['text'] for record in batch] + [record['pred_str_raw'] for record in batch])
+            for record, text, pred in zip(batch, cleaned[:len(batch)], cleaned[len(batch):]):
+                record['text_raw'] = record['text']
+                record['text'] = text
+                record['pred_str'] = pred
+            return batch
+
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                yield from flush(batch)
+                batch = []
+
+        if batch:
+            yield from flush(batch)
+
+
+    def score(self, records: Iterable[Dict], totals: Dict) -> Iterator[Dict]:
+
+        '''
+        count the errors of every record into totals, writing the records and their scores out if asked for
+
+        an utterance with an empty normalised reference cannot be scored (as in jiwer), it is skipped with a warning
+        '''
+
+        f_manifest = ManifestWriter(self.path('manifest_with_pred.json')) if self.keep_manifest else None
+        f_scores = ManifestWriter(self.path('utterance_scores.json')) if self.keep_utterance_scores else None
+
+        try:
+            for record in records:
+                if f_manifest is not None:
+                    f_manifest.write(record)
+
+                try:
+                    scores = score_utterance(record['text'], record['pred_str'])
+                except ValueError:
+                    logging.getLogger('WARNING').warning(f"{record.get('audio_filepath')}: empty reference after normalisation, not scored")
+                    self.skipped += 1
+                    continue
+
+                for level, counts in scores.items():
+                    for key, value in counts.items():
+                        totals[level][key] += value
+
+                if f_scores is not None:
+                    f_scores.write({'audio_filepath': record.get('audio_filepath'), **scores, **error_rates(scores['word'], scores['char'])})
+
+                yield record
+        finally:
+            for f in (f_manifest, f_scores):
+                if f is not None:
+                    f.close()
+
+
+    def run(self, records: Iterable[Dict]) -> Dict:
+
+        '''
+        drive the chained stages, from the merged records on
+        ---
+        returns: the result, also written to result.json
+        '''
+
+        totals = {level: dict.fromkeys(COUNT_KEYS + ('ref_len', 'hyp_len'), 0) for level in ('word', 'char')}
+        start = time.perf_counter()
+
+        with BatchTextPostProcessor(language=self.text_language, workers=self.workers) as text_processor:
+            normalised = self.timer.wrap('normalise', self.normalise(records, text_processor))
+            scored = self.timer.wrap('score', self.score(normalised, totals))
+            num_utterances = sum(1 for _ in tqdm(scored, unit='utt'))
+            normalisation = text_processor.stats()
+
+        result = {
+            **(error_rates(totals['word'], totals['char']) if totals['word']['ref_len'] else {}),
+            **totals,
+            'num_utterances': num_utterances,
+            'failed': self.failed,
+            'skipped_empty_reference': self.skipped,
+            'normalisation': normalisation,
+            'stages': self.timer.report(),
+            'seconds': round(time.perf_counter() - start, 3),
+        }
+
+        with open(self.path('result.json'), 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+        return result
+
+
+    def run_short(self, manifest_path: str, audio_root: str=None, responses_path: str=None) -> Dict:
+
+        '''
+        evaluate a manifest of short clips
+        ---
+        manifest_path: nemo manifest of the clips with their reference text
+        audio_root: root directory of the audio_filepath of the manifest, needed to transcribe
+        responses_path: responses of an earlier transcription (json list or jsonl checkpoint), the clips are not transcribed again
+        '''
+
+        entries = list(iter_manifest(manifest_path))
+
+        if responses_path is not None:
+            responses = self.iter_responses(responses_path)
+        else:
+            responses = self.transcribe_short(entries, audio_root=audio_root)
+
+        responses = self.timer.wrap('transcribe', responses)
+        records = self.timer.wrap('merge', self.merge_short(responses, entries))
+
+        return self.run(records)
+
+
+    def run_long(
+        self,
+        audio_filepath: str,
+        reference_manifest: str,
+        response_path: str=None,
+        chunk_minutes: Optional[float]=10.0,
+        overlap_seconds: float=2.0,
+        rule: str='midpoint',
+    ) -> Dict:
+
+        '''
+        evaluate a long recording against the reference utterances cut from it
+        ---
+        audio_filepath: the long recording, needed to transcribe
+        reference_manifest: nemo manifest of the reference utterances with their "start" and "end" in the recording
+        response_path: response of an earlier transcription of the recording, it is not transcribed again
+        chunk_minutes: transcribe the recording in chunks of about this many minutes, None uploads it in one request
+        rule: how the words are assigned to the utterances, see word_assignment.py
+        '''
+
+        if response_path is not None:
+            responses = iter([{'response_path': response_path}])
+        else:
+            responses = self.transcribe_long(audio_filepath, chunk_minutes=chunk_minutes, overlap_seconds=overlap_seconds)
+
+        responses = self.timer.wrap('transcribe', responses)
+        words = self.timer.wrap('words', self.words_long(responses))
+        records = self.timer.wrap('merge', self.merge_long(words, reference_manifest, rule=rule))
+
+        return self.run(records)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='transcribe, merge, normalise and score in one pass')
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    def add_common(mode: argparse.ArgumentParser) -> None:
+        mode.add_argument('--output-dir', required=True)
+        mode.add_argument('--language', default='english', help='language of the audio for the api')
+        mode.add_argument('--text-language', default='', help='language code of the text normalisation, e.g. en, id, zh_cmn')
+        mode.add_argument('--keep-responses', action='store_true', help='keep the raw responses, a rerun resumes from them')
+        mode.add_argument('--keep-manifest', action='store_true', help='write the manifest with the predictions')
+        mode.add_argument('--keep-utterance-scores', action='store_true', help='write the error counts of every utterance')
+        mode.add_argument('--batch-size', type=int, default=256)
+        mode.add_argument('--workers', type=int, default=None)
+        mode.add_argument('--api-url', default=GLADIA_API_URL)
+        mode.add_argument('--max-in-flight', type=int, default=4)
+        mode.add_argument('--requests-per-second', type=float, default=1.0)
+        mode.add_argument('--max-retries', type=int, default=5)
+        mode.add_argument('--cache-dir', default=None)
+        mode.add_argument('--encode-codec', default=None, choices=['flac', 'ogg', 'opus', 'mp3'])
+
+    short = modes.add_parser('short', help='a nemo manifest of short clips')
+    add_common(short)
+    short.add_argument('--manifest', required=True)
+    short.add_argument('--audio-root', default='')
+    short.add_argument('--responses', default=None, help='score the responses of an earlier transcription instead of transcribing')
+    short.add_argument('--schedule', choices=list(POLICIES), default='longest_first', help='order the clips are sent in')
+    short.add_argument('--pack-clips', type=int, default=1, help='number of clips joined into one upload, 1 sends every clip on its own')
+
+    long = modes.add_parser('long', help='a long recording and the reference utterances cut from it')
+    add_common(long)
+    long.add_argument('--audio', default=None)
+    long.add_argument('--reference', required=True)
+    long.add_argument('--response', default=None, help='score the response of an earlier transcription instead of transcribing')
+    long.add_argument('--chunk-minutes', type=float, default=10.0, help='0 uploads the recording in one request')
+    long.add_argument('--overlap-seconds', type=float, default=2.0)
+    long.add_argument('--rule', choices=ASSIGNMENT_RULES, default='midpoint')
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    args = build_parser().parse_args()
+
+    pipeline = EvaluationPipeline(
+        output_dir=args.output_dir,
+        language=args.language,
+        text_language=args.text_language,
+        keep_responses=args.keep_responses,
+        keep_manifest=args.keep_manifest,
+        keep_utterance_scores=args.keep_utterance_scores,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        api_url=args.api_url,
+        max_in_flight=args.max_in_flight,
+        requests_per_second=args.requests_per_second,
+        max_retries=args.max_retries,
+        cache_dir=args.cache_dir,
+        encode_codec=args.encode_codec,
+        schedule=getattr(args, 'schedule', 'longest_first'),
+        pack_clips=getattr(args, 'pack_clips', 1),
+    )
+
+    if args.mode == 'short':
+        if args.responses is None and not args.audio_root:
+            raise SystemExit('--audio-root is needed to transcribe, or pass the --responses of an earlier run')
+        result = pipeline.run_short(manifest_path=args.manifest, audio_root=args.audio_root, responses_path=args.responses)
+    else:
+        if args.response is None and args.audio is None:
+            raise SystemExit('--audio is needed to transcribe, or pass the --response of an earlier run')
+        result = pipeline.run_long(
+            audio_filepath=args.audio,
+            reference_manifest=args.reference,
+            response_path=args.response,
+            chunk_minutes=args.chunk_minutes or None,
+            overlap_seconds=args.overlap_seconds,
+            rule=args.rule,
+        )
+
+    logging.getLogger('INFO').info("Test WER: {:.5f}".format(result.get('wer', float('nan'))))
+    logging.getLogger('INFO').info("Test CER: {:.5f}".format(result.get('cer', float('nan'))))
+    logging.getLogger('INFO').info("Test Word Acc: {:.5f}".format(result.get('word_acc', float('nan'))))
+    logging.getLogger('INFO').info(f"utterances: {result['num_utterances']}, failed: {result['failed']}, skipped: {result['skipped_empty_reference']}")
+
+    for name, stage in result['stages'].items():
+        logging.getLogger('INFO').info(f"{name:<12} {stage['seconds']:>9.3f}s {stage['items']:>9} items")
@@ -0,0 +1,65 @@
+"""
+Thread-safe token bucket to throttle the requests sent to the whisper zero API
+"""
+
+import time
+import threading
+
+
+class TokenBucket:
+
+    '''
+    token bucket rate limiter, each request takes one token and the tokens are refilled at a constant rate up to the capacity
+    '''
+
+    def __init__(self, rate: float, capacity: float=None) -> None:
+
+        '''
+        rate: number of tokens refilled per second, a rate <= 0 disables the rate limiting
+        capacity: maximum number of tokens that can be accumulated (the burst size), defaults to max(1, rate)
+        '''
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def refill(self) -> None:
+
+        '''
+        top up the bucket based on the time elapsed since the last refill, must be called with the lock held
+        '''
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+
+    def acquire(self, tokens: float=1.0) -> float:
+
+        '''
+        block until the requested number of tokens are available and take them from the bucket
+        ---
+        returns: the total time in seconds spent waiting for the tokens
+        '''
+
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                self.refill()
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+
+                # time needed for the missing tokens to be refilled
+                wait_time = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait_time)
+            waited += wait_time
@@ -0,0 +1,210 @@
+"""
+Pack many short clips into one upload with silence between them, then split the words of the response back to the clips
+
+with clips of a few seconds the fixed cost of every request outweighs the transcription itself, a pack pays it once for all of its clips
+"""
+
+import os
+import wave
+import bisect
+from typing import Dict, List, Tuple
+
+from gladia_client import GladiaClient
+
+
+class PackedTranscribeShortAudio:
+
+    '''
+    transcribe short clips in packs of up to max_clips, the clips are joined with gap_seconds of silence in between
+
+    every clip owns the words whose midpoint falls within the clip or the nearer half of the gaps around it, the timestamps are shifted back
+    to the start of the clip, the clips of a pack must share the sample rate, sample width and channels of their wav header
+    '''
+
+    def __init__(
+        self,
+        client: GladiaClient,
+        language: str,
+        max_clips: int=10,
+        max_pack_seconds: float=60.0,
+        gap_seconds: float=1.0,
+    ) -> None:
+
+        '''
+        client: the gladia client used to transcribe each pack
+        language: target language of the audio
+        max_clips: number of clips in a pack at most
+        max_pack_seconds: length of a pack at most, gaps included, a single longer clip is sent on its own
+        gap_seconds: silence between two clips, long enough for the transcription not to run the words of two clips together
+        '''
+
+        self.client = client
+        self.language = language
+        self.max_clips = max(1, max_clips)
+        self.max_pack_seconds = max_pack_seconds
+        self.gap_seconds = gap_seconds
+
+
+    @staticmethod
+    def read_format(audio_filepath: str) -> Tuple[Tuple[int, int, int], float]:
+
+        '''
+        returns: the (channels, sample width, sample rate) and the duration of the wav file, from its header
+        '''
+
+        with wave.open(audio_filepath, 'rb') as w:
+            return (w.getnchannels(), w.getsampwidth(), w.getframerate()), w.getnframes() / w.getframerate()
+
+
+    def plan_packs(self, audio_filepaths: List[str]) -> List[List[int]]:
+
+        '''
+        group the clips in order into packs, a new pack is started when the next clip would exceed the limits or has another wav format,
+        a clip the wave module cannot read, or cannot open, is a pack of its own
+        ---
+        returns: the positions of the clips of every pack
+        '''
+
+        packs = []
+        pack_format = None
+        pack_seconds = 0.0
+
+        for idx, audio_filepath in enumerate(audio_filepaths):
+            try:
+                audio_format, duration = self.read_format(audio_filepath)
+            except (wave.Error, EOFError, OSError):
+                # not a pcm wav (flac, float or extensible wav), truncated or missing, its frames cannot be copied into a pack, it is sent
+                # on its own and fails or succeeds by itself
+                packs.append([idx])
+                pack_format = None
+                continue
+
+            if (
+                not packs
+                or audio_format != pack_format
+                or len(packs[-1]) >= self.max_clips
+                or pack_seconds + self.gap_seconds + duration > self.max_pack_seconds
+            ):
+                packs.append([])
+                pack_format = audio_format
+                pack_seconds = duration
+            else:
+                pack_seconds += self.gap_seconds + duration
+
+            packs[-1].append(idx)
+
+        return packs
+
+
+    def write_pack(self, audio_filepaths: List[str], pack_filepath: str) -> List[Tuple[float, float]]:
+
+        '''
+        copy the pcm frames of the clips into one wav file, with gap_seconds of silence between them
+        ---
+        returns: the (start, end) in seconds of every clip within the pack
+        '''
+
+        offsets = []
+        position = 0
+
+        with wave.open(pack_filepath, 'wb') as dst:
+            for idx, audio_filepath in enumerate(audio_filepaths):
+                with wave.open(audio_filepath, 'rb') as src:
+                    if idx == 0:
+                        dst.setnchannels(src.getnchannels())
+                        dst.setsampwidth(src.getsampwidth())
+                        dst.setframerate(src.getframerate())
+                        sample_rate = src.getframerate()
+                        # 8-bit wav is unsigned, its silence is 128
+                        silence = (b'\x80' if src.getsampwidth() == 1 else b'\x00') * src.getsampwidth() * src.getnchannels()
+                        gap_frames = int(round(self.gap_seconds * sample_rate))
+                    else:
+                        dst.writeframes(silence * gap_frames)
+                        position += gap_frames
+
+                    num_frames = src.getnframes()
+                    dst.writeframes(src.readframes(num_frames))
+
+                offsets.append((position / sample_rate, (position + num_frames) / sample_rate))
+                position += num_frames
+
+        return offsets
+
+
+    def split(self, response: Dict, offsets: List[Tuple[float, float]]) -> List[Dict]:
+
+        '''
+        split the response of a pack into one response per clip, in the same shape as the response of the clip sent on its own
+        ---
+        returns: the responses of the clips in pack order
+        '''
+
+        # a clip owns up to halfway into the gaps on either side of it
+        bounds = [(end + next_start) / 2 for (_, end), (next_start, _) in zip(offsets[:-1], offsets[1:])]
+        predictions = [[] for _ in offsets]
+
+        for segment in response.get('prediction', []):
+            words = [[] for _ in offsets]
+
+            for word in segment['words']:
+                clip = bisect.bisect_right(bounds, (word['time_begin'] + word['time_end']) / 2)
+                start, end = offsets[clip]
+
+                # rounded to the millisecond, so the shift does not leave float noise in the timestamps
+                words[clip].append(dict(
+                    word,
+                    time_begin=round(min(max(word['time_begin'] - start, 0.0), end - start), 3),
+                    time_end=round(min(max(word['time_end'] - start, 0.0), end - start), 3),
+                ))
+
+            # a segment running over several clips becomes one segment in each of them
+            for clip, clip_words in enumerate(words):
+                if not clip_words:
+                    continue
+
+                predictions[clip].append(dict(
+                    segment,
+                    words=clip_words,
+                    transcription=''.join(word['word'] for word in clip_words).strip(),
+                    time_begin=clip_words[0]['time_begin'],
+                    time_end=clip_words[-1]['time_end'],
+                ))
+
+        metadata = response.get('prediction_raw', {}).get('metadata')
+
+        return [
+            {
+                'prediction': prediction,
+                'prediction_raw': {
+                    'pack': {'clip': clip, 'clips': len(offsets), 'time_begin': start, 'time_end': end},
+                    'metadata': metadata,
+                },
+            }
+            for clip, (prediction, (start, end)) in enumerate(zip(predictions, offsets))
+        ]
+
+
+    def transcribe_pack(self, audio_filepaths: List[str], pack_filepath: str) -> List[Dict]:
+
+        '''
+        build a pack and transcribe it, raises TranscriptionError if it fails after the retries
+        ---
+        returns: the responses of the clips in the given order
+        '''
+
+        # a single clip is sent as it is, the same as without packing, which also covers the clips that are not pcm wav
+        if len(audio_filepaths) == 1:
+            return [self.client.transcribe(input_audio_path=audio_filepaths[0], language=self.language)]
+
+        offsets = self.write_pack(audio_filepaths=audio_filepaths, pack_filepath=pack_filepath)
+
+        try:
+            response = self.client.transcribe(input_audio_path=pack_filepath, language=self.language, duration=offsets[-1][1])
+        finally:
+            os.remove(pack_filepath)
+
+        return self.split(response=response, offsets=offsets)
+
+
+    def __call__(self, audio_filepaths: List[str], pack_filepath: str) -> List[Dict]:
+        return self.transcribe_pack(audio_filepaths=audio_filepaths, pack_filepath=pack_filepath)
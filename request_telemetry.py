@@ -0,0 +1,253 @@
+"""
+Per-request telemetry of the transcription api: upload size, audio duration, time to first byte, latency, real-time factor, status and retries,
+aggregated into percentiles and written as a json summary and a prometheus text file at the end of a run
+"""
+
+import os
+import json
+import time
+import threading
+import numpy as np
+import soundfile as sf
+from typing import Dict, Optional
+
+# the percentiles of the summary and of the prometheus quantiles
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+# record field -> (prometheus metric name, help text) of the distributions in the summary
+DISTRIBUTIONS = {
+    'latency': ('whisper_zero_request_latency_seconds', 'wall time of the last attempt of a request, upload to the end of the response body'),
+    'ttfb': ('whisper_zero_request_ttfb_seconds', 'time from the start of the upload to the response headers of the last attempt'),
+    'total_seconds': ('whisper_zero_request_total_seconds', 'wall time of a request including the retries, the backoff and the rate limiting'),
+    'rtf': ('whisper_zero_request_real_time_factor', 'total seconds of a request divided by the duration of its audio'),
+    'upload_bytes': ('whisper_zero_request_upload_bytes', 'size of the uploaded audio of a request'),
+}
+
+
+def audio_duration(input_audio_path: str) -> Optional[float]:
+
+    '''
+    returns: the duration of the audio file read from its header, None if it cannot be read
+    '''
+
+    try:
+        return sf.info(input_audio_path).duration
+    except (RuntimeError, OSError):
+        return None
+
+
+class RequestTelemetry:
+
+    '''
+    collects one record per transcription request from GladiaClient, thread safe so the concurrent transcription can share it
+
+    a request is everything sent for one audio file, the attempts it took are counted as its retries, responses served from the response
+    cache are counted apart and left out of the distributions
+    '''
+
+    def __init__(self, records_path: str=None) -> None:
+
+        '''
+        records_path: if set, every record is appended there as a json line as soon as the request is done
+        '''
+
+        self.records_path = records_path
+        self.lock = threading.Lock()
+
+        self.values = {field: [] for field in DISTRIBUTIONS}
+        self.status_counts = {}
+        self.error_counts = {}
+        self.num_requests = 0
+        self.num_failed = 0
+        self.num_retries = 0
+        self.num_cache_hits = 0
+        self.total_upload_bytes = 0
+        self.total_audio_seconds = 0.0
+        self.started = time.time()
+
+        self.f_records = open(records_path, 'a', encoding='utf-8') if records_path is not None else None
+
+
+    def record(
+        self,
+        input_audio_path: str,
+        upload_bytes: int,
+        attempts: int,
+        total_seconds: float,
+        latency: Optional[float],
+        ttfb: Optional[float],
+        status_code: Optional[int],
+        error_kind: Optional[str]=None,
+        duration: Optional[float]=None,
+    ) -> Dict:
+
+        '''
+        record a finished request
+        ---
+        attempts: number of attempts made, the retries are attempts - 1
+        latency, ttfb: of the last attempt, ttfb is None if no response came back
+        status_code: http status of the last attempt, None on a network error
+        error_kind: the TranscriptionError kind if the request failed, None on success
+        duration: seconds of audio, read from the file header if not given
+        ---
+        returns: the record
+        '''
+
+        if duration is None:
+            duration = audio_duration(input_audio_path)
+
+        record = {
+            'audio_filepath': input_audio_path,
+            'upload_bytes': upload_bytes,
+            'duration': duration,
+            'ttfb': ttfb,
+            'latency': latency,
+            'total_seconds': total_seconds,
+            'rtf': total_seconds / duration if duration else None,
+            'status_code': status_code,
+            'retries': attempts - 1,
+            'error': error_kind,
+        }
+
+        with self.lock:
+            self.num_requests += 1
+            self.num_retries += attempts - 1
+            self.total_upload_bytes += upload_bytes
+            self.total_audio_seconds += duration or 0.0
+
+            status = str(status_code) if status_code is not None else 'none'
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+            if error_kind is not None:
+                self.num_failed += 1
+                self.error_counts[error_kind] = self.error_counts.get(error_kind, 0) + 1
+
+            for field, values in self.values.items():
+                if record[field] is not None:
+                    values.append(record[field])
+
+            if self.f_records is not None:
+                self.f_records.write(json.dumps(dict(record, time=time.time()), ensure_ascii=False) + '\n')
+                self.f_records.flush()
+
+        return record
+
+
+    def record_cache_hit(self) -> None:
+        with self.lock:
+            self.num_cache_hits += 1
+
+
+    def summary(self) -> Dict:
+
+        '''
+        returns: the request, failure and retry counts, the totals and the percentiles of every distribution
+        '''
+
+        with self.lock:
+            distributions = {}
+
+            for field, values in self.values.items():
+                if not values:
+                    distributions[field] = None
+                    continue
+
+                array = np.asarray(values, dtype=np.float64)
+                distributions[field] = {
+                    'count': len(array),
+                    'sum': float(array.sum()),
+                    'mean': float(array.mean()),
+                    'min': float(array.min()),
+                    'max': float(array.max()),
+                    **{f'p{round(q * 100)}': float(value) for q, value in zip(QUANTILES, np.quantile(array, QUANTILES))},
+                }
+
+            elapsed = time.time() - self.started
+
+            return {
+                'requests': self.num_requests,
+                'failed': self.num_failed,
+                'error_rate': self.num_failed / self.num_requests if self.num_requests else 0.0,
+                'retries': self.num_retries,
+                'cache_hits': self.num_cache_hits,
+                'status_codes': dict(sorted(self.status_counts.items())),
+                'errors': dict(sorted(self.error_counts.items())),
+                'upload_bytes': self.total_upload_bytes,
+                'audio_seconds': round(self.total_audio_seconds, 3),
+                'wall_seconds': round(elapsed, 3),
+                'audio_seconds_per_second': round(self.total_audio_seconds / elapsed, 3) if elapsed > 0 else None,
+                **distributions,
+            }
+
+
+    @staticmethod
+    def write_atomic(output_path: str, text: str) -> None:
+
+        '''
+        write through a temporary file and rename it, so a scraper never reads a half written file
+        '''
+
+        tmp_path = f'{output_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, output_path)
+
+
+    @staticmethod
+    def to_prometheus(summary: Dict) -> str:
+
+        '''
+        returns: the summary in the prometheus text exposition format, the distributions as summaries with their quantiles
+        '''
+
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples) -> None:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+
+        metric('whisper_zero_requests_total', 'counter', 'transcription requests by http status of the last attempt, none on a network error',
+               [(f'{{status="{status}"}}', count) for status, count in summary['status_codes'].items()])
+        metric('whisper_zero_request_failures_total', 'counter', 'transcription requests that failed after the retries, by failure kind',
+               [(f'{{kind="{kind}"}}', count) for kind, count in summary['errors'].items()])
+        metric('whisper_zero_request_retries_total', 'counter', 'retried attempts over all the requests', [('', summary['retries'])])
+        metric('whisper_zero_cache_hits_total', 'counter', 'responses served from the response cache without a request', [('', summary['cache_hits'])])
+        metric('whisper_zero_upload_bytes_total', 'counter', 'bytes of audio uploaded', [('', summary['upload_bytes'])])
+        metric('whisper_zero_audio_seconds_total', 'counter', 'seconds of audio sent for transcription', [('', summary['audio_seconds'])])
+
+        for field, (name, help_text) in DISTRIBUTIONS.items():
+            stats = summary[field]
+            if stats is None:
+                continue
+
+            samples = [(f'{{quantile="{q}"}}', stats[f'p{round(q * 100)}']) for q in QUANTILES]
+            metric(name, 'summary', help_text, samples)
+            lines.append(f"{name}_sum {stats['sum']}")
+            lines.append(f"{name}_count {stats['count']}")
+
+        return '\n'.join(lines) + '\n'
+
+
+    def write(self, summary_path: str, prometheus_path: str=None) -> Dict:
+
+        '''
+        write the json summary, and the prometheus text file next to it (same name, .prom) unless another path is given
+        ---
+        returns: the summary
+        '''
+
+        summary = self.summary()
+
+        self.write_atomic(summary_path, json.dumps(summary, indent=2) + '\n')
+        self.write_atomic(prometheus_path or os.path.splitext(summary_path)[0] + '.prom', self.to_prometheus(summary))
+
+        return summary
+
+
+    def close(self) -> None:
+        with self.lock:
+            if self.f_records is not None:
+                self.f_records.close()
+                self.f_records = None
@@ -0,0 +1,204 @@
+"""
+On-disk cache of the transcription responses, keyed by the hash of the audio bytes and the request parameters
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Optional
+
+CACHE_MODES = ('use', 'bypass', 'refresh')
+
+
+class ResponseCache:
+
+    '''
+    content addressed response cache with a size bounded least recently used eviction
+
+    each response is stored as <cache_dir>/<key[:2]>/<key>.json, the file mtime is used as the last access time so the lru order survives restarts
+    '''
+
+    def __init__(self, cache_dir: str, max_bytes: int=2 * 1024**3, mode: str='use') -> None:
+
+        '''
+        cache_dir: directory where the responses are stored
+        max_bytes: total size of the cached responses, the least recently used entries are evicted beyond this
+        mode: 'use' reads and writes the cache, 'bypass' does neither, 'refresh' skips the reads but overwrites the entries with the new responses
+        '''
+
+        if mode not in CACHE_MODES:
+            raise ValueError(f'cache mode must be one of {CACHE_MODES}, got {mode}')
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mode = mode
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+        # key -> [size in bytes, last access time]
+        self.index = {}
+        self.total_bytes = 0
+
+        if self.mode != 'bypass':
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.scan()
+
+
+    def scan(self) -> None:
+
+        '''
+        build the in-memory index from the entries already on disk
+        '''
+
+        for subdir in os.listdir(self.cache_dir):
+            subdir_path = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(subdir_path):
+                continue
+
+            for filename in os.listdir(subdir_path):
+                if not filename.endswith('.json'):
+                    continue
+
+                stat = os.stat(os.path.join(subdir_path, filename))
+                self.index[filename[:-len('.json')]] = [stat.st_size, stat.st_mtime]
+                self.total_bytes += stat.st_size
+
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+
+    @staticmethod
+    def make_key(input_audio_path: str, params: Dict) -> str:
+
+        '''
+        hash the audio bytes together with the request parameters
+        ---
+        input_audio_path: the audio file that is uploaded
+        params: the request parameters that change the response, e.g. the api url, language, language_behaviour, toggle_diarization
+        ---
+        returns: the hex digest used as the cache key
+        '''
+
+        h = hashlib.sha256()
+
+        with open(input_audio_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+
+        h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+
+        return h.hexdigest()
+
+
+    def get(self, key: str) -> Optional[Dict]:
+
+        '''
+        returns: the cached response, or None if it is not cached (always None unless the mode is 'use')
+        '''
+
+        if self.mode != 'use':
+            return None
+
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+
+            path = self.entry_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    response = json.load(f)
+            except (OSError, ValueError):
+                # entry removed or corrupted behind our back
+                self.drop(key)
+                self.misses += 1
+                return None
+
+            # mark as most recently used
+            now = time.time()
+            os.utime(path, (now, now))
+            self.index[key][1] = now
+            self.hits += 1
+
+        return response
+
+
+    def put(self, key: str, response: Dict) -> None:
+
+        '''
+        store a response, evicting the least recently used entries if the cache grows beyond max_bytes
+        '''
+
+        if self.mode == 'bypass':
+            return
+
+        payload = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self.lock:
+            # write to a temp file first so a crash never leaves a half written entry
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+            if key in self.index:
+                self.total_bytes -= self.index[key][0]
+            self.index[key] = [len(payload), time.time()]
+            self.total_bytes += len(payload)
+
+            self.evict()
+
+
+    def drop(self, key: str) -> None:
+
+        '''
+        remove an entry from the index and the disk, must be called with the lock held
+        '''
+
+        size, _ = self.index.pop(key)
+        self.total_bytes -= size
+
+        try:
+            os.remove(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+
+    def evict(self) -> None:
+
+        '''
+        remove the least recently used entries until the cache fits in max_bytes, must be called with the lock held
+        '''
+
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        for key in sorted(self.index, key=lambda k: self.index[k][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+
+            self.drop(key)
+            self.evictions += 1
+
+
+    def stats(self) -> Dict[str, int]:
+
+        '''
+        returns: the hit/miss/eviction counters and the current size of the cache
+        '''
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.index),
+            'bytes': self.total_bytes,
+        }
@@ -0,0 +1,507 @@
+"""
+Persistent time range and speaker index over the whisper zero responses of long recordings
+
+the segments and the words of every response are stored once as columns of numpy arrays, grouped by recording and speaker and sorted by
+start time, the queries binary search the memory-mapped columns so the responses are never parsed again:
+
+    meta.json                   format version, the indexed recordings with the size and mtime of their response, the speaker and channel labels
+    segments/, words/           one interval table each:
+        blocks.npy              int64 (recording, speaker, first row, end row) of every run of rows of one speaker in one recording
+        begin.npy, end.npy      float64, time_begin and time_end of every row, sorted by time_begin within a block
+        max_end.npy             float64, the running maximum of end within a block, for the binary search of the overlaps
+        confidence.npy          float64
+        recording.npy           int32, position of the recording in meta.json
+        speaker.npy, channel.npy int32, position of the labels in meta.json
+        parent.npy              int64, the segment row of a word, the number of words of a segment
+        text_id.npy             int64, position of the text of the row in the text table
+        offsets.npy, text.bin   the utf-8 text of the words (or segment transcriptions) back to back, as in word_store.py
+"""
+
+import os
+import sys
+import json
+import time
+import ijson
+import shutil
+import logging
+import argparse
+import numpy as np
+from array import array
+from tqdm import tqdm
+from typing import Dict, List, Optional, Sequence, Union
+
+FORMAT_VERSION = 1
+COLUMNS = ('begin', 'end', 'max_end', 'confidence', 'recording', 'speaker', 'channel', 'parent', 'text_id', 'offsets')
+
+
+def parse_time(value: Union[str, float]) -> float:
+
+    '''
+    seconds from a number of seconds or a [hh:]mm:ss[.fff] timestamp
+    '''
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+
+    return seconds
+
+
+class IntervalTable:
+
+    '''
+    read only view over one interval table directory of the index, the rows of a block are sorted by begin
+    '''
+
+    def __init__(self, table_dir: str) -> None:
+        self.table_dir = table_dir
+
+        for column in COLUMNS + ('blocks',):
+            setattr(self, column, np.load(os.path.join(table_dir, f'{column}.npy'), mmap_mode='r'))
+
+        # np.memmap cannot map an empty file
+        text_path = os.path.join(table_dir, 'text.bin')
+        self.text_bytes = np.memmap(text_path, dtype=np.uint8, mode='r') if os.path.getsize(text_path) else np.zeros(0, dtype=np.uint8)
+
+
+    def __len__(self) -> int:
+        return len(self.begin)
+
+
+    def text(self, row: int) -> str:
+        text_id = self.text_id[row]
+        return self.text_bytes[self.offsets[text_id]:self.offsets[text_id + 1]].tobytes().decode('utf-8')
+
+
+    def select(
+        self,
+        recordings: Optional[Sequence[int]]=None,
+        speakers: Optional[Sequence[int]]=None,
+        start: float=float('-inf'),
+        end: float=float('inf'),
+        min_confidence: Optional[float]=None,
+        contained: bool=False,
+    ) -> np.ndarray:
+
+        '''
+        find the rows overlapping [start, end), or lying within it if contained
+        ---
+        recordings, speakers: positions of the recordings and speaker labels to search, None for all of them
+        ---
+        returns: the rows in order of recording, then time_begin
+        '''
+
+        blocks = self.blocks
+        if recordings is not None:
+            blocks = blocks[np.isin(blocks[:, 0], recordings)]
+        if speakers is not None:
+            blocks = blocks[np.isin(blocks[:, 1], speakers)]
+
+        found = []
+        for _, _, first, last in blocks:
+            # the rows ending after start begin at the first row whose running maximum end passes start, the rows starting before end stop
+            # at the first row beginning at or after end
+            lo = first + np.searchsorted(self.max_end[first:last], start, side='right')
+            hi = first + np.searchsorted(self.begin[first:last], end, side='left')
+            if lo >= hi:
+                continue
+
+            rows = np.arange(lo, hi)
+            keep = (self.begin[lo:hi] >= start) & (self.end[lo:hi] <= end) if contained else self.end[lo:hi] > start
+            if min_confidence is not None:
+                keep &= self.confidence[lo:hi] >= min_confidence
+
+            found.append(rows[keep])
+
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+
+        rows = np.concatenate(found)
+
+        # the speakers of a recording are in blocks of their own, interleave them back in time order
+        if len(found) > 1:
+            rows = rows[np.lexsort((self.begin[rows], self.recording[rows]))]
+
+        return rows
+
+
+class ResponseIndex:
+
+    '''
+    query the segments and words of many recordings by time range, speaker and confidence, see ResponseIndex.build for the index
+    '''
+
+    def __init__(self, index_dir: str) -> None:
+
+        '''
+        index_dir: the directory written by ResponseIndex.build
+        '''
+
+        self.index_dir = index_dir
+
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f'unsupported response index version {meta["version"]} in {index_dir}')
+
+        self.recordings = meta['recordings']
+        self.speakers = meta['speakers']
+        self.channels = meta['channels']
+        self.recording_ids = {recording['name']: idx for idx, recording in enumerate(self.recordings)}
+
+        self.segment_table = IntervalTable(os.path.join(index_dir, 'segments'))
+        self.word_table = IntervalTable(os.path.join(index_dir, 'words'))
+
+
+    @staticmethod
+    def signature(response_path: str) -> Dict:
+        stat = os.stat(response_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+    def stale(self) -> List[str]:
+
+        '''
+        returns: the names of the recordings whose response changed or went missing since the index was built
+        '''
+
+        changed = []
+        for recording in self.recordings:
+            try:
+                if self.signature(recording['source']) != {'size': recording['size'], 'mtime_ns': recording['mtime_ns']}:
+                    changed.append(recording['name'])
+            except OSError:
+                changed.append(recording['name'])
+
+        return changed
+
+
+    def recording_ids_of(self, recording: Optional[Union[str, Sequence[str]]]) -> Optional[List[int]]:
+
+        '''
+        positions of the recordings by name, None for all of them
+        '''
+
+        if recording is None:
+            return None
+
+        names = [recording] if isinstance(recording, str) else list(recording)
+        missing = [name for name in names if name not in self.recording_ids]
+        if missing:
+            raise KeyError(f'recordings not in the index: {", ".join(missing)}')
+
+        return [self.recording_ids[name] for name in names]
+
+
+    def speaker_ids_of(self, speaker) -> Optional[List[int]]:
+
+        '''
+        positions of the speaker labels, None for all of them, a label can also be given as a string, e.g. '1' for the speaker 1
+        '''
+
+        if speaker is None:
+            return None
+
+        wanted = {str(label) for label in ([speaker] if isinstance(speaker, (str, int)) else speaker)}
+
+        return [idx for idx, label in enumerate(self.speakers) if str(label) in wanted]
+
+
+    def select(self, table: IntervalTable, recording, speaker, start, end, min_confidence, contained) -> np.ndarray:
+        return table.select(
+            recordings=self.recording_ids_of(recording),
+            speakers=self.speaker_ids_of(speaker),
+            start=parse_time(start),
+            end=parse_time(end),
+            min_confidence=min_confidence,
+            contained=contained,
+        )
+
+
+    def to_dicts(self, table: IntervalTable, rows: np.ndarray, text_field: str) -> List[Dict]:
+
+        '''
+        the rows as dicts, every column is gathered for all the rows at once, reading the memory-mapped columns row by row is far slower,
+        the texts are sliced from a memoryview since every slice of a np.memmap builds a new memmap object
+        '''
+
+        text_ids = table.text_id[rows]
+        text_begin, text_end = table.offsets[text_ids].tolist(), table.offsets[text_ids + 1].tolist()
+        text_bytes = memoryview(table.text_bytes)
+
+        return [
+            {
+                'recording': self.recordings[recording]['name'],
+                'speaker': self.speakers[speaker],
+                'channel': self.channels[channel],
+                text_field: str(text_bytes[first:last], 'utf-8'),
+                'time_begin': begin,
+                'time_end': end,
+                'confidence': confidence,
+            }
+            for recording, speaker, channel, first, last, begin, end, confidence in zip(
+                table.recording[rows].tolist(),
+                table.speaker[rows].tolist(),
+                table.channel[rows].tolist(),
+                text_begin,
+                text_end,
+                table.begin[rows].tolist(),
+                table.end[rows].tolist(),
+                table.confidence[rows].tolist(),
+            )
+        ]
+
+
+    def words(
+        self,
+        recording: Union[str, Sequence[str]]=None,
+        speaker=None,
+        start: Union[str, float]=float('-inf'),
+        end: Union[str, float]=float('inf'),
+        min_confidence: float=None,
+        contained: bool=False,
+    ) -> List[Dict]:
+
+        '''
+        the words overlapping the time range, e.g. words('CHDIR_495', speaker=1, start='01:20:00', end='01:25:00')
+        ---
+        recording: name or names of the recordings, None for all of them
+        speaker: label or labels of the speakers, None for all of them
+        start, end: seconds or [hh:]mm:ss timestamps
+        min_confidence: leave out the words of lower confidence
+        contained: only the words lying entirely within the range
+        ---
+        returns: {"recording", "speaker", "channel", "word", "time_begin", "time_end", "confidence"} per word, in time order per recording
+        '''
+
+        rows = self.select(self.word_table, recording, speaker, start, end, min_confidence, contained)
+
+        return self.to_dicts(self.word_table, rows, 'word')
+
+
+    def segments(
+        self,
+        recording: Union[str, Sequence[str]]=None,
+        speaker=None,
+        start: Union[str, float]=float('-inf'),
+        end: Union[str, float]=float('inf'),
+        min_confidence: float=None,
+        contained: bool=False,
+    ) -> List[Dict]:
+
+        '''
+        the segments overlapping the time range, same arguments as words
+        ---
+        returns: {"recording", "speaker", "channel", "transcription", "time_begin", "time_end", "confidence", "num_words"} per segment
+        '''
+
+        rows = self.select(self.segment_table, recording, speaker, start, end, min_confidence, contained)
+
+        segments = self.to_dicts(self.segment_table, rows, 'transcription')
+        for segment, num_words in zip(segments, self.segment_table.parent[rows].tolist()):
+            segment['num_words'] = num_words
+
+        return segments
+
+
+    @staticmethod
+    def write_table(table_dir: str, columns: Dict[str, np.ndarray], texts: List[bytes]) -> None:
+
+        '''
+        sort the rows by recording, speaker and begin, cut them into blocks and save the columns
+        '''
+
+        os.makedirs(table_dir, exist_ok=True)
+
+        order = np.lexsort((columns['begin'], columns['speaker'], columns['recording']))
+        columns = {name: values[order] for name, values in columns.items()}
+        columns['text_id'] = order.astype(np.int64)
+
+        # a block starts wherever the recording or the speaker changes
+        key = columns['recording'].astype(np.int64) * (int(columns['speaker'].max(initial=0)) + 1) + columns['speaker']
+        starts = np.flatnonzero(np.diff(key, prepend=-1)) if len(key) else np.zeros(0, dtype=np.int64)
+        stops = np.append(starts[1:], len(key))
+
+        max_end = np.empty_like(columns['end'])
+        for first, last in zip(starts, stops):
+            max_end[first:last] = np.maximum.accumulate(columns['end'][first:last])
+        columns['max_end'] = max_end
+
+        blocks = np.stack([columns['recording'][starts], columns['speaker'][starts], starts, stops], axis=1).astype(np.int64) if len(starts) else np.zeros((0, 4), dtype=np.int64)
+        np.save(os.path.join(table_dir, 'blocks.npy'), blocks)
+
+        columns['offsets'] = np.concatenate([[0], np.cumsum([len(text) for text in texts], dtype=np.int64)]).astype(np.int64)
+        with open(os.path.join(table_dir, 'text.bin'), 'wb') as f:
+            f.write(b''.join(texts))
+
+        for name in COLUMNS:
+            np.save(os.path.join(table_dir, f'{name}.npy'), columns[name])
+
+
+    @staticmethod
+    def build(response_paths: Sequence[str], index_dir: str, names: Sequence[str]=None) -> 'ResponseIndex':
+
+        '''
+        index the responses, each one is streamed once with ijson and its prediction_raw is skipped over
+        ---
+        response_paths: the json responses of whisper zero, one per recording
+        index_dir: the directory to write the index into, replaced if it exists
+        names: the names the recordings are queried by, defaults to the file names without the extension
+        ---
+        returns: the opened index
+        '''
+
+        names = list(names) if names is not None else [os.path.splitext(os.path.basename(path))[0] for path in response_paths]
+        if len(names) != len(response_paths):
+            raise ValueError(f'{len(names)} names for {len(response_paths)} responses')
+        if len(set(names)) != len(names):
+            raise ValueError('the recording names are not unique, pass names explicitly')
+
+        speakers, channels = {}, {}
+        recordings = []
+        segments = {name: array('d') for name in ('begin', 'end', 'confidence')}
+        segments.update({name: array('q') for name in ('recording', 'speaker', 'channel', 'parent')})
+        words = {name: array('d') for name in ('begin', 'end', 'confidence')}
+        words.update({name: array('q') for name in ('recording', 'speaker', 'channel', 'parent')})
+        segment_texts, word_texts = [], []
+
+        def label_id(labels: Dict, label) -> int:
+            # json keys cannot tell 1 from '1', the labels are kept in a list by their json encoding
+            return labels.setdefault(json.dumps(label), len(labels))
+
+        for recording_id, (name, path) in enumerate(zip(names, tqdm(response_paths, desc='responses'))):
+            recordings.append(dict(name=name, source=os.path.abspath(path), **ResponseIndex.signature(path)))
+
+            with open(path, 'rb') as f:
+                for segment in ijson.items(f, 'prediction.item', use_float=True):
+                    speaker = label_id(speakers, segment.get('speaker'))
+                    channel = label_id(channels, segment.get('channel'))
+                    segment_row = len(segment_texts)
+
+                    for word in segment.get('words', []):
+                        words['begin'].append(word['time_begin'])
+                        words['end'].append(word['time_end'])
+                        words['confidence'].append(word.get('confidence', float('nan')))
+                        words['recording'].append(recording_id)
+                        words['speaker'].append(speaker)
+                        words['channel'].append(channel)
+                        words['parent'].append(segment_row)
+                        word_texts.append(word['word'].encode('utf-8'))
+
+                    segments['begin'].append(segment['time_begin'])
+                    segments['end'].append(segment['time_end'])
+                    segments['confidence'].append(segment.get('confidence', float('nan')))
+                    segments['recording'].append(recording_id)
+                    segments['speaker'].append(speaker)
+                    segments['channel'].append(channel)
+                    segments['parent'].append(len(segment.get('words', [])))
+                    segment_texts.append(segment.get('transcription', '').encode('utf-8'))
+
+        def to_numpy(columns: Dict[str, array]) -> Dict[str, np.ndarray]:
+            return {
+                name: np.frombuffer(values, dtype=np.float64) if values.typecode == 'd' else np.frombuffer(values, dtype=np.int64).astype(np.int32)
+                for name, values in columns.items() if name != 'parent'
+            }
+
+        segment_columns = to_numpy(segments)
+        segment_columns['parent'] = np.frombuffer(segments['parent'], dtype=np.int64)
+
+        # the words point to the row of their segment once the segments are sorted
+        segment_order = np.lexsort((segment_columns['begin'], segment_columns['speaker'], segment_columns['recording']))
+        segment_rank = np.empty(len(segment_order), dtype=np.int64)
+        segment_rank[segment_order] = np.arange(len(segment_order))
+
+        word_columns = to_numpy(words)
+        word_columns['parent'] = segment_rank[np.frombuffer(words['parent'], dtype=np.int64)]
+
+        # written next to the old index and swapped in at the end, a query never sees half an index
+        tmp_dir = f'{index_dir.rstrip(os.sep)}.tmp'
+        old_dir = f'{index_dir.rstrip(os.sep)}.old'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        ResponseIndex.write_table(os.path.join(tmp_dir, 'segments'), segment_columns, segment_texts)
+        ResponseIndex.write_table(os.path.join(tmp_dir, 'words'), word_columns, word_texts)
+
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': FORMAT_VERSION,
+                'recordings': recordings,
+                'speakers': [json.loads(label) for label in speakers],
+                'channels': [json.loads(label) for label in channels],
+                'num_segments': len(segment_texts),
+                'num_words': len(word_texts),
+            }, f, indent=2, ensure_ascii=False)
+
+        # the old index is only moved aside, it is deleted once the new one is in place and put back if the swap fails
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        try:
+            os.replace(tmp_dir, index_dir)
+        except OSError:
+            if os.path.exists(old_dir):
+                os.replace(old_dir, index_dir)
+            raise
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+        return ResponseIndex(index_dir)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='index the segments and words of whisper zero responses by time, speaker and confidence, and query them')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='index the responses, replacing the index if it exists')
+    build_parser.add_argument('index_dir')
+    build_parser.add_argument('responses', nargs='+', help='whisper zero json responses, one per recording, named by their file name')
+
+    query_parser = subparsers.add_parser('query', help='print the matching words or segments as json lines')
+    query_parser.add_argument('index_dir')
+    query_parser.add_argument('--recording', action='append', default=None, help='recording name, repeat for several, all by default')
+    query_parser.add_argument('--speaker', action='append', default=None, help='speaker label, repeat for several, all by default')
+    query_parser.add_argument('--start', default='-inf', help='seconds or [hh:]mm:ss')
+    query_parser.add_argument('--end', default='inf', help='seconds or [hh:]mm:ss')
+    query_parser.add_argument('--min-confidence', type=float, default=None)
+    query_parser.add_argument('--contained', action='store_true', help='only what lies entirely within the range')
+    query_parser.add_argument('--segments', action='store_true', help='return the segments instead of the words')
+    query_parser.add_argument('--text', action='store_true', help='print the text joined instead of the json lines')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = ResponseIndex.build(args.responses, args.index_dir)
+        print(f'{len(index.recordings)} recordings, {len(index.segment_table)} segments, {len(index.word_table)} words indexed in {args.index_dir}')
+    else:
+        index = ResponseIndex(args.index_dir)
+
+        stale = index.stale()
+        if stale:
+            logging.getLogger('WARNING').warning(f'the responses of {", ".join(stale)} changed since the index was built, rebuild it')
+
+        started = time.perf_counter()
+        query = index.segments if args.segments else index.words
+        results = query(
+            recording=args.recording,
+            speaker=args.speaker,
+            start=args.start,
+            end=args.end,
+            min_confidence=args.min_confidence,
+            contained=args.contained,
+        )
+        elapsed = time.perf_counter() - started
+
+        if args.text and args.segments:
+            print(' '.join(result['transcription'] for result in results))
+        elif args.text:
+            print(''.join(result['word'] for result in results).strip())
+        else:
+            for result in results:
+                print(json.dumps(result, ensure_ascii=False))
+
+        # kept off stdout so the json lines can be piped on
+        print(f'{len(results)} results in {elapsed * 1000:.2f} ms', file=sys.stderr)
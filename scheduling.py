@@ -0,0 +1,90 @@
+"""
+Order the transcription jobs by the duration of their audio and estimate how long the run will take
+
+the durations come from the manifest, or from the audio file header when the manifest has none, the audio is never decoded,
+with several requests in flight, starting the longest clips first keeps a few long clips from being the last ones running
+"""
+
+import os
+import json
+import heapq
+from typing import Callable, Dict, List, Optional
+
+from request_telemetry import audio_duration
+
+# policy -> sort key of a (manifest position, duration) job, the manifest position breaks the ties so the order is deterministic
+POLICIES: Dict[str, Callable] = {
+    'manifest': lambda job: job[0],
+    'longest_first': lambda job: (-job[1], job[0]),
+    'shortest_first': lambda job: (job[1], job[0]),
+}
+
+# seconds of request per second of audio assumed when there is no earlier telemetry to go by, rough
+DEFAULT_RTF = 0.25
+
+
+def clip_duration(entry: Dict, audio_root_path: str='') -> float:
+
+    '''
+    returns: the duration of the clip from the manifest entry, else from the header of its audio file, 0.0 if neither is readable
+    '''
+
+    duration = entry.get('duration')
+    if duration is None:
+        duration = audio_duration(os.path.join(audio_root_path, entry['audio_filepath']))
+
+    return float(duration or 0.0)
+
+
+def order_jobs(entries: List[Dict], durations: List[float], policy: str='longest_first') -> List[int]:
+
+    '''
+    returns: the positions of the entries in the order they should be sent
+    '''
+
+    if policy not in POLICIES:
+        raise ValueError(f'unknown schedule {policy}, expects one of {", ".join(POLICIES)}')
+
+    jobs = sorted(zip(range(len(entries)), durations), key=POLICIES[policy])
+
+    return [idx for idx, _ in jobs]
+
+
+def previous_rtf(telemetry_path: str) -> Optional[float]:
+
+    '''
+    returns: the median real-time factor of the earlier run summarised at telemetry_path, None if there is none
+    '''
+
+    try:
+        with open(telemetry_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['rtf']['p50']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def estimate_makespan(durations: List[float], rtf: float, workers: int, requests_per_second: float=0.0) -> float:
+
+    '''
+    simulate the run with every clip taking rtf * duration seconds, each clip goes to the first free worker in the given order and
+    no earlier than the rate limit allows
+    ---
+    durations: of the clips in the order they are sent
+    workers: number of requests in flight
+    ---
+    returns: the expected wall clock seconds of the run
+    '''
+
+    free_at = [0.0] * max(1, workers)
+    makespan = 0.0
+
+    for idx, duration in enumerate(durations):
+        start = heapq.heappop(free_at)
+        if requests_per_second > 0:
+            start = max(start, idx / requests_per_second)
+
+        end = start + rtf * duration
+        heapq.heappush(free_at, end)
+        makespan = max(makespan, end)
+
+    return makespan
@@ -0,0 +1,254 @@
+"""
+Cut the long recording into utterance clips from the word level timestamps of ExtractSingleWord and write their NeMo manifest
+
+the words are grouped into utterances at the pauses, and every clip is sliced straight out of the memory-mapped pcm data of the recording,
+nothing is decoded or read beyond the frames of the clips
+"""
+
+import os
+import wave
+import struct
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from typing import Callable, List, Tuple
+
+from word_store import WordTimestampStore, is_word_store
+from manifest_io import load_manifest, write_manifest
+
+
+def find_data_chunk(audio_filepath: str) -> Tuple[int, int]:
+
+    '''
+    walk the riff chunks of the wav file for its pcm data
+    ---
+    returns: the byte offset and the size of the data chunk
+    '''
+
+    with open(audio_filepath, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f'{audio_filepath} is not a riff wav file')
+
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f'{audio_filepath} has no data chunk')
+
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                # a data chunk still being recorded can claim more bytes than the file has
+                return f.tell(), min(chunk_size, os.path.getsize(audio_filepath) - f.tell())
+
+            # the chunks are padded to an even size
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+class SegmentLongAudio:
+
+    '''
+    group the words into utterances and cut the utterance clips out of the long recording
+
+    a new utterance starts after a pause longer than max_pause, or when the next word would take the utterance past max_duration,
+    every clip is padded on both sides by up to padding seconds without reaching into the pause before the neighbouring utterance
+    '''
+
+    def __init__(
+        self,
+        audio_filepath: str,
+        word_level_manifest: str,
+        output_dir: str,
+        output_manifest: str,
+        max_pause: float=0.5,
+        max_duration: float=20.0,
+        min_duration: float=0.0,
+        padding: float=0.1,
+        workers: int=4,
+    ) -> None:
+
+        '''
+        audio_filepath: the long recording, a pcm wav file
+        word_level_manifest: the word level manifest from ExtractSingleWord, or a word store directory
+        output_dir: directory the clips are written to, created if missing
+        output_manifest: nemo manifest of the clips, the audio_filepath of a clip is relative to the directory of the manifest
+        max_pause: seconds of silence between two words that ends an utterance
+        max_duration: seconds of words an utterance is kept within, a single longer word is an utterance of its own
+        min_duration: utterances shorter than this are left out
+        padding: seconds of audio kept before the first and after the last word of a clip
+        workers: number of threads writing the clips
+        '''
+
+        self.audio_filepath = audio_filepath
+        self.word_level_manifest = word_level_manifest
+        self.output_dir = output_dir
+        self.output_manifest = output_manifest
+        self.max_pause = max_pause
+        self.max_duration = max_duration
+        self.min_duration = min_duration
+        self.padding = max(0.0, padding)
+        self.workers = max(1, workers)
+
+
+    def load_words(self) -> Tuple[np.ndarray, np.ndarray, Callable[[int], str]]:
+
+        '''
+        loads the word timestamps, either from the json manifest or memory-mapped from a word store directory (see word_store.py)
+        ---
+        returns: the start and end times of the words and a function giving the text of word idx
+        '''
+
+        if is_word_store(self.word_level_manifest):
+            store = WordTimestampStore(self.word_level_manifest)
+            return np.asarray(store.start), np.asarray(store.end), store.text
+
+        words = load_manifest(self.word_level_manifest)
+        word_start = np.fromiter((word['start'] for word in words), dtype=np.float64, count=len(words))
+        word_end = np.fromiter((word['end'] for word in words), dtype=np.float64, count=len(words))
+
+        return word_start, word_end, lambda idx: words[idx]['text']
+
+
+    def group_words(self, word_start: np.ndarray, word_end: np.ndarray) -> List[np.ndarray]:
+
+        '''
+        returns: the indices of the words of every utterance, in time order
+        '''
+
+        order = np.argsort(word_start, kind='stable')
+        start, end = word_start[order], word_end[order]
+
+        utterances = []
+        first = 0
+        # the latest end so far, a word can end after the next one starts
+        reach = end[0] if len(order) else 0.0
+
+        for idx in range(1, len(order)):
+            if start[idx] - reach > self.max_pause or max(reach, end[idx]) - start[first] > self.max_duration:
+                utterances.append(order[first:idx])
+                first = idx
+                reach = end[idx]
+            else:
+                reach = max(reach, end[idx])
+
+        if len(order):
+            utterances.append(order[first:])
+
+        return utterances
+
+
+    def plan_clips(self, word_start: np.ndarray, word_end: np.ndarray, duration: float) -> List[Tuple[np.ndarray, float, float]]:
+
+        '''
+        returns: for every utterance, the indices of its words and the start and end of its clip in seconds
+        '''
+
+        # words timed past the end of the recording have no audio to cut
+        inside = np.flatnonzero(word_start < duration)
+        if len(inside) < len(word_start):
+            logging.getLogger('WARNING').warning(f'{len(word_start) - len(inside)} words start past the end of the audio at {duration:.3f}s, they are left out')
+
+        utterances = [inside[words] for words in self.group_words(word_start[inside], word_end[inside])]
+        bounds = [(float(word_start[words].min()), float(word_end[words].max())) for words in utterances]
+
+        clips = []
+        for idx, (words, (start, end)) in enumerate(zip(utterances, bounds)):
+            # pad into at most half of the pause to the neighbouring utterance, so the clips never overlap
+            lower = (bounds[idx - 1][1] + start) / 2 if idx > 0 else 0.0
+            upper = (end + bounds[idx + 1][0]) / 2 if idx < len(bounds) - 1 else duration
+
+            clip_start = max(lower, start - self.padding) if lower <= start else start
+            clip_end = min(min(upper, end + self.padding) if upper >= end else end, duration)
+
+            if clip_end <= clip_start or clip_end - clip_start < self.min_duration:
+                continue
+
+            clips.append((words, clip_start, clip_end))
+
+        return clips
+
+
+    def segment(self) -> int:
+
+        '''
+        main method to write the clips and their manifest
+        ---
+        returns: the number of clips written
+        '''
+
+        with wave.open(self.audio_filepath, 'rb') as w:
+            channels, sample_width, sample_rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+
+        data_offset, data_size = find_data_chunk(self.audio_filepath)
+        frame_bytes = channels * sample_width
+        num_frames = data_size // frame_bytes
+        duration = num_frames / sample_rate
+
+        word_start, word_end, get_text = self.load_words()
+        clips = self.plan_clips(word_start, word_end, duration)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(self.audio_filepath))[0]
+        manifest_dir = os.path.dirname(os.path.abspath(self.output_manifest))
+        os.makedirs(manifest_dir, exist_ok=True)
+
+        # the clips are cut on whole frames, the manifest times are those of the frames
+        frames = [
+            (int(round(clip_start * sample_rate)), min(num_frames, int(round(clip_end * sample_rate))))
+            for _, clip_start, clip_end in clips
+        ]
+
+        # only the pages of the clips being written are read in, np.memmap cannot map an empty data chunk
+        pcm = np.memmap(self.audio_filepath, dtype=np.uint8, mode='r', offset=data_offset, shape=(num_frames * frame_bytes,)) if num_frames else None
+
+        def write_clip(idx: int, first_frame: int, last_frame: int) -> str:
+            clip_filepath = os.path.join(self.output_dir, f'{stem}_{idx:06d}.wav')
+
+            with wave.open(clip_filepath, 'wb') as dst:
+                dst.setnchannels(channels)
+                dst.setsampwidth(sample_width)
+                dst.setframerate(sample_rate)
+                # a view into the mapped file, the frames are copied once, into the clip file
+                dst.writeframes(memoryview(pcm[first_frame * frame_bytes:last_frame * frame_bytes]))
+
+            return clip_filepath
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(write_clip, idx, first_frame, last_frame) for idx, (first_frame, last_frame) in enumerate(frames)]
+            clip_filepaths = [future.result() for future in tqdm(futures)]
+
+        del pcm
+
+        entries = (
+            {
+                'audio_filepath': os.path.relpath(clip_filepath, manifest_dir),
+                'duration': round((last_frame - first_frame) / sample_rate, 3),
+                'text': ' '.join(get_text(int(word)).strip() for word in words).strip(),
+                'start': round(first_frame / sample_rate, 3),
+                'end': round(last_frame / sample_rate, 3),
+            }
+            for clip_filepath, (words, _, _), (first_frame, last_frame) in zip(clip_filepaths, clips, frames)
+        )
+
+        return write_manifest(self.output_manifest, entries)
+
+
+    def __call__(self) -> int:
+        return self.segment()
+
+
+if __name__ == '__main__':
+
+    ROOT = '/datasets/mms/transcribed/mms_transcribed_batch_2/test_split'
+
+    AUDIO = 'CHDIR_495_2022-05-07_19.wav'
+    WORD_LEVEL_MANIFEST = 'CHDIR_495_2022-05-07_19_word_level.json'
+    OUTPUT_DIR = 'CHDIR_495_2022-05-07_19_clips'
+    OUTPUT_MANIFEST = 'CHDIR_495_2022-05-07_19_clips_manifest.json'
+
+    s = SegmentLongAudio(
+        audio_filepath=os.path.join(ROOT, AUDIO),
+        word_level_manifest=os.path.join(ROOT, WORD_LEVEL_MANIFEST),
+        output_dir=os.path.join(ROOT, OUTPUT_DIR),
+        output_manifest=os.path.join(ROOT, OUTPUT_MANIFEST),
+    )()
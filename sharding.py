@@ -0,0 +1,259 @@
+"""
+Split the batch transcription of a manifest over independent workers (machines, job array tasks) and merge their outputs back
+
+every entry goes to the shard given by a stable hash of its audio_filepath, so each worker picks its own entries out of the same input manifest
+without talking to the others, and the merge puts the responses back in manifest order, the merged file is the same whatever the number of shards
+"""
+
+import os
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+from tqdm import tqdm
+from typing import Dict, Iterable, Iterator, List
+
+from jsonl_checkpoint import write_json_list
+from manifest_io import dumps, iter_manifest, loads, write_manifest
+
+KEY = 'audio_filepath'
+
+# number of missing or duplicated keys listed in a merge error
+MAX_REPORTED = 10
+
+
+def shard_of(audio_filepath: str, num_shards: int) -> int:
+
+    '''
+    shard of an entry from the blake2b hash of its audio filepath, unlike hash() it is the same in every process, machine and python version
+    '''
+
+    digest = hashlib.blake2b(audio_filepath.encode('utf-8'), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'big') % num_shards
+
+
+def check_shard(shard_index: int, num_shards: int) -> None:
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(f'shard {shard_index} of {num_shards} is out of range, expects 0 <= shard_index < num_shards')
+
+
+def select_shard(entries: Iterable[Dict], shard_index: int, num_shards: int) -> List[Dict]:
+
+    '''
+    returns: the entries of the given shard, in manifest order
+    '''
+
+    check_shard(shard_index, num_shards)
+
+    if num_shards == 1:
+        return list(entries)
+
+    return [entry for entry in entries if shard_of(entry[KEY], num_shards) == shard_index]
+
+
+def shard_path(path: str, shard_index: int, num_shards: int) -> str:
+
+    '''
+    name of the file of one shard, e.g. output.json -> output.shard-00003-of-00016.json
+    '''
+
+    root, ext = os.path.splitext(path)
+
+    return f'{root}.shard-{shard_index:05d}-of-{num_shards:05d}{ext}'
+
+
+def split_manifest(manifest_path: str, num_shards: int, output_dir: str) -> List[str]:
+
+    '''
+    write the shards of the manifest as their own manifests, for workers that should not read the whole input manifest
+    ---
+    returns: the paths of the shard manifests
+    '''
+
+    check_shard(0, num_shards)
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards = [[] for _ in range(num_shards)]
+    for entry in iter_manifest(manifest_path):
+        shards[shard_of(entry[KEY], num_shards)].append(entry)
+
+    paths = []
+    for shard_index, entries in enumerate(shards):
+        paths.append(shard_path(os.path.join(output_dir, os.path.basename(manifest_path)), shard_index, num_shards))
+        write_manifest(paths[-1], entries)
+
+    return paths
+
+
+class ShardMerger:
+
+    '''
+    merge the outputs of the shard workers into one output in the order of the input manifest
+
+    a shard output is either the json list written at the end of BatchTranscribeAudio or its jsonl checkpoint, for a shard that did not finish,
+    the responses are collected into one temporary jsonl and only their byte offsets are kept in memory
+    '''
+
+    def __init__(self, manifest_path: str, shard_paths: List[str], output_path: str, allow_missing: bool=False) -> None:
+
+        '''
+        manifest_path: the input manifest the shards were taken from, gives the order of the output
+        shard_paths: the outputs of all the shards, json lists or jsonl checkpoints
+        output_path: the merged output, a json list in the format of BatchTranscribeAudio
+        allow_missing: write the merged output without the missing entries instead of raising
+        '''
+
+        self.manifest_path = manifest_path
+        self.shard_paths = shard_paths
+        self.output_path = output_path
+        self.allow_missing = allow_missing
+
+
+    @staticmethod
+    def iter_shard(shard_path: str) -> Iterator[Dict]:
+
+        '''
+        yield the responses of a shard output, a json list is streamed with ijson, anything else is read as json lines
+        '''
+
+        with open(shard_path, 'rb') as f:
+            head = f.read(64).lstrip()
+
+        if head.startswith(b'['):
+            import ijson
+
+            with open(shard_path, 'rb') as f:
+                # floats are kept as floats, so they are written back exactly as before
+                yield from ijson.items(f, 'item', use_float=True)
+            return
+
+        with open(shard_path, 'rb') as f:
+            for line in f:
+                try:
+                    yield loads(line)
+                except ValueError:
+                    # the torn last line of a checkpoint, the same as JSONLCheckpoint.load_completed
+                    if line.strip():
+                        logging.getLogger('WARNING').warning(f'{shard_path}: skipping an unreadable line')
+
+
+    def collect(self, f_tmp) -> Dict:
+
+        '''
+        copy the responses of every shard into the temporary jsonl
+        ---
+        returns: audio filepath -> list of (shard path, byte offset), more than one for a duplicated entry
+        '''
+
+        offsets = {}
+        offset = 0
+
+        for path in tqdm(self.shard_paths, desc='shards'):
+            for response in self.iter_shard(path):
+                line = dumps(response) + b'\n'
+                f_tmp.write(line)
+                offsets.setdefault(response[KEY], []).append((path, offset))
+                offset += len(line)
+
+        return offsets
+
+
+    def merge(self) -> Dict:
+
+        '''
+        check that every entry of the manifest is in exactly one shard, then write the merged output in manifest order
+
+        an entry found twice is an error, even with the same response, as it means the shards were not cut the same way
+        ---
+        returns: the merge report, number of entries and shards, the missing, duplicated and unexpected audio filepaths
+        '''
+
+        keys = [entry[KEY] for entry in iter_manifest(self.manifest_path)]
+
+        with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.output_path))) as f_tmp:
+            offsets = self.collect(f_tmp)
+
+            manifest_keys = set(keys)
+            duplicated_in_manifest = len(keys) - len(manifest_keys)
+            missing = [key for key in keys if key not in offsets]
+            duplicates = {key: [path for path, _ in found] for key, found in offsets.items() if len(found) > 1}
+            unexpected = [key for key in offsets if key not in manifest_keys]
+
+            report = {
+                'entries': len(keys),
+                'shards': len(self.shard_paths),
+                'merged': len(keys) - len(missing),
+                'missing': missing,
+                'duplicates': duplicates,
+                'unexpected': unexpected,
+            }
+
+            if duplicated_in_manifest:
+                raise ValueError(f'{self.manifest_path} lists {duplicated_in_manifest} audio filepaths more than once, the merge order is ambiguous')
+
+            if duplicates:
+                listed = ', '.join(f'{key} ({", ".join(paths)})' for key, paths in list(duplicates.items())[:MAX_REPORTED])
+                raise ValueError(f'{len(duplicates)} entries are in more than one shard output: {listed}')
+
+            if missing and not self.allow_missing:
+                raise ValueError(f'{len(missing)} entries are missing from the shard outputs: {", ".join(missing[:MAX_REPORTED])}')
+
+            if unexpected:
+                logging.getLogger('WARNING').warning(f'{len(unexpected)} responses are not in {self.manifest_path} and are left out')
+
+            def records() -> Iterator[Dict]:
+                for key in keys:
+                    if key in offsets:
+                        f_tmp.seek(offsets[key][0][1])
+                        yield loads(f_tmp.readline())
+
+            f_tmp.flush()
+            write_json_list(self.output_path, records())
+
+        return report
+
+
+    def __call__(self) -> Dict:
+        return self.merge()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='split a manifest into shards for independent transcription workers, or merge their outputs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    split_parser = subparsers.add_parser('split', help='write the shard manifests')
+    split_parser.add_argument('manifest', help='input nemo manifest')
+    split_parser.add_argument('num_shards', type=int)
+    split_parser.add_argument('output_dir')
+
+    merge_parser = subparsers.add_parser('merge', help='merge the shard outputs in manifest order')
+    merge_parser.add_argument('manifest', help='input nemo manifest the shards were taken from')
+    merge_parser.add_argument('output', help='merged output json')
+    merge_parser.add_argument('shards', nargs='+', help='shard outputs, json lists or jsonl checkpoints')
+    merge_parser.add_argument('--allow-missing', action='store_true', help='write the merged output even if some entries are missing')
+    merge_parser.add_argument('--report', default=None, help='write the merge report as json')
+
+    args = parser.parse_args()
+
+    if args.command == 'split':
+        for path in split_manifest(args.manifest, args.num_shards, args.output_dir):
+            print(path)
+    else:
+        report = ShardMerger(
+            manifest_path=args.manifest,
+            shard_paths=args.shards,
+            output_path=args.output,
+            allow_missing=args.allow_missing,
+        )()
+
+        if args.report is not None:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+
+        print(
+            f"merged {report['merged']} of {report['entries']} entries from {report['shards']} shards into {args.output}, "
+            f"{len(report['missing'])} missing, {len(report['unexpected'])} unexpected"
+        )
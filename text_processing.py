@@ -1,23 +1,121 @@
 from nltk import flatten
 from num2words import num2words
-from text2digits import text2digits
-from hanziconv import HanziConv
+from hanziconv.charmap import simplified_charmap, traditional_charmap
+import os
+import sys
 import string
+import pickle
+import hashlib
 import re
-import decimal
 import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List
+
+from number_words import EnglishNumberConverter
 
 # Setup logging in a nice readable format
 logging.basicConfig(level=logging.INFO,
                     format='[%(levelname)5s][%(asctime)s][%(name)s]: %(message)s',
                     datefmt='%H:%M:%S')
 
+# compiled once at import instead of being looked up on every call
+LATIN_PATTERN = re.compile(r'[^A-Za-z0-9#\' ]+')
+TAGALOG_PATTERN = re.compile(r'[^A-Za-z0-9#Ññ\' ]+')
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+
+def compile_char_ranges(ranges) -> tuple:
+
+    '''
+    build the regexes of a list of (bottom, top) code point ranges
+    ---
+    returns: a pattern matching a single character in the ranges, and a pattern matching the runs of characters outside of them
+    '''
+
+    char_class = ''.join(f'{re.escape(chr(bottom))}-{re.escape(chr(top))}' for bottom, top in ranges)
+
+    return re.compile(f'[{char_class}]'), re.compile(f'[^{char_class}]+')
+
+
+# the compiled cjk translate tables are cached here, building them walks every cjk code point
+TABLE_CACHE_DIR = os.environ.get('WHISPER_ZERO_TABLE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'whisper_zero'))
+TABLE_CACHE_VERSION = 1
+
+# script conversion -> (from charmap, to charmap) of HanziConv
+CJK_CONVERSIONS = {
+    None: ('', ''),
+    'simplified': (traditional_charmap, simplified_charmap),
+    'traditional': (simplified_charmap, traditional_charmap),
+}
+
+
+def build_cjk_map(ranges, conversion: str=None) -> dict:
+
+    '''
+    map every character in the ranges to its converted form followed by a space
+    ---
+    conversion: None, 'simplified' or 'traditional', converted like HanziConv which takes the first match in its charmap
+    '''
+
+    from_map, to_map = CJK_CONVERSIONS[conversion]
+    converted = {}
+    for from_char, to_char in zip(from_map, to_map):
+        converted.setdefault(from_char, to_char)
+
+    return {
+        code: converted.get(chr(code), chr(code)) + ' '
+        for bottom, top in ranges
+        for code in range(bottom, top + 1)
+    }
+
+
+def load_cjk_table(ranges, conversion: str=None) -> list:
+
+    '''
+    one str.translate table that keeps the characters in the ranges, converted and followed by a space, and deletes every other character
+
+    the character map is cached on disk under TABLE_CACHE_DIR, keyed by the ranges and the charmaps so a change to either rebuilds it
+    ---
+    returns: a list indexed by code point, usable with str.translate
+    '''
+
+    from_map, to_map = CJK_CONVERSIONS[conversion]
+    digest = hashlib.sha256(repr((TABLE_CACHE_VERSION, list(ranges), from_map, to_map)).encode('utf-8')).hexdigest()[:16]
+    cache_path = os.path.join(TABLE_CACHE_DIR, f'cjk_{conversion or "none"}_{digest}.pickle')
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cjk_map = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        cjk_map = build_cjk_map(ranges, conversion)
+
+        try:
+            os.makedirs(TABLE_CACHE_DIR, exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(cjk_map, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.getLogger('WARNING').warning(f'could not cache the cjk table in {TABLE_CACHE_DIR}: {e}')
+
+    # a list covering every code point, None deletes the character
+    table = [None] * (sys.maxunicode + 1)
+    for code, replacement in cjk_map.items():
+        table[code] = replacement
+
+    return table
+
+
 class TextPostProcessingManager:
     
     '''
     takes in the label of the data and language code and pass it to the corresponding language/data preprocessor. The main class that the calling code will be interacting with.
     '''
 
+    # one processor per language shared by every manager, the processors hold no per-call state
+    processors = {}
+
     def __init__(self, label: str=None, language: str='') -> None:
        
         '''
@@ -29,43 +127,29 @@ class TextPostProcessingManager:
         self.language = language
 
 
+    def get_processor(self):
+
+        '''
+        returns: the processor of the language, built on first use
+        '''
+
+        processor = self.processors.get(self.language)
+
+        if processor is None:
+            # defaults to base, no processing, if text_preprocessing_language is ''
+            processor = LANGUAGE_PROCESSORS.get(self.language, TextPostProcessingBase)()
+            self.processors[self.language] = processor
+
+        return processor
+
+
     def process_data(self, text: str) -> str:
         
         '''
         depending on the label and language, does the corresponding post-processing of the text 
         '''
 
-        if self.language == 'en':
-            return TextPostProcessingEN().process(text=text)
-        
-        elif self.language == 'zh':
-            # does not matter if the chinese is simplified or traditional
-            return TextPostProcessingCJK().process(text=text)
-        
-        elif self.language == 'zh_cmn':
-            return TextPostProcessingZHSimplified().process(text=text)
-            
-        elif self.language == 'zh_yue':
-            return TextPostProcessingZHTraditional().process(text=text)
-        
-        elif self.language == 'vi':
-            return TextPostProcessingVI().process(text=text)
-        
-        elif self.language == 'ta':
-            return TextPostProcessingTA().process(text=text)
-        
-        elif self.language == 'tl':
-            return TextPostProcessingTL().process(text=text)
-        
-        elif self.language == 'id' or self.language == 'ms':
-            return TextPostProcessingLatin().process(text=text)
-        
-        elif self.language == 'th':
-            return TextPostProcessingTH().process(text=text)
-        
-        else:
-            # defaults to base, no processing, if text_preprocessing_language is ''
-            return TextPostProcessingBase().process(text=text)
+        return self.get_processor().process(text=text)
 
 
 class TextPostProcessingBase:
@@ -109,7 +193,7 @@ class TextPostProcessingLatin:
         text = text_en.decode()
         
         # keep only certain characters
-        clean_text = re.sub(r'[^A-Za-z0-9#\' ]+', ' ', text)
+        clean_text = LATIN_PATTERN.sub(' ', text)
         
         # replace hyphen with space because hyphen cannot be heard
         clean_text = clean_text.replace('-', ' ')
@@ -129,20 +213,15 @@ class TextPostProcessingEN(TextPostProcessingLatin):
 
     def __init__(self) -> None:
         super().__init__()
+        self.number_converter = EnglishNumberConverter()
 
 
     def get_number_from_text(self, text: str) -> str:
         '''
-        convert all the text form of the number into digit form to suit whisper decoding
+        convert all the text form of the number into digit form to suit whisper decoding, the text is left as it is if the numbers are malformed
         '''
-        try:
-            t2d = text2digits.Text2Digits()
-            text = t2d.convert(text)
-        except decimal.InvalidOperation:
-            logging.warning("decimal.InvalidOperation ERROR, skipping transformation ...")
-            pass
 
-        return text
+        return self.number_converter(text)
 
     
     def process(self, text: str) -> str:
@@ -156,7 +235,7 @@ class TextPostProcessingEN(TextPostProcessingLatin):
         text = text_en.decode()
         
         # keep only certain characters
-        clean_text = re.sub(r'[^A-Za-z0-9#\' ]+', ' ', text)
+        clean_text = LATIN_PATTERN.sub(' ', text)
 
         # convert text form of number to digits
         clean_text = self.get_number_from_text(text=clean_text)
@@ -188,7 +267,7 @@ class TextPostProcessingTL(TextPostProcessingLatin):
         '''
         
         # keep only certain characters, extends the n tilde in the tagalog language
-        clean_text = re.sub(r'[^A-Za-z0-9#Ññ\' ]+', ' ', text)
+        clean_text = TAGALOG_PATTERN.sub(' ', text)
         
         # replace hyphen with space because hyphen cannot be heard
         clean_text = clean_text.replace('-', ' ')
@@ -229,13 +308,11 @@ class TextPostProcessingCJK:
             (0x2F800, 0x2FA1F)
         ]
 
+        # the ranges compiled into character classes, filtering a whole string in one regex call
+        self.cjk_char, self.cjk_drop = compile_char_ranges(self.cjk_ranges)
+
     def is_cjk(self, char):
-        
-        char = ord(char)
-        for bottom, top in self.cjk_ranges:
-            if char >= bottom and char <= top:
-                return True
-        return False
+        return self.cjk_char.match(char) is not None
 
 
     def process(self, text: str) -> str:
@@ -244,7 +321,7 @@ class TextPostProcessingCJK:
         main method to filter the cjk annotation
         '''
 
-        return ' '.join(filter(self.is_cjk, text))
+        return ' '.join(self.cjk_drop.sub('', text))
 
 
 class TextPostProcessingZHTraditional(TextPostProcessingCJK):
@@ -255,14 +332,16 @@ class TextPostProcessingZHTraditional(TextPostProcessingCJK):
 
     def __init__(self) -> None:
         super().__init__()
+        self.cjk_table = load_cjk_table(self.cjk_ranges, conversion='traditional')
 
     
     def process(self, text: str) -> str:
         '''
-        main method to filter the cjk annotation
+        main method to filter the cjk annotation, same as HanziConv.toTraditional(' '.join(<cjk characters of the text>))
         '''
 
-        return HanziConv.toTraditional(' '.join(filter(self.is_cjk, text)))
+        # every kept character is followed by a space, drop the last one
+        return text.translate(self.cjk_table)[:-1]
     
 
 class TextPostProcessingZHSimplified(TextPostProcessingCJK):
@@ -273,14 +352,16 @@ class TextPostProcessingZHSimplified(TextPostProcessingCJK):
 
     def __init__(self) -> None:
         super().__init__()
+        self.cjk_table = load_cjk_table(self.cjk_ranges, conversion='simplified')
 
     
     def process(self, text: str) -> str:
         '''
-        main method to filter the cjk annotation
+        main method to filter the cjk annotation, same as HanziConv.toSimplified(' '.join(<cjk characters of the text>))
         '''
 
-        return HanziConv.toSimplified(' '.join(filter(self.is_cjk, text)))
+        # every kept character is followed by a space, drop the last one
+        return text.translate(self.cjk_table)[:-1]
     
 
 class TextPostProcessingTH:
@@ -301,12 +382,11 @@ class TextPostProcessingTH:
             (0x0E50, 0x0E5B)
         ]
 
+        # the ranges compiled into character classes, filtering a whole string in one regex call
+        self.th_char, self.th_drop = compile_char_ranges(self.th_ranges)
+
     def is_th(self, char):
-        char = ord(char)
-        for bottom, top in self.th_ranges:
-            if char >= bottom and char <= top:
-                return True
-        return False
+        return self.th_char.match(char) is not None
 
 
     def process(self, text: str) -> str:
@@ -314,7 +394,7 @@ class TextPostProcessingTH:
         main method to filter the thai annotation
         '''
 
-        return ' '.join(filter(self.is_th, text))
+        return ' '.join(self.th_drop.sub('', text))
     
 
 class TextPostProcessingVI:
@@ -354,18 +434,17 @@ class TextPostProcessingVI:
             (0x1EA0, 0x1EF9)
         ]
 
+        # the ranges compiled into character classes, filtering a whole string in one regex call
+        self.vi_char, self.vi_drop = compile_char_ranges(self.vi_ranges)
+
 
     def remove_punct_en(self, sentence: str) -> str:
         sentence = sentence.replace('-', ' ')
-        return sentence.translate(str.maketrans('', '', string.punctuation))
+        return sentence.translate(PUNCTUATION_TABLE)
     
 
     def is_vi(self, char):
-        char = ord(char)
-        for bottom, top in self.vi_ranges:
-            if char >= bottom and char <= top:
-                return True
-        return False
+        return self.vi_char.match(char) is not None
 
 
     def process(self, text: str) -> str:
@@ -374,7 +453,7 @@ class TextPostProcessingVI:
         main method to filter the vietnamese annotation
         '''
 
-        text = self.remove_punct_en(''.join(filter(self.is_vi, text.upper())))
+        text = self.remove_punct_en(self.vi_drop.sub('', text.upper()))
 
         return text.lstrip().rstrip()
     
@@ -411,13 +490,11 @@ class TextPostProcessingTA:
             (0x0BF0, 0x0BFA)
         ]
 
+        # the ranges compiled into character classes, filtering a whole string in one regex call
+        self.ta_char, self.ta_drop = compile_char_ranges(self.ta_ranges)
+
     def is_ta(self, char):
-       
-        char = ord(char)
-        for bottom, top in self.ta_ranges:
-            if char >= bottom and char <= top:
-                return True
-        return False
+        return self.ta_char.match(char) is not None
 
 
     def process(self, text: str) -> str:
@@ -426,13 +503,153 @@ class TextPostProcessingTA:
         main method to filter the tamil annotation
         '''
 
-        text = ''.join(filter(self.is_ta, text))
+        text = self.ta_drop.sub('', text)
         # text = ' '.join(filter(self.is_ta, text))
 
         return text.lstrip().rstrip()
         #return text.strip()
 
 
+# language code -> processor class, any other language gets TextPostProcessingBase
+LANGUAGE_PROCESSORS = {
+    'en': TextPostProcessingEN,
+    # does not matter if the chinese is simplified or traditional
+    'zh': TextPostProcessingCJK,
+    'zh_cmn': TextPostProcessingZHSimplified,
+    'zh_yue': TextPostProcessingZHTraditional,
+    'vi': TextPostProcessingVI,
+    'ta': TextPostProcessingTA,
+    'tl': TextPostProcessingTL,
+    'id': TextPostProcessingLatin,
+    'ms': TextPostProcessingLatin,
+    'th': TextPostProcessingTH,
+}
+
+
+def normalise_texts(language: str, texts: List[str]) -> List[str]:
+
+    '''
+    normalise a chunk of texts, runs in the worker processes of BatchTextPostProcessor
+    '''
+
+    manager = TextPostProcessingManager(language=language)
+
+    return [manager.process_data(text=text) for text in texts]
+
+
+class BatchTextPostProcessor:
+
+    '''
+    normalises many texts at once, the distinct texts not seen before are fanned out over a process pool in chunks and the results come back in input order
+
+    an lru memo keeps the recent results so repeated texts, like templated call centre utterances, are only normalised once
+    '''
+
+    def __init__(self, language: str='', workers: int=None, chunk_size: int=256, memo_size: int=100_000, min_parallel: int=1000) -> None:
+
+        '''
+        language: language of the dataset, as for TextPostProcessingManager
+        workers: number of worker processes, None for one per cpu, 0 or 1 normalises in this process
+        chunk_size: number of texts sent to a worker at once
+        memo_size: number of normalised texts remembered, 0 disables the memo
+        min_parallel: batches with fewer new texts than this are normalised in this process, the pool is not worth starting for them
+        '''
+
+        self.language = language
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.memo_size = memo_size
+        self.min_parallel = min_parallel
+
+        self.memo = OrderedDict()
+        self.executor = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def remember(self, text: str, normalised: str) -> None:
+        if self.memo_size <= 0:
+            return
+
+        self.memo[text] = normalised
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+
+    def normalise_new(self, texts: List[str]) -> List[str]:
+
+        '''
+        normalise texts that are not in the memo, in the pool if there are enough of them
+        '''
+
+        if self.workers <= 1 or len(texts) < self.min_parallel:
+            return normalise_texts(self.language, texts)
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        chunks = [texts[idx:idx + self.chunk_size] for idx in range(0, len(texts), self.chunk_size)]
+        normalised = []
+        for chunk in self.executor.map(normalise_texts, [self.language] * len(chunks), chunks):
+            normalised.extend(chunk)
+
+        return normalised
+
+
+    def process_batch(self, texts: Iterable[str]) -> List[str]:
+
+        '''
+        normalise the texts
+        ---
+        texts: any iterable of strings
+        ---
+        returns: the normalised texts in the same order
+        '''
+
+        texts = list(texts)
+        results = {}
+        new_texts = []
+
+        for text in texts:
+            if text in results:
+                continue
+
+            if text in self.memo:
+                self.memo.move_to_end(text)
+                results[text] = self.memo[text]
+            else:
+                # placeholder so duplicates within the batch are sent once
+                results[text] = None
+                new_texts.append(text)
+
+        self.hits += len(texts) - len(new_texts)
+        self.misses += len(new_texts)
+
+        for text, normalised in zip(new_texts, self.normalise_new(new_texts)):
+            results[text] = normalised
+            self.remember(text, normalised)
+
+        return [results[text] for text in texts]
+
+
+    def stats(self) -> dict:
+        return {'memo_hits': self.hits, 'normalised': self.misses, 'memo_entries': len(self.memo)}
+
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+    def __enter__(self) -> 'BatchTextPostProcessor':
+        return self
+
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
 if __name__ == "__main__":
 
     pass
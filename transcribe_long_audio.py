@@ -1,8 +1,13 @@
 import os
 import json
-import requests
 from dotenv import load_dotenv
 
+from gladia_client import GladiaClient
+from chunk_long_audio import ChunkedTranscribeLongAudio
+from response_cache import ResponseCache
+from audio_encoder import AudioEncoder
+from request_telemetry import RequestTelemetry
+
 # load the environment variable
 load_dotenv()
 
@@ -10,27 +15,62 @@ API_KEY = os.environ.get("API_KEY")
 AUDIO_FILEPATH = '/datasets/long_2_id.wav'
 OUTPUT = 'output.json'
 
+# json summary of the request latencies, sizes, statuses and retries, with the prometheus text file (.prom) next to it
+TELEMETRY_PATH = 'output.telemetry.json'
+
+# directory of the response cache, set to None to disable it, CACHE_MODE is one of 'use', 'bypass' or 'refresh'
+CACHE_DIR = '/datasets/.whisper_zero_cache'
+CACHE_MODE = 'use'
+
+# split the audio at quiet points into chunks of about this many minutes and transcribe them concurrently, set to None to upload the whole file in one request
+CHUNK_MINUTES = 10.0
+OVERLAP_SECONDS = 2.0
+MAX_IN_FLIGHT = 4
+
+# compress the audio before the upload, 'flac' is lossless, 'ogg', 'opus' or 'mp3' are smaller but lossy, set to None to upload the raw wav
+ENCODE_CODEC = 'flac'
+
 # FILENAME = 'CHDIR_497_2022-07-15'
 
 # AUDIO_FILEPATH = f'/datasets/mms/transcribed/mms_transcribed_batch_2/test/{FILENAME}.wav'
 
 # OUTPUT = f'/datasets/mms/transcribed/mms_transcribed_batch_2/test_split/{FILENAME}_whisper_zero.json'
 
-headers = {
-    'x-gladia-key': API_KEY,
-}
+cache = ResponseCache(cache_dir=CACHE_DIR, mode=CACHE_MODE) if CACHE_DIR is not None else None
+encoder = AudioEncoder(codec=ENCODE_CODEC, workers=MAX_IN_FLIGHT) if ENCODE_CODEC is not None else None
+telemetry = RequestTelemetry()
+
+if CHUNK_MINUTES is not None:
+    client = GladiaClient(api_key=API_KEY, pool_maxsize=MAX_IN_FLIGHT, cache=cache, encoder=encoder, telemetry=telemetry)
+
+    response_json = ChunkedTranscribeLongAudio(
+        client=client,
+        language='indonesian',
+        chunk_minutes=CHUNK_MINUTES,
+        overlap_seconds=OVERLAP_SECONDS,
+        max_in_flight=MAX_IN_FLIGHT,
+    )(audio_filepath=AUDIO_FILEPATH)
+else:
+    # long audio takes a while to come back, allow up to an hour for the response
+    client = GladiaClient(api_key=API_KEY, read_timeout=3600.0, cache=cache, encoder=encoder, telemetry=telemetry)
+
+    response_json = client.transcribe(
+        input_audio_path=AUDIO_FILEPATH,
+        language='indonesian',
+        language_behaviour='manual',
+        toggle_diarization=True,
+    )
+
+if cache is not None:
+    print(f'response cache: {cache.stats()}')
+
+if encoder is not None:
+    print(f'audio encoding: {encoder.stats()}')
 
-with open(AUDIO_FILEPATH, 'rb') as f:
-    files = {
-        'audio': (AUDIO_FILEPATH, f, 'audio/wav'),
-        # 'audio_url': (None, 'http://files.gladia.io/example/audio-transcription/split_infinity.wav'),
-        'toggle_diarization': (None, True),
-        'language_behaviour': 'manual',
-        'language': 'indonesian'
-    }
+summary = telemetry.write(summary_path=TELEMETRY_PATH)
+print(f"requests: {summary['requests']}, failed: {summary['failed']}, retries: {summary['retries']}, audio seconds per second: {summary['audio_seconds_per_second']}")
 
-    response = requests.post('https://api.gladia.io/audio/text/audio-transcription/', headers=headers, files=files)
-    print(response.json())
+client.close()
 
-    with open(OUTPUT, "w") as f:
-        json.dump(response.json(), f, indent=2)
\ No newline at end of file
+with open(OUTPUT, "w") as f:
+    json.dump(response_json, f, indent=2)
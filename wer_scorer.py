@@ -0,0 +1,236 @@
+"""
+Stream a NeMo manifest with predictions and score it in one pass, the error counts of every utterance are computed once and summed into WER, CER and MER
+"""
+
+import os
+import re
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from rapidfuzz.distance import Levenshtein
+from tqdm import tqdm
+from typing import Dict, Iterator, List, Tuple
+
+from manifest_io import ManifestWriter, iter_manifest
+
+# jiwer's default transforms: wer_default (RemoveMultipleSpaces, Strip, ReduceToListOfListOfWords) and cer_default (Strip, ReduceToListOfListOfChars)
+MULTIPLE_SPACES_PATTERN = re.compile(r'\s\s+')
+COUNT_KEYS = ('hits', 'substitutions', 'deletions', 'insertions')
+
+
+def to_words(text: str) -> List[str]:
+    return [word for word in MULTIPLE_SPACES_PATTERN.sub(' ', text).strip().split(' ') if len(word) >= 1]
+
+
+def count_edits(reference, hypothesis) -> Dict[str, int]:
+
+    '''
+    hits, substitutions, deletions and insertions between two sequences, counted from the same levenshtein edit operations as jiwer
+    '''
+
+    substitutions = deletions = insertions = 0
+
+    for op in Levenshtein.editops(reference, hypothesis):
+        if op.tag == 'replace':
+            substitutions += 1
+        elif op.tag == 'delete':
+            deletions += 1
+        elif op.tag == 'insert':
+            insertions += 1
+
+    return {
+        'hits': len(reference) - substitutions - deletions,
+        'substitutions': substitutions,
+        'deletions': deletions,
+        'insertions': insertions,
+    }
+
+
+def score_utterance(reference: str, hypothesis: str) -> Dict[str, Dict[str, int]]:
+
+    '''
+    word and character level error counts of a single utterance, the reference must not be empty as in jiwer
+    ---
+    returns: {'word': counts, 'char': counts}, counts also hold the number of reference and hypothesis tokens
+    '''
+
+    ref_words, hyp_words = to_words(reference), to_words(hypothesis)
+    ref_chars, hyp_chars = reference.strip(), hypothesis.strip()
+
+    if not reference or not ref_words or not ref_chars:
+        raise ValueError(f'empty reference, jiwer cannot score it: {reference!r}')
+
+    word = count_edits(ref_words, hyp_words)
+    word.update(ref_len=len(ref_words), hyp_len=len(hyp_words))
+
+    char = count_edits(ref_chars, hyp_chars)
+    char.update(ref_len=len(ref_chars), hyp_len=len(hyp_chars))
+
+    return {'word': word, 'char': char}
+
+
+def score_chunk(pairs: List[Tuple[str, str]]) -> List[Dict[str, Dict[str, int]]]:
+
+    '''
+    score a chunk of (reference, hypothesis) pairs, runs in the worker processes of StreamingWERScorer
+    '''
+
+    return [score_utterance(reference, hypothesis) for reference, hypothesis in pairs]
+
+
+def error_rates(word: Dict[str, int], char: Dict[str, int]) -> Dict[str, float]:
+
+    '''
+    returns: wer, mer, cer and word accuracy from the summed counts, with the same formulas as jiwer
+    '''
+
+    word_errors = word['substitutions'] + word['deletions'] + word['insertions']
+    char_errors = char['substitutions'] + char['deletions'] + char['insertions']
+
+    wer = float(word_errors) / float(word['hits'] + word['substitutions'] + word['deletions'])
+    mer = float(word_errors) / float(word['hits'] + word['substitutions'] + word['deletions'] + word['insertions'])
+    cer = float(char_errors) / float(char['hits'] + char['substitutions'] + char['deletions'])
+
+    return {'wer': wer, 'mer': mer, 'cer': cer, 'word_acc': 1 - mer}
+
+
+class StreamingWERScorer:
+
+    '''
+    scores a manifest without loading it, chunks of utterances are scored in worker processes and summed in manifest order
+    '''
+
+    def __init__(
+        self,
+        manifest_path: str,
+        ref_key: str='text',
+        pred_key: str='pred_str',
+        workers: int=None,
+        chunk_size: int=512,
+        utterance_output_path: str=None,
+        keep_counts: bool=False,
+    ) -> None:
+
+        '''
+        manifest_path: NeMo manifest with the reference and the prediction of every utterance
+        ref_key, pred_key: the keys of the reference and the prediction
+        workers: number of scoring processes, None for one per cpu, 0 or 1 scores in this process
+        chunk_size: number of utterances sent to a worker at once
+        utterance_output_path: if set, the counts and error rates of every utterance are written there as json lines
+        keep_counts: keep the errors and reference length of every utterance in self.counts, for the bootstrap of wer_bootstrap
+        '''
+
+        self.manifest_path = manifest_path
+        self.ref_key = ref_key
+        self.pred_key = pred_key
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.utterance_output_path = utterance_output_path
+        self.keep_counts = keep_counts
+
+        # level -> {'errors': [...], 'ref_len': [...]} in manifest order, filled by score when keep_counts is set
+        self.counts = {level: {'errors': [], 'ref_len': []} for level in ('word', 'char')}
+
+
+    def iter_chunks(self) -> Iterator[List[Dict]]:
+
+        '''
+        read the manifest line by line in chunks of entries
+        '''
+
+        chunk = []
+
+        for entry in iter_manifest(self.manifest_path):
+            chunk.append(entry)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+
+    def iter_scored(self) -> Iterator[Tuple[List[Dict], List[Dict]]]:
+
+        '''
+        returns: (entries, scores) of every chunk in manifest order, at most two chunks per worker are in flight
+        '''
+
+        pairs_of = lambda entries: [(entry[self.ref_key], entry[self.pred_key]) for entry in entries]
+
+        if self.workers <= 1:
+            for entries in self.iter_chunks():
+                yield entries, score_chunk(pairs_of(entries))
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = deque()
+
+            for entries in self.iter_chunks():
+                in_flight.append((entries, executor.submit(score_chunk, pairs_of(entries))))
+
+                if len(in_flight) >= 2 * self.workers:
+                    entries, future = in_flight.popleft()
+                    yield entries, future.result()
+
+            while in_flight:
+                entries, future = in_flight.popleft()
+                yield entries, future.result()
+
+
+    def score(self) -> Dict:
+
+        '''
+        score the whole manifest
+        ---
+        returns: the error rates plus the summed 'word' and 'char' counts and the number of utterances
+        '''
+
+        totals = {level: dict.fromkeys(COUNT_KEYS + ('ref_len', 'hyp_len'), 0) for level in ('word', 'char')}
+        num_utterances = 0
+
+        f_out = ManifestWriter(self.utterance_output_path) if self.utterance_output_path else None
+
+        try:
+            with tqdm(unit='utt') as progress:
+                for entries, scores in self.iter_scored():
+                    for entry, score in zip(entries, scores):
+                        for level, counts in score.items():
+                            for key, value in counts.items():
+                                totals[level][key] += value
+
+                            if self.keep_counts:
+                                self.counts[level]['errors'].append(counts['substitutions'] + counts['deletions'] + counts['insertions'])
+                                self.counts[level]['ref_len'].append(counts['ref_len'])
+
+                        if f_out is not None:
+                            utterance = {'audio_filepath': entry.get('audio_filepath'), **score, **error_rates(score['word'], score['char'])}
+                            f_out.write(utterance)
+
+                    num_utterances += len(entries)
+                    progress.update(len(entries))
+        finally:
+            if f_out is not None:
+                f_out.close()
+
+        if num_utterances == 0:
+            raise ValueError(f'no utterances to score in {self.manifest_path}')
+
+        return {**error_rates(totals['word'], totals['char']), **totals, 'num_utterances': num_utterances}
+
+
+    def __call__(self) -> Dict:
+        return self.score()
+
+
+if __name__ == '__main__':
+
+    ROOT = '/datasets/mms/transcribed/mms_transcribed_batch_2/test_split/'
+    MANIFEST_PATH = 'test_manifest_495_with_pred.json'
+    UTTERANCE_OUTPUT_PATH = 'test_manifest_495_utterance_scores.json'
+
+    result = StreamingWERScorer(
+        manifest_path=os.path.join(ROOT, MANIFEST_PATH),
+        utterance_output_path=os.path.join(ROOT, UTTERANCE_OUTPUT_PATH),
+    )()
+    print(json.dumps(result, indent=2))
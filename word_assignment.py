@@ -0,0 +1,135 @@
+"""
+Assign the word level timestamps to reference segments with a sorted index and binary search instead of walking the words one by one
+"""
+
+import numpy as np
+from typing import Tuple
+
+# midpoint: the word midpoint falls within [segment start, segment end)
+# start: the word start falls within [segment start, segment end)
+# max_overlap: every word goes to the single segment it overlaps the most
+ASSIGNMENT_RULES = ('midpoint', 'start', 'max_overlap')
+
+
+class WordSegmentAssigner:
+
+    '''
+    sorted index over the word start/end times, assigns the words to any number of reference segments in O((W + R) log W)
+
+    the reference segments can be in any order and can overlap each other, with the midpoint and start rules a word can then belong to several segments
+    '''
+
+    def __init__(self, word_start: np.ndarray, word_end: np.ndarray) -> None:
+
+        '''
+        word_start, word_end: start and end time of every word in seconds, in any order
+        '''
+
+        self.word_start = np.asarray(word_start, dtype=np.float64)
+        self.word_end = np.asarray(word_end, dtype=np.float64)
+
+        # one sorted view per rule key, built on first use
+        self.sorted_keys = {}
+        self.max_word_length = float((self.word_end - self.word_start).max()) if len(self.word_start) else 0.0
+
+
+    def sorted_by(self, rule: str) -> Tuple[np.ndarray, np.ndarray]:
+
+        '''
+        returns: the word order sorted by the time the rule looks at, and the sorted times
+        '''
+
+        if rule not in self.sorted_keys:
+            key = (self.word_start + self.word_end) / 2 if rule == 'midpoint' else self.word_start
+            order = np.argsort(key, kind='stable')
+            self.sorted_keys[rule] = (order, key[order])
+
+        return self.sorted_keys[rule]
+
+
+    @staticmethod
+    def expand_ranges(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+
+        '''
+        flatten the [lo, hi) range of every segment into (segment index, position) pairs without a python loop
+        '''
+
+        counts = np.maximum(hi - lo, 0)
+        segment_idx = np.repeat(np.arange(len(lo)), counts)
+        # position within each range, shifted to the start of the range
+        position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+
+        return segment_idx, position
+
+
+    @staticmethod
+    def to_offsets(segment_idx: np.ndarray, num_segments: int) -> np.ndarray:
+
+        '''
+        returns: offsets so that the words of segment r are word_idx[offsets[r]:offsets[r + 1]], segment_idx must be grouped
+        '''
+
+        offsets = np.zeros(num_segments + 1, dtype=np.int64)
+        np.cumsum(np.bincount(segment_idx, minlength=num_segments), out=offsets[1:])
+
+        return offsets
+
+
+    def assign(self, ref_start: np.ndarray, ref_end: np.ndarray, rule: str='midpoint') -> Tuple[np.ndarray, np.ndarray]:
+
+        '''
+        assign the words to the reference segments
+        ---
+        ref_start, ref_end: start and end time of every reference segment in seconds
+        rule: one of 'midpoint', 'start' or 'max_overlap'
+        ---
+        returns: (offsets, word_idx), the words of segment r are word_idx[offsets[r]:offsets[r + 1]] in time order
+        '''
+
+        if rule not in ASSIGNMENT_RULES:
+            raise ValueError(f'rule must be one of {ASSIGNMENT_RULES}, got {rule}')
+
+        ref_start = np.asarray(ref_start, dtype=np.float64)
+        ref_end = np.asarray(ref_end, dtype=np.float64)
+        num_segments = len(ref_start)
+
+        if rule in ('midpoint', 'start'):
+            order, keys = self.sorted_by(rule)
+            lo = np.searchsorted(keys, ref_start, side='left')
+            hi = np.searchsorted(keys, ref_end, side='left')
+            segment_idx, position = self.expand_ranges(lo, hi)
+
+            return self.to_offsets(segment_idx, num_segments), order[position]
+
+        # max_overlap: the candidates of a segment start before it ends and no earlier than the longest word before it starts
+        order, starts = self.sorted_by('start')
+        lo = np.searchsorted(starts, ref_start - self.max_word_length, side='left')
+        hi = np.searchsorted(starts, ref_end, side='left')
+        segment_idx, position = self.expand_ranges(lo, hi)
+        word_idx = order[position]
+
+        overlap = np.minimum(self.word_end[word_idx], ref_end[segment_idx]) - np.maximum(self.word_start[word_idx], ref_start[segment_idx])
+        keep = overlap > 0
+        segment_idx, position, overlap = segment_idx[keep], position[keep], overlap[keep]
+
+        if len(position) == 0:
+            return np.zeros(num_segments + 1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # group the candidates by word, the stable sort keeps the lowest segment index first among the ties
+        by_word = np.argsort(position, kind='stable')
+        segment_idx, position, overlap = segment_idx[by_word], position[by_word], overlap[by_word]
+
+        group_start = np.flatnonzero(np.concatenate([[True], position[1:] != position[:-1]]))
+        group_size = np.diff(np.append(group_start, len(position)))
+        is_best = overlap == np.repeat(np.maximum.reduceat(overlap, group_start), group_size)
+
+        # first best candidate of every word
+        best = np.flatnonzero(is_best)
+        best_group = np.repeat(np.arange(len(group_start)), group_size)[best]
+        best = best[np.concatenate([[True], best_group[1:] != best_group[:-1]])]
+        segment_idx, position = segment_idx[best], position[best]
+
+        # group by segment, the position in the sorted index keeps the words in time order
+        grouped = np.argsort(segment_idx.astype(np.int64) * len(order) + position, kind='stable')
+
+        return self.to_offsets(segment_idx[grouped], num_segments), order[position[grouped]]
@@ -0,0 +1,179 @@
+"""
+Columnar store of the word level timestamps, an alternative to the one json dict per word manifest written by ExtractSingleWord
+
+the store is a directory of numpy arrays plus a packed string table, all of them memory-mapped on load so nothing is parsed:
+
+    start.npy       float64, start time of every word
+    end.npy         float64, end time of every word
+    confidence.npy  float64, confidence of every word
+    flags.npy       uint8, which of the fields above were integers in the json, so the conversion back is exact
+    offsets.npy     int64, byte offsets of every word into text.bin, one more entry than the number of words
+    text.bin        the utf-8 text of all the words back to back
+    meta.json       format version and number of words
+"""
+
+import os
+import json
+import numpy as np
+from array import array
+from tqdm import tqdm
+from typing import Dict, Iterator
+
+from manifest_io import ManifestWriter
+
+FORMAT_VERSION = 1
+NUMERIC_FIELDS = ('start', 'end', 'confidence')
+
+
+class WordTimestampStore:
+
+    '''
+    read only view over a word store directory, behaves like a list of word dicts
+    '''
+
+    def __init__(self, store_dir: str) -> None:
+
+        '''
+        store_dir: the directory written by WordTimestampStore.from_jsonl
+        '''
+
+        self.store_dir = store_dir
+
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            meta = json.load(f)
+
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f'unsupported word store version {meta["version"]} in {store_dir}')
+
+        self.num_words = meta['num_words']
+        self.start = np.load(os.path.join(store_dir, 'start.npy'), mmap_mode='r')
+        self.end = np.load(os.path.join(store_dir, 'end.npy'), mmap_mode='r')
+        self.confidence = np.load(os.path.join(store_dir, 'confidence.npy'), mmap_mode='r')
+        self.flags = np.load(os.path.join(store_dir, 'flags.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, 'offsets.npy'), mmap_mode='r')
+
+        # np.memmap cannot map an empty file
+        text_path = os.path.join(store_dir, 'text.bin')
+        self.text_bytes = np.memmap(text_path, dtype=np.uint8, mode='r') if os.path.getsize(text_path) else np.zeros(0, dtype=np.uint8)
+
+
+    def __len__(self) -> int:
+        return self.num_words
+
+
+    def text(self, idx: int) -> str:
+
+        '''
+        returns: the text of a single word
+        '''
+
+        return self.text_bytes[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+
+    def __getitem__(self, idx: int) -> Dict:
+
+        '''
+        returns: a single word in the same dict form as the json manifest
+        '''
+
+        if idx < 0:
+            idx += self.num_words
+        if not 0 <= idx < self.num_words:
+            raise IndexError(f'word index {idx} out of range')
+
+        word = {'text': self.text(idx)}
+        flags = int(self.flags[idx])
+
+        for bit, field in enumerate(NUMERIC_FIELDS):
+            value = float(getattr(self, field)[idx])
+            word[field] = int(value) if flags & (1 << bit) else value
+
+        return word
+
+
+    def __iter__(self) -> Iterator[Dict]:
+        for idx in range(self.num_words):
+            yield self[idx]
+
+
+    @staticmethod
+    def from_jsonl(jsonl_path: str, store_dir: str) -> 'WordTimestampStore':
+
+        '''
+        convert the word level json manifest into a store, the manifest is read line by line and the columns are kept in compact arrays
+        ---
+        jsonl_path: word level manifest with one {"text", "start", "end", "confidence"} dict per line
+        store_dir: the directory to write the store into, created if it does not exist
+        ---
+        returns: the opened store
+        '''
+
+        os.makedirs(store_dir, exist_ok=True)
+
+        columns = {field: array('d') for field in NUMERIC_FIELDS}
+        flags = array('B')
+        offsets = array('q', [0])
+
+        with open(jsonl_path, 'rb') as f_in, open(os.path.join(store_dir, 'text.bin'), 'wb') as f_text:
+            for line in tqdm(f_in):
+                if not line.strip():
+                    continue
+
+                word = json.loads(line)
+                flag = 0
+
+                for bit, field in enumerate(NUMERIC_FIELDS):
+                    value = word[field]
+                    columns[field].append(value)
+                    if isinstance(value, int):
+                        flag |= 1 << bit
+
+                flags.append(flag)
+
+                text = word['text'].encode('utf-8')
+                f_text.write(text)
+                offsets.append(offsets[-1] + len(text))
+
+        for field in NUMERIC_FIELDS:
+            np.save(os.path.join(store_dir, f'{field}.npy'), np.frombuffer(columns[field], dtype=np.float64))
+        np.save(os.path.join(store_dir, 'flags.npy'), np.frombuffer(flags, dtype=np.uint8))
+        np.save(os.path.join(store_dir, 'offsets.npy'), np.frombuffer(offsets, dtype=np.int64))
+
+        # meta.json is written last, a store without it is incomplete
+        with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'num_words': len(flags)}, f)
+
+        return WordTimestampStore(store_dir)
+
+
+    def to_jsonl(self, jsonl_path: str) -> None:
+
+        '''
+        convert the store back into the word level json manifest, identical to the manifest it was built from, both are written by manifest_io
+        '''
+
+        with ManifestWriter(jsonl_path) as writer:
+            writer.write_many(tqdm(self))
+
+
+def is_word_store(path: str) -> bool:
+
+    '''
+    returns: whether the path is a word store directory rather than a json manifest
+    '''
+
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json'))
+
+
+if __name__ == '__main__':
+
+    ROOT = '/datasets/mms/transcribed/mms_transcribed_batch_2/test_split'
+
+    WORD_LEVEL_MANIFEST = 'CHDIR_495_2022-05-07_19_word_level.json'
+    WORD_STORE = 'CHDIR_495_2022-05-07_19_word_level.store'
+
+    store = WordTimestampStore.from_jsonl(
+        jsonl_path=os.path.join(ROOT, WORD_LEVEL_MANIFEST),
+        store_dir=os.path.join(ROOT, WORD_STORE),
+    )
+    print(f'{len(store)} words written to {store.store_dir}')